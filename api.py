@@ -1,56 +1,158 @@
-import os
+import time
 from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, List, Literal
 
-import aiohttp
 import uvicorn
 from dotenv import load_dotenv
-from fastapi import FastAPI, HTTPException, Response
-from tortoise import Tortoise
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import PlainTextResponse
+from pydantic import BaseModel
 
+from crn.db import close_db, init_db
+from crn.directory import StockDirectory
+from crn.http import STOCK_API, create_session
+from crn.metrics import METRICS, install_query_counter
 from crn.models import Stock, User
+from crn.persist import save_follows
 
 load_dotenv()
 
+MAX_BATCH_SIZE = 1000
+"""Maximum number of follows in one request to /add-stocks"""
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    await Tortoise.init(
-        db_url=os.getenv("DB_URL") or "sqlite://db.sqlite3",
-        modules={"models": ["crn.models"]},
-    )
-    await Tortoise.generate_schemas()
-    app.state.session = aiohttp.ClientSession()
+    install_query_counter()
+    await init_db()
+    app.state.session = create_session(STOCK_API)
+    app.state.stock_directory = StockDirectory()
+    await app.state.stock_directory.load()
+    METRICS.add_cache("stock_directory", app.state.stock_directory)
     yield
-    await Tortoise.close_connections()
+    await close_db()
     await app.state.session.close()
 
 
 app = FastAPI(lifespan=lifespan)
 
 
+@app.middleware("http")
+async def record_request(
+    request: Request, call_next: Callable[[Request], Awaitable[Response]]
+) -> Response:
+    start = time.perf_counter()
+    response = await call_next(request)
+    # The route template rather than the path, so that ids don't become labels
+    route = request.scope.get("route")
+    METRICS.observe(
+        "crn_http_request_seconds",
+        time.perf_counter() - start,
+        path=getattr(route, "path", "unmatched"),
+        status=response.status_code,
+    )
+    return response
+
+
 @app.get("/")
 async def index() -> Response:
     return Response(status_code=200, content="CRN API v1.0")
 
 
+@app.get("/metrics")
+async def metrics() -> Response:
+    return PlainTextResponse(METRICS.render())
+
+
 @app.get("/add-stock")
 async def add_stock(user_id: str, stock_id: str) -> Response:
-    async with app.state.session.get(
-        f"https://stock-api.seriaati.xyz/stocks/{stock_id}"
-    ) as resp:
-        if resp.status != 200:
-            raise HTTPException(status_code=404, detail="stock not found")
-        data = await resp.json()
-
-    stock_name = data["name"]
+    directory: StockDirectory = app.state.stock_directory
+    found = await directory.resolve_id(app.state.session, stock_id)
+    if found is None:
+        raise HTTPException(status_code=404, detail="stock not found")
+
+    stock_name = found[1]
     user = await User.get_or_none(id=user_id)
     if user is None:
         raise HTTPException(status_code=404, detail="user not found")
 
-    stock, _ = await Stock.get_or_create(id=stock_id, name=stock_name)
+    stock, created = await Stock.get_or_create(
+        id=stock_id, defaults={"name": stock_name}
+    )
+    if created:
+        directory.update([(stock_id, stock_name)])
     await user.stocks.add(stock)
     return Response(status_code=200, content="stock added")
 
 
+class Subscription(BaseModel):
+    user_id: str
+    stock_ids: List[str]
+
+
+class SubscriptionBatch(BaseModel):
+    subscriptions: List[Subscription]
+
+
+class SubscriptionResult(BaseModel):
+    user_id: str
+    stock_id: str
+    status: Literal[200, 404, 502]
+    detail: str
+
+
+class SubscriptionBatchResult(BaseModel):
+    results: List[SubscriptionResult]
+
+
+@app.post("/add-stocks")
+async def add_stocks(batch: SubscriptionBatch) -> SubscriptionBatchResult:
+    """
+    Make users follow many stocks at once, each follow gets the result
+    /add-stock would have answered it with
+
+    Unknown stock ids are looked up concurrently, each once, then all the
+    follows are saved in one transaction.
+    """
+    follows = list(
+        dict.fromkeys(
+            (subscription.user_id, stock_id)
+            for subscription in batch.subscriptions
+            for stock_id in subscription.stock_ids
+        )
+    )
+    if len(follows) > MAX_BATCH_SIZE:
+        raise HTTPException(
+            status_code=413, detail=f"at most {MAX_BATCH_SIZE} stocks per request"
+        )
+
+    directory: StockDirectory = app.state.stock_directory
+    stocks = await directory.resolve_ids(
+        app.state.session, (stock_id for _, stock_id in follows)
+    )
+    names = {stock[0]: stock[1] for stock in stocks.values() if stock is not None}
+    users, _ = await save_follows(
+        [follow for follow in follows if follow[1] in names], names
+    )
+    directory.update(names.items())
+
+    results: List[SubscriptionResult] = []
+    for user_id, stock_id in follows:
+        if stock_id not in stocks:
+            status, detail = 502, "stock api unavailable"
+        elif stocks[stock_id] is None:
+            status, detail = 404, "stock not found"
+        elif user_id not in users:
+            status, detail = 404, "user not found"
+        else:
+            status, detail = 200, "stock added"
+        results.append(
+            SubscriptionResult(
+                user_id=user_id, stock_id=stock_id, status=status, detail=detail
+            )
+        )
+    return SubscriptionBatchResult(results=results)
+
+
 if __name__ == "__main__":
     uvicorn.run("api:app", port=4501, log_level="info")
@@ -0,0 +1,86 @@
+"""
+Backfill the revenue reports of past months, e.g.
+
+    python backfill.py 108/1 112/12
+    python backfill.py 108/1 112/12 --pages-dir pages --record
+    python backfill.py 108/1 112/12 --pages-dir pages --offline
+"""
+
+import argparse
+import asyncio
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from dotenv import load_dotenv
+from seria.logging import setup_logging
+
+from crn.backfill import Backfill, parse_period
+from crn.crawl import FetchScheduler
+from crn.db import close_db, init_db
+from crn.extract import EXTRACTORS
+from crn.http import CRAWL, create_session
+
+load_dotenv()
+
+
+async def run(args: argparse.Namespace) -> None:
+    await init_db()
+
+    session = create_session(CRAWL)
+    scheduler = None
+    if not args.offline:
+        scheduler = FetchScheduler(
+            session, concurrency=args.concurrency, rate=args.rate
+        )
+    try:
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            backfill = Backfill(
+                scheduler=scheduler,
+                pages_dir=args.pages_dir,
+                record=args.record,
+                workers=args.concurrency,
+                extractor=EXTRACTORS[args.extractor],
+                executor=executor,
+            )
+            progress = await backfill.run(args.start, args.end)
+    finally:
+        await session.close()
+        await close_db()
+
+    if progress.failed:
+        raise SystemExit(f"{progress.failed} pages failed, run again to retry them")
+
+
+parser = argparse.ArgumentParser(description="Backfill past monthly revenue reports")
+parser.add_argument("start", type=parse_period, help="first period, e.g. 108/1")
+parser.add_argument("end", type=parse_period, help="last period, e.g. 112/12")
+parser.add_argument(
+    "--pages-dir", type=Path, help="directory of recorded pages to read or record"
+)
+parser.add_argument(
+    "--offline", action="store_true", help="read pages from --pages-dir only"
+)
+parser.add_argument(
+    "--record", action="store_true", help="save fetched pages to --pages-dir"
+)
+parser.add_argument(
+    "--concurrency", type=int, default=4, help="pages processed concurrently"
+)
+parser.add_argument(
+    "--rate", type=float, default=0.5, help="requests per second sent to MOPS"
+)
+parser.add_argument(
+    "--workers", type=int, default=2, help="processes pages are parsed in"
+)
+parser.add_argument("--extractor", choices=sorted(EXTRACTORS), default="stream")
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    if (args.offline or args.record) and args.pages_dir is None:
+        parser.error("--offline and --record need --pages-dir")
+    if args.offline and args.record:
+        parser.error("--offline and --record can't be used together")
+
+    with setup_logging(logging.INFO, log_filename="backfill.log"):
+        asyncio.run(run(args))
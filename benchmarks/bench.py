@@ -0,0 +1,352 @@
+"""
+Benchmark the crawl -> persist -> notify pipeline against recorded MOPS pages
+
+Pages are replayed from a directory laid out like the one `backfill.py
+--record` writes, e.g. <pages-dir>/sii/t21sc03_112_9_0.html, by a local HTTP
+stub. Reports are saved to a fresh SQLite database, or the one at `--db-url`
+whose rows are deleted first, and notifications are sent to a stub LINE
+Notify endpoint. The stub can add `--latency` seconds to every
+page, like the round trip to MOPS, and the pages are also fetched one at a
+time and all at once to compare the two. Results are printed as JSON, e.g.
+
+    python backfill.py 112/9 112/9 --pages-dir fixtures --record
+    python -m benchmarks.bench 112/9 --pages-dir fixtures --output before.json
+    python -m benchmarks.bench 112/9 --pages-dir fixtures --compare before.json
+    python -m benchmarks.bench 112/9 --pages-dir fixtures \
+        --db-url postgres://localhost/bench
+"""
+
+import argparse
+import asyncio
+import cProfile
+import datetime
+import json
+import platform
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+import aiohttp
+from pypika import Table
+from tortoise import Tortoise
+
+from benchmarks.stubs import Stub
+from crn.backfill import get_recorded_path, parse_period
+from crn.crawl import (
+    PAGES,
+    FetchScheduler,
+    crawl_monthly_revenue_reports,
+    get_report_url,
+    parse_page,
+)
+from crn.db import close_db, init_db
+from crn.extract import EXTRACTORS
+from crn.followers import FollowerGraph
+from crn.metrics import METRICS, install_query_counter
+from crn.models import (
+    BackfilledPage,
+    CrawledPage,
+    PendingNotification,
+    RevenueReport,
+    Stock,
+    User,
+)
+from crn.notify import NotifyDispatcher, Outbox
+from crn.persist import save_revenue_reports
+
+STAGES = ("crawl", "persist", "notify")
+
+
+@contextmanager
+def measure(
+    results: Dict[str, Dict[str, float]],
+    stage: str,
+    stub: Stub,
+) -> Iterator[None]:
+    queries_before = METRICS.get("crn_db_queries_total")
+    requests_before = stub.requests
+    wall, cpu = time.perf_counter(), time.process_time()
+    yield
+    results[stage] = {
+        "wall_s": time.perf_counter() - wall,
+        # Includes the stubs, which run in this process, but not pages parsed
+        # in worker processes
+        "cpu_s": time.process_time() - cpu,
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "queries": METRICS.get("crn_db_queries_total") - queries_before,
+        "requests": stub.requests - requests_before,
+    }
+
+
+async def time_fetches(
+    base_url: str, period: Tuple[int, int], concurrency: int
+) -> Dict[str, float]:
+    """Seconds taken to fetch the pages of a period one at a time and at once"""
+    urls = [
+        get_report_url(company_type, *period, area, base_url)
+        for company_type, area in PAGES
+    ]
+    times: Dict[str, float] = {}
+    async with aiohttp.ClientSession() as session:
+        for name, limit in (("sequential_s", 1), ("concurrent_s", concurrency)):
+            scheduler = FetchScheduler(session, concurrency=limit)
+            start = time.perf_counter()
+            await scheduler.fetch_all(urls)
+            times[name] = time.perf_counter() - start
+    return times
+
+
+def load_stock_ids(
+    pages_dir: Path, period: Tuple[int, int], extractor: str
+) -> List[str]:
+    stock_ids: Set[str] = set()
+    for company_type, area in PAGES:
+        path = get_recorded_path(pages_dir, get_report_url(company_type, *period, area))
+        if path.exists():
+            rows = parse_page(path.read_bytes(), EXTRACTORS[extractor])
+            stock_ids.update(strings[0] for strings in rows)
+    return sorted(stock_ids)
+
+
+async def clear() -> None:
+    """Delete the rows left by an earlier run"""
+    conn = Tortoise.get_connection("default")
+    await conn.execute_query(str(conn.query_class.from_("user_stock").delete()))
+    for model in (
+        PendingNotification,
+        CrawledPage,
+        BackfilledPage,
+        RevenueReport,
+        Stock,
+        User,
+    ):
+        await model.all().delete()
+
+
+async def seed(args: argparse.Namespace, stock_ids: List[str]) -> None:
+    """Create the followed stocks and the users following them"""
+    rng = random.Random(args.seed)
+    await Stock.bulk_create(
+        [Stock(id=stock_id, name=stock_id) for stock_id in stock_ids]
+    )
+    await User.bulk_create(
+        [
+            User(
+                id=f"U{i:032d}",
+                line_notify_token=f"token-{i}",
+                digest_notifications=rng.random() < args.digest_ratio,
+            )
+            for i in range(args.users)
+        ]
+    )
+    follows = [
+        (f"U{i:032d}", stock_id)
+        for i in range(args.users)
+        for stock_id in rng.sample(stock_ids, min(args.follows, len(stock_ids)))
+    ]
+    conn = Tortoise.get_connection("default")
+    user_stock = Table("user_stock")
+    # Literal values work with the placeholders of SQLite and Postgres alike
+    insert = (
+        conn.query_class.into(user_stock)
+        .columns(user_stock.user_id, user_stock.stock_id)
+        .insert(*follows)
+    )
+    await conn.execute_query(str(insert))
+
+
+async def run_once(
+    args: argparse.Namespace,
+    stub: Stub,
+    base_url: str,
+    profiler: Optional[cProfile.Profile],
+) -> Dict[str, Any]:
+    stages: Dict[str, Dict[str, float]] = {}
+    with tempfile.TemporaryDirectory() as directory:
+        await init_db(args.db_url or f"sqlite://{directory}/bench.sqlite3")
+        if args.db_url:
+            await clear()
+        await seed(args, load_stock_ids(args.pages_dir, args.period, args.extractor))
+        followers = FollowerGraph()
+        await followers.load()
+
+        executor = ProcessPoolExecutor(args.workers) if args.workers else None
+        async with aiohttp.ClientSession() as session:
+            if profiler is not None:
+                profiler.enable()
+
+            with measure(stages, "crawl", stub):
+                result = await crawl_monthly_revenue_reports(
+                    session,
+                    *args.period,
+                    concurrency=args.concurrency,
+                    extractor=EXTRACTORS[args.extractor],
+                    executor=executor,
+                    incremental=True,
+                    base_url=base_url,
+                )
+
+            with measure(stages, "persist", stub):
+                await followers.sync()
+                saved = await save_revenue_reports(
+                    result.reports,
+                    result.pages,
+                    period=args.period,
+                    followers=followers,
+                )
+
+            pending = await PendingNotification.all().count()
+            outbox = Outbox(
+                NotifyDispatcher(
+                    session,
+                    workers=args.notify_workers,
+                    rate=args.notify_rate,
+                    burst=args.notify_workers,
+                    url=f"{base_url}/notify",
+                )
+            )
+            with measure(stages, "notify", stub):
+                while await outbox.drain_batch():
+                    pass
+
+            if profiler is not None:
+                profiler.disable()
+
+        if executor is not None:
+            executor.shutdown()
+        await close_db()
+
+    return {
+        "reports": len(saved),
+        "notifications": pending,
+        "stages": stages,
+    }
+
+
+def summarize(runs: List[Dict[str, Any]]) -> Dict[str, Dict[str, float]]:
+    """Median of every metric of every stage over the runs"""
+    return {
+        stage: {
+            metric: statistics.median(run["stages"][stage][metric] for run in runs)
+            for metric in runs[0]["stages"][stage]
+        }
+        for stage in STAGES
+    }
+
+
+def compare(summary: Dict[str, Dict[str, float]], baseline_path: Path) -> str:
+    baseline = json.loads(baseline_path.read_text())["summary"]
+    lines = [f"compared to {baseline_path}:"]
+    for stage in STAGES:
+        for metric, value in summary[stage].items():
+            old = baseline.get(stage, {}).get(metric)
+            if not old:
+                continue
+            lines.append(
+                f"  {stage}.{metric}: {old:g} -> {value:g} ({(value / old - 1) * 100:+.1f}%)"
+            )
+    return "\n".join(lines)
+
+
+def get_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    install_query_counter()
+
+    stub = Stub(args.pages_dir, latency=args.latency)
+    base_url = await stub.start()
+    profiler = cProfile.Profile() if args.profile else None
+    try:
+        fetches = [
+            await time_fetches(base_url, args.period, args.concurrency)
+            for _ in range(args.runs)
+        ]
+        runs = [
+            await run_once(args, stub, base_url, profiler if i == 0 else None)
+            for i in range(args.runs)
+        ]
+    finally:
+        await stub.runner.cleanup()
+
+    if profiler is not None:
+        profiler.dump_stats(args.profile)
+
+    return {
+        "commit": get_commit(),
+        "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "params": {
+            "period": "/".join(map(str, args.period)),
+            "users": args.users,
+            "follows": args.follows,
+            "digest_ratio": args.digest_ratio,
+            "concurrency": args.concurrency,
+            "workers": args.workers,
+            "notify_workers": args.notify_workers,
+            "notify_rate": args.notify_rate,
+            "extractor": args.extractor,
+            "latency": args.latency,
+            "db": (args.db_url or "sqlite").split(":", 1)[0],
+        },
+        "fetch": {
+            name: statistics.median(fetch[name] for fetch in fetches)
+            for name in fetches[0]
+        },
+        "runs": runs,
+        "summary": summarize(runs),
+    }
+
+
+parser = argparse.ArgumentParser(description="Benchmark the crawl pipeline")
+parser.add_argument("period", type=parse_period, help="recorded period, e.g. 112/9")
+parser.add_argument("--pages-dir", type=Path, required=True)
+parser.add_argument("--runs", type=int, default=3)
+parser.add_argument("--users", type=int, default=1000)
+parser.add_argument("--follows", type=int, default=20, help="stocks per user")
+parser.add_argument("--digest-ratio", type=float, default=0.1)
+parser.add_argument("--concurrency", type=int, default=4)
+parser.add_argument(
+    "--latency", type=float, default=0.0, help="seconds added to every page"
+)
+parser.add_argument(
+    "--workers", type=int, default=2, help="parser processes, 0 for threads"
+)
+parser.add_argument("--notify-workers", type=int, default=8)
+parser.add_argument(
+    "--notify-rate", type=float, default=1e6, help="notifications sent per second"
+)
+parser.add_argument("--extractor", choices=sorted(EXTRACTORS), default="stream")
+parser.add_argument("--seed", type=int, default=0)
+parser.add_argument(
+    "--db-url", help="a fresh SQLite file by default, its rows are deleted"
+)
+parser.add_argument("--output", type=Path, help="write the results here")
+parser.add_argument("--compare", type=Path, help="results of an earlier run")
+parser.add_argument("--profile", help="write cProfile stats of the first run here")
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    results = asyncio.run(run(args))
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        args.output.write_text(output)
+    else:
+        print(output)
+    if args.compare:
+        print(compare(results["summary"], args.compare), file=sys.stderr)
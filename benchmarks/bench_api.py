@@ -0,0 +1,149 @@
+"""
+Benchmark importing portfolios through the API, one /add-stock call per
+follow against batched /add-stocks calls
+
+The API is served in this process with a fresh SQLite database, stock ids are
+looked up from a local stub of the stock API that answers after a delay. Each
+mode imports the same number of follows with its own users and stock ids, so
+every lookup of both goes to the stub. Results are printed as JSON, e.g.
+
+    python -m benchmarks.bench_api --users 10 --stocks 100 --latency 0.02
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+from typing import Any, Dict, List, Tuple
+
+import aiohttp
+import uvicorn
+
+from api import app
+from benchmarks.stubs import StockAPIStub
+from crn.metrics import METRICS
+from crn.models import User
+
+MODES = ("single", "batch")
+
+
+def get_follows(args: argparse.Namespace, mode: str) -> List[Tuple[str, str]]:
+    """Follows of the users of `mode`, stock ids are 5 digits, unlike real ones"""
+    offset = MODES.index(mode) * args.users * args.stocks
+    return [
+        (f"U{MODES.index(mode)}{i:031d}", str(10000 + offset + i * args.stocks + j))
+        for i in range(args.users)
+        for j in range(args.stocks)
+    ]
+
+
+async def import_single(
+    session: aiohttp.ClientSession, api_url: str, follows: List[Tuple[str, str]]
+) -> Dict[int, int]:
+    statuses: Dict[int, int] = {}
+    for user_id, stock_id in follows:
+        async with session.get(
+            f"{api_url}/add-stock", params={"user_id": user_id, "stock_id": stock_id}
+        ) as resp:
+            statuses[resp.status] = statuses.get(resp.status, 0) + 1
+    return statuses
+
+
+async def import_batch(
+    session: aiohttp.ClientSession,
+    api_url: str,
+    follows: List[Tuple[str, str]],
+    batch_size: int,
+) -> Dict[int, int]:
+    statuses: Dict[int, int] = {}
+    for i in range(0, len(follows), batch_size):
+        subscriptions: Dict[str, List[str]] = {}
+        for user_id, stock_id in follows[i : i + batch_size]:
+            subscriptions.setdefault(user_id, []).append(stock_id)
+        body = {
+            "subscriptions": [
+                {"user_id": user_id, "stock_ids": stock_ids}
+                for user_id, stock_ids in subscriptions.items()
+            ]
+        }
+        async with session.post(f"{api_url}/add-stocks", json=body) as resp:
+            resp.raise_for_status()
+            for result in (await resp.json())["results"]:
+                statuses[result["status"]] = statuses.get(result["status"], 0) + 1
+    return statuses
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    stub = StockAPIStub(args.latency, args.missing_ratio)
+    stub_url = await stub.start()
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.environ["DB_URL"] = f"sqlite://{directory}/bench.sqlite3"
+        server = uvicorn.Server(
+            uvicorn.Config(app, host="127.0.0.1", port=0, log_level="warning")
+        )
+        serving = asyncio.create_task(server.serve())
+        while not server.started:
+            await asyncio.sleep(0.01)
+        host, port = server.servers[0].sockets[0].getsockname()[:2]
+        api_url = f"http://{host}:{port}"
+        app.state.stock_directory.api_url = stub_url
+
+        results: Dict[str, Any] = {}
+        try:
+            async with aiohttp.ClientSession() as session:
+                for mode in MODES:
+                    follows = get_follows(args, mode)
+                    await User.bulk_create(
+                        [
+                            User(id=user_id)
+                            for user_id in dict.fromkeys(u for u, _ in follows)
+                        ]
+                    )
+                    requests_before = len(stub.requests)
+                    queries_before = METRICS.get("crn_db_queries_total")
+                    start = time.perf_counter()
+                    if mode == "single":
+                        statuses = await import_single(session, api_url, follows)
+                    else:
+                        statuses = await import_batch(
+                            session, api_url, follows, args.batch_size
+                        )
+                    wall = time.perf_counter() - start
+                    results[mode] = {
+                        "wall_s": wall,
+                        "follows_per_s": len(follows) / wall,
+                        "stock_api_requests": len(stub.requests) - requests_before,
+                        "queries": METRICS.get("crn_db_queries_total") - queries_before,
+                        "statuses": statuses,
+                    }
+        finally:
+            server.should_exit = True
+            await serving
+            await stub.runner.cleanup()
+
+    return {
+        "params": {
+            "users": args.users,
+            "stocks": args.stocks,
+            "latency": args.latency,
+            "missing_ratio": args.missing_ratio,
+            "batch_size": args.batch_size,
+        },
+        "results": results,
+    }
+
+
+parser = argparse.ArgumentParser(description="Benchmark portfolio imports")
+parser.add_argument("--users", type=int, default=10)
+parser.add_argument("--stocks", type=int, default=100, help="stocks per user")
+parser.add_argument(
+    "--latency", type=float, default=0.02, help="seconds a stock API lookup takes"
+)
+parser.add_argument("--missing-ratio", type=float, default=0.05)
+parser.add_argument("--batch-size", type=int, default=500)
+
+if __name__ == "__main__":
+    print(json.dumps(asyncio.run(run(parser.parse_args())), indent=2))
@@ -0,0 +1,173 @@
+"""
+Check that the bot and the API processes can share the database under load
+
+A writer process saves `--batch` revenue reports per transaction every
+`--pause` seconds, like a crawl or the backfill, while a reader process runs
+the queries of the webhook and /add-stock: a user lookup, a count of their
+follows and a get_or_create of a stock. Both run for `--seconds` against the
+same database, which is a fresh SQLite file unless `--db-url` is given. Errors
+and latencies of each process are printed as JSON, e.g.
+
+    python -m benchmarks.bench_db --seconds 8
+    python -m benchmarks.bench_db --seconds 8 --baseline
+
+`--baseline` connects SQLite with Tortoise's defaults instead of
+crn.db.init_db, as both processes did before.
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import statistics
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+from tortoise import Tortoise
+from tortoise.transactions import in_transaction
+
+from crn.db import close_db, init_db
+from crn.models import RevenueReport, Stock, User
+
+USERS = 100
+
+
+async def connect(args: argparse.Namespace) -> None:
+    if args.baseline:
+        await Tortoise.init(db_url=args.db_url, modules={"models": ["crn.models"]})
+        await Tortoise.generate_schemas()
+    else:
+        await init_db(args.db_url)
+
+
+async def seed(args: argparse.Namespace) -> None:
+    await connect(args)
+    await User.bulk_create([User(id=f"U{i:032d}") for i in range(USERS)])
+    await Stock.bulk_create([Stock(id=str(1000 + i), name=str(i)) for i in range(100)])
+    await close_db()
+
+
+async def write(args: argparse.Namespace, deadline: float) -> List[float]:
+    latencies: List[float] = []
+    i = 0
+    while time.monotonic() < deadline:
+        start = time.perf_counter()
+        async with in_transaction() as conn:
+            # Read before writing like save_revenue_reports does
+            await RevenueReport.filter(roc_year=i).using_db(conn).count()
+            await RevenueReport.bulk_create(
+                [
+                    RevenueReport(
+                        stock_id=str(j),
+                        roc_year=i,
+                        month=1,
+                        industry="",
+                        current_month_revenue=j,
+                        last_month_revenue=j,
+                        last_year_current_month_revenue=j,
+                        last_month_diff=0,
+                        last_year_current_month_diff=0,
+                        current_month_accum_revenue=j,
+                        last_year_accum_revenue=j,
+                        last_season_diff=0,
+                    )
+                    for j in range(args.batch)
+                ],
+                using_db=conn,
+            )
+        latencies.append(time.perf_counter() - start)
+        i += 1
+        # The crawl and the backfill fetch and parse pages between writes
+        await asyncio.sleep(args.pause)
+    return latencies
+
+
+async def read(args: argparse.Namespace, deadline: float) -> List[float]:
+    latencies: List[float] = []
+    i = 0
+    while time.monotonic() < deadline:
+        start = time.perf_counter()
+        user = await User.get(id=f"U{i % USERS:032d}")
+        await user.stocks.all().count()
+        await Stock.get_or_create(id=str(10000 + i), defaults={"name": str(i)})
+        latencies.append(time.perf_counter() - start)
+        i += 1
+    return latencies
+
+
+async def run_role(args: argparse.Namespace, role: str) -> Dict[str, Any]:
+    await connect(args)
+    deadline = time.monotonic() + args.seconds
+    errors: Dict[str, int] = {}
+    latencies: List[float] = []
+    func = write if role == "writer" else read
+    while time.monotonic() < deadline:
+        try:
+            latencies.extend(await func(args, deadline))
+        except Exception as e:
+            errors[str(e)] = errors.get(str(e), 0) + 1
+            await asyncio.sleep(0.01)
+    await close_db()
+
+    latencies.sort()
+    return {
+        "operations": len(latencies),
+        "errors": errors,
+        "latency_ms": (
+            {
+                "p50": statistics.median(latencies) * 1000,
+                "p99": latencies[int(len(latencies) * 0.99)] * 1000,
+                "max": latencies[-1] * 1000,
+            }
+            if latencies
+            else None
+        ),
+    }
+
+
+def run_process(args: argparse.Namespace, role: str, results: Any) -> None:
+    results[role] = asyncio.run(run_role(args, role))
+
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    asyncio.run(seed(args))
+    with multiprocessing.Manager() as manager:
+        results = manager.dict()
+        processes = [
+            multiprocessing.Process(target=run_process, args=(args, role, results))
+            for role in ("writer", "reader")
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        return {
+            "params": {
+                "seconds": args.seconds,
+                "batch": args.batch,
+                "pause": args.pause,
+                "baseline": args.baseline,
+            },
+            **results,
+        }
+
+
+parser = argparse.ArgumentParser(description="Benchmark two processes on one DB")
+parser.add_argument("--db-url", help="a fresh SQLite file by default")
+parser.add_argument("--seconds", type=float, default=8)
+parser.add_argument("--batch", type=int, default=5000, help="reports per write")
+parser.add_argument(
+    "--pause", type=float, default=0.2, help="seconds between writes, can be 0"
+)
+parser.add_argument(
+    "--baseline", action="store_true", help="connect with Tortoise's defaults"
+)
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        if args.db_url is None:
+            args.db_url = f"sqlite://{Path(directory) / 'bench.sqlite3'}"
+        print(json.dumps(run(args), indent=2))
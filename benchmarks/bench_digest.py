@@ -0,0 +1,146 @@
+"""
+Count the LINE Notify requests of one crawl with and without digest mode
+
+A fresh SQLite database is seeded with `--stocks` stocks with a report each and
+`--users` users following `--follows` random stocks each, with a pending
+notification of every followed stock, as after a crawl that published all of
+them. The outbox is drained against a local notify stub once with digest mode
+off for everyone and once with it on. Results are printed as JSON, e.g.
+
+    python -m benchmarks.bench_digest --users 1000 --follows 40
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict
+
+import aiohttp
+
+from benchmarks.stubs import Stub
+from crn.db import close_db, init_db
+from crn.models import PendingNotification, RevenueReport, Stock, User
+from crn.notify import NotifyDispatcher, Outbox
+
+
+async def seed(args: argparse.Namespace, digest: bool) -> None:
+    rng = random.Random(args.seed)
+    stock_ids = [str(1000 + i) for i in range(args.stocks)]
+    await Stock.bulk_create(
+        [Stock(id=stock_id, name=f"股票{stock_id}") for stock_id in stock_ids]
+    )
+    await RevenueReport.bulk_create(
+        [
+            RevenueReport(
+                stock_id=stock_id,
+                roc_year=112,
+                month=9,
+                industry="",
+                current_month_revenue=rng.randrange(10**9),
+                last_month_revenue=rng.randrange(10**9),
+                last_year_current_month_revenue=rng.randrange(10**9),
+                last_month_diff=rng.uniform(-50, 50),
+                last_year_current_month_diff=rng.uniform(-50, 50),
+                current_month_accum_revenue=rng.randrange(10**10),
+                last_year_accum_revenue=rng.randrange(10**10),
+                last_season_diff=rng.uniform(-50, 50),
+            )
+            for stock_id in stock_ids
+        ]
+    )
+    report_ids = dict(await RevenueReport.all().values_list("stock_id", "id"))
+    await User.bulk_create(
+        [
+            User(
+                id=f"U{i:032d}",
+                line_notify_token=f"token-{i}",
+                digest_notifications=digest,
+            )
+            for i in range(args.users)
+        ]
+    )
+    await PendingNotification.bulk_create(
+        [
+            PendingNotification(
+                user_id=f"U{i:032d}", stock_id=stock_id, report_id=report_ids[stock_id]
+            )
+            for i in range(args.users)
+            for stock_id in rng.sample(stock_ids, min(args.follows, len(stock_ids)))
+        ],
+        batch_size=10000,
+    )
+
+
+async def run_mode(
+    args: argparse.Namespace, stub: Stub, base_url: str, digest: bool
+) -> Dict[str, float]:
+    with tempfile.TemporaryDirectory() as directory:
+        await init_db(f"sqlite://{directory}/bench.sqlite3")
+        await seed(args, digest)
+        notifications = await PendingNotification.all().count()
+
+        requests_before = stub.requests
+        async with aiohttp.ClientSession() as session:
+            outbox = Outbox(
+                NotifyDispatcher(
+                    session,
+                    workers=args.notify_workers,
+                    rate=1e6,
+                    burst=args.notify_workers,
+                    url=f"{base_url}/notify",
+                ),
+                batch_size=args.batch_size,
+            )
+            start = time.perf_counter()
+            while await outbox.drain_batch():
+                pass
+            wall = time.perf_counter() - start
+        await close_db()
+
+    requests = stub.requests - requests_before
+    return {
+        "notifications": notifications,
+        "requests": requests,
+        "requests_per_user": requests / args.users,
+        "wall_s": wall,
+    }
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    with tempfile.TemporaryDirectory() as pages_dir:
+        # Only the notify endpoint is used
+        stub = Stub(Path(pages_dir))
+        base_url = await stub.start()
+        try:
+            results = {
+                "single": await run_mode(args, stub, base_url, digest=False),
+                "digest": await run_mode(args, stub, base_url, digest=True),
+            }
+        finally:
+            await stub.runner.cleanup()
+
+    return {
+        "params": {
+            "users": args.users,
+            "follows": args.follows,
+            "stocks": args.stocks,
+            "batch_size": args.batch_size,
+        },
+        "results": results,
+    }
+
+
+parser = argparse.ArgumentParser(description="Benchmark digest notifications")
+parser.add_argument("--users", type=int, default=1000)
+parser.add_argument("--follows", type=int, default=40, help="stocks per user")
+parser.add_argument("--stocks", type=int, default=1800)
+parser.add_argument("--batch-size", type=int, default=500)
+parser.add_argument("--notify-workers", type=int, default=8)
+parser.add_argument("--seed", type=int, default=0)
+
+if __name__ == "__main__":
+    print(json.dumps(asyncio.run(run(parser.parse_args())), indent=2))
@@ -0,0 +1,123 @@
+"""
+Benchmark stock lookups of the stock directory against the queries it replaced
+
+A fresh SQLite database is seeded with `--stocks` stocks with made up names and
+loaded into a StockDirectory. Exact lookups by id and name, as done by
+add_company before the directory, are timed as `Stock.get_or_none` queries and
+as directory lookups. Prefix and substring searches are timed too, and
+`--api-lookups` lookups of missing stocks against a local stock API stub that
+answers after `--api-latency` seconds, the first ones and the cached ones.
+Results are printed as JSON in microseconds per lookup, e.g.
+
+    python -m benchmarks.bench_directory --stocks 1800 --lookups 2000
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import tempfile
+import time
+from typing import Any, Awaitable, Callable, Dict, List
+
+import aiohttp
+
+from benchmarks.stubs import StockAPIStub
+from crn.db import close_db, init_db
+from crn.directory import StockDirectory
+from crn.models import Stock
+
+# Characters the made up names are drawn from
+NAME_CHARS = "台積電鴻海聯發科中華信國泰富邦玉山兆豐統一大立光華碩廣達"
+
+
+async def time_lookups(
+    lookup: Callable[[str], Awaitable[Any]], queries: List[str]
+) -> Dict[str, float]:
+    times: List[float] = []
+    for query in queries:
+        start = time.perf_counter()
+        await lookup(query)
+        times.append((time.perf_counter() - start) * 1e6)
+    times.sort()
+    return {
+        "median_us": statistics.median(times),
+        "p99_us": times[int(len(times) * 0.99)],
+    }
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    rng = random.Random(args.seed)
+    stocks: Dict[str, str] = {}
+    while len(stocks) < args.stocks:
+        name = "".join(rng.choices(NAME_CHARS, k=rng.randint(2, 4)))
+        if name not in stocks.values():
+            stocks[str(1000 + len(stocks))] = name
+    ids = [rng.choice(list(stocks)) for _ in range(args.lookups)]
+    names = [stocks[stock_id] for stock_id in ids]
+    prefixes = [name[:1] for name in names]
+    substrings = [name[1:] for name in names]
+    missing = [str(100000 + i) for i in range(args.api_lookups)]
+
+    results: Dict[str, Dict[str, float]] = {}
+    with tempfile.TemporaryDirectory() as directory:
+        await init_db(f"sqlite://{directory}/bench.sqlite3")
+        await Stock.bulk_create(
+            [Stock(id=stock_id, name=name) for stock_id, name in stocks.items()]
+        )
+
+        async def get_by_id(stock_id: str) -> Any:
+            return await Stock.get_or_none(id=stock_id)
+
+        async def get_by_name(name: str) -> Any:
+            return await Stock.get_or_none(name=name)
+
+        results["db_get_id"] = await time_lookups(get_by_id, ids)
+        results["db_get_name"] = await time_lookups(get_by_name, names)
+
+        # Only stocks missing from the directory are looked up, none exist
+        stub = StockAPIStub(args.api_latency, missing_ratio=1.0)
+        stock_directory = StockDirectory(api_url=await stub.start())
+        await stock_directory.load()
+        async with aiohttp.ClientSession() as session:
+
+            async def resolve(stock_id_or_name: str) -> Any:
+                return await stock_directory.resolve(session, stock_id_or_name)
+
+            async def search(query: str) -> Any:
+                return stock_directory.search(query)
+
+            results["directory_resolve_id"] = await time_lookups(resolve, ids)
+            results["directory_resolve_name"] = await time_lookups(resolve, names)
+            results["directory_search_prefix"] = await time_lookups(search, prefixes)
+            results["directory_search_substring"] = await time_lookups(
+                search, substrings
+            )
+            results["api_missing_first"] = await time_lookups(resolve, missing)
+            results["api_missing_cached"] = await time_lookups(resolve, missing)
+        await stub.runner.cleanup()
+        await close_db()
+
+    return {
+        "params": {
+            "stocks": args.stocks,
+            "lookups": args.lookups,
+            "api_lookups": args.api_lookups,
+            "api_latency": args.api_latency,
+        },
+        "results": results,
+    }
+
+
+parser = argparse.ArgumentParser(description="Benchmark the stock directory")
+parser.add_argument("--stocks", type=int, default=1800)
+parser.add_argument("--lookups", type=int, default=2000)
+parser.add_argument("--api-lookups", type=int, default=100)
+parser.add_argument(
+    "--api-latency", type=float, default=0.05, help="seconds per stock API answer"
+)
+parser.add_argument("--seed", type=int, default=0)
+
+if __name__ == "__main__":
+    print(json.dumps(asyncio.run(run(parser.parse_args())), indent=2))
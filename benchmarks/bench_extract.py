@@ -0,0 +1,115 @@
+"""
+Benchmark the extractors of t21sc03 pages, time and peak memory per page
+
+Pages of a period are read from a directory of recorded pages, see
+benchmarks/bench.py, or, without `--pages-dir`, a page of `--rows` rows laid
+out like t21sc03 is made up. Every extractor must return the same rows as the
+soup reference. Results are printed as JSON, e.g.
+
+    python -m benchmarks.bench_extract --period 112/9 --pages-dir fixtures
+    python -m benchmarks.bench_extract --rows 2000
+"""
+
+import argparse
+import gc
+import json
+import statistics
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Dict, List
+
+from crn.backfill import get_recorded_path, parse_period
+from crn.crawl import PAGES, get_report_url
+from crn.extract import EXTRACTORS
+
+
+def make_page(rows: int) -> str:
+    """A page of `rows` rows in industries of 100 rows, like t21sc03"""
+    parts = ["<html><body><center><table width=100%><tr><td>"]
+    for start in range(0, rows, 100):
+        parts.append(f"<table><tr><th class=tt>產業別：{start}</th></tr></table>")
+        parts.append("<table><tr><td><table class=hasBorder>")
+        parts.append("<tr><th>公司代號</th><th>公司名稱</th></tr>" * 4)
+        for i in range(start, min(start + 100, rows)):
+            cells = [str(10000 + i), f"公司{i}", "1,234,567", "1,000,000"]
+            cells += ["987,654", "23.45", "-12.34", "12,345,678", "11,111,111"]
+            cells += ["11.11", "-"]
+            parts.append(
+                "<tr align=right>"
+                + "".join(f"<td>{cell}</td>" for cell in cells)
+                + "</tr>"
+            )
+        parts.append("<tr><th>合計</th><td>1,000</td></tr>")
+        parts.append("</table></td></tr></table>")
+    parts.append("</td></tr></table></center></body></html>")
+    return "".join(parts)
+
+
+def load_pages(args: argparse.Namespace) -> List[str]:
+    if args.pages_dir is None:
+        return [make_page(args.rows)]
+    if args.period is None:
+        raise SystemExit("--period is required with --pages-dir")
+
+    pages: List[str] = []
+    for company_type, area in PAGES:
+        path = get_recorded_path(
+            args.pages_dir, get_report_url(company_type, *args.period, area)
+        )
+        if path.exists():
+            pages.append(path.read_bytes().decode("big5hkscs"))
+    if not pages:
+        raise SystemExit(f"No pages of {args.period} in {args.pages_dir}")
+    return pages
+
+
+def measure(name: str, pages: List[str], repeat: int) -> Dict[str, float]:
+    extractor = EXTRACTORS[name]
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        for page in pages:
+            extractor(page)
+        times.append(time.perf_counter() - start)
+
+    # Tracing slows allocations down, memory is measured in a separate pass
+    peak = 0
+    for page in pages:
+        gc.collect()
+        tracemalloc.start()
+        extractor(page)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return {"seconds": statistics.median(times), "peak_mb": peak / 2**20}
+
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    pages = load_pages(args)
+    expected = [EXTRACTORS["soup"](page) for page in pages]
+    for name in EXTRACTORS:
+        if [EXTRACTORS[name](page) for page in pages] != expected:
+            raise SystemExit(f"Extractor {name} doesn't match the soup reference")
+
+    return {
+        "params": {
+            "pages": len(pages),
+            "page_mb": [len(page.encode("big5hkscs")) / 2**20 for page in pages],
+            "rows": sum(len(rows) for rows in expected),
+            "repeat": args.repeat,
+        },
+        "extractors": {
+            name: measure(name, pages, args.repeat) for name in sorted(EXTRACTORS)
+        },
+    }
+
+
+parser = argparse.ArgumentParser(description="Benchmark the page extractors")
+parser.add_argument("--period", type=parse_period, help="recorded period, e.g. 112/9")
+parser.add_argument("--pages-dir", type=Path, help="recorded pages, see bench.py")
+parser.add_argument("--rows", type=int, default=2000, help="rows of a made up page")
+parser.add_argument("--repeat", type=int, default=5)
+
+if __name__ == "__main__":
+    print(json.dumps(run(parser.parse_args()), indent=2))
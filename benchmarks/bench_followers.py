@@ -0,0 +1,142 @@
+"""
+Benchmark finding the followers to notify of newly published reports, with the
+in-memory follower graph against prefetching `stock.users` from the database
+
+A fresh SQLite database is seeded with `--users` users following `--follows`
+random stocks each out of `--stocks`. Time and allocated memory of building
+the graph and of computing the targets of every stock, as if every stock
+published its report at once, are printed as JSON, e.g.
+
+    python -m benchmarks.bench_followers --users 100000 --follows 20 --orm
+"""
+
+import argparse
+import asyncio
+import gc
+import json
+import random
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Awaitable, Callable, Dict, List, Tuple, TypeVar
+
+from tortoise import Tortoise
+
+from crn.db import close_db, init_db
+from crn.followers import FollowerGraph
+from crn.models import Stock, User
+
+T = TypeVar("T")
+
+
+async def measure(
+    results: Dict[str, Dict[str, float]], name: str, func: Callable[[], Awaitable[T]]
+) -> T:
+    """
+    Time `func`, then call it again with tracemalloc on to measure the memory it
+    allocates, tracing slows allocations down too much to time it at once
+    """
+    gc.collect()
+    start = time.perf_counter()
+    await func()
+    wall = time.perf_counter() - start
+
+    gc.collect()
+    tracemalloc.start()
+    value = await func()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    results[name] = {
+        "wall_s": wall,
+        "retained_mb": retained / 2**20,
+        "peak_mb": peak / 2**20,
+    }
+    return value
+
+
+async def seed(args: argparse.Namespace) -> List[str]:
+    rng = random.Random(args.seed)
+    stock_ids = [str(1000 + i) for i in range(args.stocks)]
+    await Stock.bulk_create(
+        [Stock(id=stock_id, name=stock_id) for stock_id in stock_ids]
+    )
+    await User.bulk_create(
+        [
+            User(
+                id=f"U{i:032d}",
+                line_notify_token=(
+                    f"token-{i}" if rng.random() < args.notify_ratio else None
+                ),
+            )
+            for i in range(args.users)
+        ],
+        batch_size=10000,
+    )
+    conn = Tortoise.get_connection("default")
+    for start in range(0, args.users, 10000):
+        await conn.execute_many(
+            'INSERT INTO "user_stock" (user_id, stock_id) VALUES (?, ?)',
+            [
+                (f"U{i:032d}", stock_id)
+                for i in range(start, min(start + 10000, args.users))
+                for stock_id in rng.sample(stock_ids, args.follows)
+            ],
+        )
+    return stock_ids
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    results: Dict[str, Dict[str, float]] = {}
+    with tempfile.TemporaryDirectory() as directory:
+        await init_db(f"sqlite://{directory}/bench.sqlite3")
+        stock_ids = await seed(args)
+
+        followers = FollowerGraph()
+        await measure(results, "graph_load", followers.load)
+        await measure(results, "graph_sync", followers.sync)
+
+        async def get_graph_targets() -> List[Tuple[str, str]]:
+            return followers.get_targets(stock_ids)
+
+        targets = await measure(results, "graph_targets", get_graph_targets)
+
+        async def get_orm_targets() -> List[Tuple[str, str]]:
+            return [
+                (stock.id, user.id)
+                for stock in await Stock.filter(id__in=stock_ids).prefetch_related(
+                    "users"
+                )
+                for user in stock.users
+                if user.line_notify_token is not None
+            ]
+
+        if args.orm:
+            del targets
+            targets = await measure(results, "orm_targets", get_orm_targets)
+
+        count = len(targets)
+        await close_db()
+
+    return {
+        "params": {
+            "users": args.users,
+            "follows": args.follows,
+            "stocks": args.stocks,
+            "notify_ratio": args.notify_ratio,
+        },
+        "follows": len(followers),
+        "targets": count,
+        "results": results,
+    }
+
+
+parser = argparse.ArgumentParser(description="Benchmark the follower graph")
+parser.add_argument("--users", type=int, default=100000)
+parser.add_argument("--follows", type=int, default=20, help="stocks per user")
+parser.add_argument("--stocks", type=int, default=1800)
+parser.add_argument("--notify-ratio", type=float, default=0.9)
+parser.add_argument("--orm", action="store_true", help="also measure prefetch_related")
+parser.add_argument("--seed", type=int, default=0)
+
+if __name__ == "__main__":
+    print(json.dumps(asyncio.run(run(parser.parse_args())), indent=2))
@@ -0,0 +1,109 @@
+"""
+Benchmark sending notifications with a default aiohttp session against one
+made by `crn.http.create_session(NOTIFY)`
+
+Each session sends two bursts of `--notifications` notifications through a
+NotifyDispatcher with `--workers` workers to the notify endpoint of a local
+stub, `--pause` seconds apart like two outbox batches. The throughput of each
+burst and the connections opened for it are printed as JSON. Connections to
+localhost are almost free, the ones reopened after the pause each cost a TLS
+handshake with the real host, e.g.
+
+    python -m benchmarks.bench_http --notifications 2000 --workers 64 --pause 20
+"""
+
+import argparse
+import asyncio
+import json
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List
+
+import aiohttp
+
+from benchmarks.stubs import Stub
+from crn.http import NOTIFY, create_session
+from crn.notify import Notification, NotifyDispatcher
+
+SESSIONS: Dict[str, Callable[[aiohttp.TraceConfig], aiohttp.ClientSession]] = {
+    "default": lambda trace: aiohttp.ClientSession(trace_configs=[trace]),
+    "notify": lambda trace: create_session(NOTIFY, trace_configs=[trace]),
+}
+
+
+def create_trace(connections: List[int]) -> aiohttp.TraceConfig:
+    """Count the connections opened in `connections[0]`"""
+
+    async def on_connection_create_end(
+        session: aiohttp.ClientSession, context: SimpleNamespace, params: Any
+    ) -> None:
+        connections[0] += 1
+
+    trace = aiohttp.TraceConfig()
+    trace.on_connection_create_end.append(on_connection_create_end)
+    return trace
+
+
+async def run_session(
+    args: argparse.Namespace, name: str, url: str
+) -> List[Dict[str, float]]:
+    connections = [0]
+    # About the length of a report's notification
+    message = "\n" + "-" * 300
+    notifications = [
+        Notification(f"token-{i}", message) for i in range(args.notifications)
+    ]
+    bursts: List[Dict[str, float]] = []
+    async with SESSIONS[name](create_trace(connections)) as session:
+        dispatcher = NotifyDispatcher(
+            session, workers=args.workers, rate=1e6, burst=args.workers, url=url
+        )
+        for i in range(2):
+            if i:
+                await asyncio.sleep(args.pause)
+            connections[0] = 0
+            start = time.perf_counter()
+            stats = await dispatcher.dispatch(notifications)
+            wall = time.perf_counter() - start
+            bursts.append(
+                {
+                    "sent": stats.sent,
+                    "wall_s": wall,
+                    "per_s": stats.sent / wall,
+                    "connections_opened": connections[0],
+                }
+            )
+    return bursts
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    with tempfile.TemporaryDirectory() as pages_dir:
+        # Only the notify endpoint is used
+        stub = Stub(Path(pages_dir))
+        url = f"{await stub.start()}/notify"
+        try:
+            results = {name: await run_session(args, name, url) for name in SESSIONS}
+        finally:
+            await stub.runner.cleanup()
+
+    return {
+        "params": {
+            "notifications": args.notifications,
+            "workers": args.workers,
+            "pause": args.pause,
+        },
+        "results": results,
+    }
+
+
+parser = argparse.ArgumentParser(description="Benchmark the notify session")
+parser.add_argument("--notifications", type=int, default=2000)
+parser.add_argument("--workers", type=int, default=8)
+parser.add_argument(
+    "--pause", type=float, default=20.0, help="seconds between the two bursts"
+)
+
+if __name__ == "__main__":
+    print(json.dumps(asyncio.run(run(parser.parse_args())), indent=2))
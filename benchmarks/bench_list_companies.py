@@ -0,0 +1,165 @@
+"""
+Benchmark the pages of list_companies for a user following many stocks
+
+A fresh SQLite database is seeded with `--stocks` stocks, half of them with a
+current report, and `--users` users following `--follows` random stocks each.
+The benchmarked user follows `--user-follows` stocks. Every page of their list,
+and every page of a search in it, is fetched with `get_followed_stocks` and with
+`Stock.filter(users__id=...)`, the query list_companies used before. Median
+milliseconds per page are printed as JSON, e.g.
+
+    python -m benchmarks.bench_list_companies --user-follows 600
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import tempfile
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from tortoise import Tortoise
+from tortoise.expressions import Q
+
+from crn.db import close_db, init_db
+from crn.followers import get_followed_stocks
+from crn.models import RevenueReport, Stock, User
+
+PAGE_SIZE = 10
+USER_ID = "U" + "f" * 32
+
+
+async def seed(args: argparse.Namespace) -> None:
+    rng = random.Random(args.seed)
+    stock_ids = [str(1000 + i) for i in range(args.stocks)]
+    reports = [
+        RevenueReport(
+            stock_id=stock_id,
+            roc_year=112,
+            month=9,
+            industry="",
+            current_month_revenue=1,
+            last_month_revenue=1,
+            last_year_current_month_revenue=1,
+            last_month_diff=0,
+            last_year_current_month_diff=0,
+            current_month_accum_revenue=1,
+            last_year_accum_revenue=1,
+            last_season_diff=0,
+        )
+        for stock_id in stock_ids[::2]
+    ]
+    await RevenueReport.bulk_create(reports)
+    report_ids = dict(
+        await RevenueReport.all().values_list("stock_id", "id")  # type: ignore
+    )
+    await Stock.bulk_create(
+        [
+            Stock(
+                id=stock_id,
+                name=f"公司{stock_id}",
+                revenue_report_id=report_ids.get(stock_id),
+            )
+            for stock_id in stock_ids
+        ]
+    )
+
+    user_ids = [f"U{i:032d}" for i in range(args.users)]
+    await User.bulk_create(
+        [User(id=user_id) for user_id in user_ids + [USER_ID]], batch_size=10000
+    )
+    follows = [
+        (user_id, stock_id)
+        for user_id in user_ids
+        for stock_id in rng.sample(stock_ids, args.follows)
+    ]
+    follows += [
+        (USER_ID, stock_id) for stock_id in rng.sample(stock_ids, args.user_follows)
+    ]
+    await Tortoise.get_connection("default").execute_many(
+        'INSERT INTO "user_stock" (user_id, stock_id) VALUES (?, ?)', follows
+    )
+
+
+async def get_stocks_before(
+    user: User, offset: int, limit: int, search: Optional[str] = None
+) -> List[Stock]:
+    query = Stock.filter(users__id=user.id)
+    if search:
+        query = query.filter(Q(id__contains=search) | Q(name__contains=search))
+    return (
+        await query.order_by("id")
+        .offset(offset)
+        .limit(limit)
+        .select_related("revenue_report")
+    )
+
+
+async def time_pages(
+    func: Callable[..., Awaitable[List[Stock]]],
+    user: User,
+    search: Optional[str],
+    repeat: int,
+) -> Dict[str, Any]:
+    """Median milliseconds of fetching each page until the last one"""
+    times: List[float] = []
+    pages = 0
+    while True:
+        page_times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            stocks = await func(user, pages * PAGE_SIZE, PAGE_SIZE + 1, search)
+            page_times.append(time.perf_counter() - start)
+        times.append(statistics.median(page_times))
+        pages += 1
+        if len(stocks) <= PAGE_SIZE:
+            break
+    return {
+        "pages": pages,
+        "first_page_ms": times[0] * 1000,
+        "last_page_ms": times[-1] * 1000,
+        "median_page_ms": statistics.median(times) * 1000,
+    }
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    results: Dict[str, Dict[str, Any]] = {}
+    with tempfile.TemporaryDirectory() as directory:
+        await init_db(f"sqlite://{directory}/bench.sqlite3")
+        await seed(args)
+        user = await User.get(id=USER_ID)
+        for name, func in (
+            ("before", get_stocks_before),
+            ("get_followed_stocks", get_followed_stocks),
+        ):
+            results[name] = {
+                "list": await time_pages(func, user, None, args.repeat),
+                "search": await time_pages(func, user, args.search, args.repeat),
+            }
+        await close_db()
+
+    return {
+        "params": {
+            "stocks": args.stocks,
+            "users": args.users,
+            "follows": args.follows,
+            "user_follows": args.user_follows,
+            "search": args.search,
+        },
+        "results": results,
+    }
+
+
+parser = argparse.ArgumentParser(description="Benchmark list_companies pages")
+parser.add_argument("--stocks", type=int, default=1800)
+parser.add_argument("--users", type=int, default=10000)
+parser.add_argument("--follows", type=int, default=20, help="stocks per user")
+parser.add_argument("--user-follows", type=int, default=600)
+parser.add_argument("--search", default="1", help="searched id or name part")
+parser.add_argument("--repeat", type=int, default=20)
+parser.add_argument("--seed", type=int, default=0)
+
+if __name__ == "__main__":
+    print(json.dumps(asyncio.run(run(parser.parse_args())), indent=2))
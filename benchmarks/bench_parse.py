@@ -0,0 +1,100 @@
+"""
+Benchmark parsing a month of revenue report rows, one `RevenueReport` per row
+against the columnar `parse_reports` batch
+
+Rows are taken from recorded pages, see benchmarks/bench.py, and repeated with
+new stock ids up to `--rows`, the size of a full month. `--new` is the share of
+rows whose stocks don't have a report yet, only those are made into models by
+the batch path. Results are printed as JSON, e.g.
+
+    python -m benchmarks.bench_parse 112/9 --pages-dir fixtures --rows 1800 --new 0.1
+"""
+
+import argparse
+import json
+import pickle
+import statistics
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+from crn.backfill import get_recorded_path, parse_period
+from crn.crawl import PAGES, get_report_url, parse_page
+from crn.extract import EXTRACTORS
+from crn.models import RevenueReport
+from crn.parse import parse_reports
+
+
+def load_rows(args: argparse.Namespace) -> List[List[str]]:
+    recorded: List[List[str]] = []
+    for company_type, area in PAGES:
+        path = get_recorded_path(
+            args.pages_dir, get_report_url(company_type, *args.period, area)
+        )
+        if path.exists():
+            recorded.extend(parse_page(path.read_bytes(), EXTRACTORS["stream"]))
+    if not recorded:
+        raise SystemExit(f"No pages of {args.period} in {args.pages_dir}")
+    # Strings are copied, pickle would otherwise send repeated ones only once
+    return [
+        [str(100000 + i)]
+        + [s.encode().decode() for s in recorded[i % len(recorded)][1:]]
+        for i in range(args.rows)
+    ]
+
+
+def time_best(func: Callable[[], Any], repeat: int) -> float:
+    """Median seconds of `repeat` calls"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    rows = load_rows(args)
+    new = set(row[0] for row in rows[: int(len(rows) * args.new)])
+
+    def parse_rows() -> List[RevenueReport]:
+        return [RevenueReport.parse(strings) for strings in rows if strings[0] in new]
+
+    def parse_batch() -> List[RevenueReport]:
+        batch = parse_reports(rows)
+        return [
+            batch.get_report(i)
+            for i, stock_id in enumerate(batch.stock_ids)
+            if stock_id in new
+        ]
+
+    def parse_all_rows() -> List[RevenueReport]:
+        return [RevenueReport.parse(strings) for strings in rows]
+
+    batch = parse_reports(rows)
+    return {
+        "params": {"rows": len(rows), "new": args.new, "repeat": args.repeat},
+        "seconds": {
+            "rows_all_models": time_best(parse_all_rows, args.repeat),
+            "rows_new_models": time_best(parse_rows, args.repeat),
+            "batch": time_best(lambda: parse_reports(rows), args.repeat),
+            "batch_new_models": time_best(parse_batch, args.repeat),
+        },
+        # What a worker process sends back to the crawl
+        "pickled_bytes": {
+            "rows": len(pickle.dumps(rows)),
+            "batch": len(pickle.dumps(batch)),
+        },
+        "errors": len(batch.errors),
+    }
+
+
+parser = argparse.ArgumentParser(description="Benchmark revenue report parsing")
+parser.add_argument("period", type=parse_period, help="recorded period, e.g. 112/9")
+parser.add_argument("--pages-dir", type=Path, required=True)
+parser.add_argument("--rows", type=int, default=1800)
+parser.add_argument("--new", type=float, default=1.0, help="share of new stocks")
+parser.add_argument("--repeat", type=int, default=20)
+
+if __name__ == "__main__":
+    print(json.dumps(run(parser.parse_args()), indent=2))
@@ -0,0 +1,134 @@
+"""
+Benchmark the monthly rollover of revenue reports with years of report history
+
+A fresh SQLite database is seeded as it is the day before a rollover, with
+`--stocks` stocks and a report of each of them for each of the `--periods`
+periods before the current one. The stocks are linked to the reports of the
+latest of them, the only ones with a rendered message. The rollover with a
+retention of `--keep` periods and a "latest report of a stock" query are timed
+before and after it.
+Results are printed as JSON, e.g.
+
+    python -m benchmarks.bench_rollover --stocks 2000 --periods 60 --keep 60
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import tempfile
+import time
+from typing import Any, Dict, List
+
+from tortoise import Tortoise
+
+from crn.db import close_db, init_db
+from crn.models import RevenueReport, Stock
+from crn.persist import roll_over_reports
+from crn.utils import get_report_period, shift_period
+
+
+async def seed(args: argparse.Namespace) -> List[str]:
+    rng = random.Random(args.seed)
+    stock_ids = [str(1000 + i) for i in range(args.stocks)]
+    await Stock.bulk_create(
+        [Stock(id=stock_id, name=stock_id) for stock_id in stock_ids]
+    )
+    roc_year, month = shift_period(*get_report_period(), -1)
+    for i in range(args.periods):
+        period_year, period_month = shift_period(roc_year, month, -i)
+        await RevenueReport.bulk_create(
+            [
+                RevenueReport(
+                    stock_id=stock_id,
+                    roc_year=period_year,
+                    month=period_month,
+                    industry="",
+                    current_month_revenue=rng.randrange(10**9),
+                    last_month_revenue=rng.randrange(10**9),
+                    last_year_current_month_revenue=rng.randrange(10**9),
+                    last_month_diff=rng.uniform(-50, 50),
+                    last_year_current_month_diff=rng.uniform(-50, 50),
+                    current_month_accum_revenue=rng.randrange(10**10),
+                    last_year_accum_revenue=rng.randrange(10**10),
+                    last_season_diff=rng.uniform(-50, 50),
+                    message="-" * 300 if i == 0 else None,
+                )
+                for stock_id in stock_ids
+            ],
+            batch_size=5000,
+        )
+    await Tortoise.get_connection("default").execute_script(
+        'UPDATE "stock" SET revenue_report_id = (SELECT id FROM "revenuereport" '
+        'WHERE stock_id = "stock".id '
+        f"AND roc_year = {roc_year} AND month = {month})"
+    )
+    return stock_ids
+
+
+async def time_latest_reports(stock_ids: List[str], queries: int) -> Dict[str, Any]:
+    """Median milliseconds of looking up the latest report of a random stock"""
+    rng = random.Random(0)
+    times = []
+    for _ in range(queries):
+        stock_id = rng.choice(stock_ids)
+        start = time.perf_counter()
+        await RevenueReport.filter(stock_id=stock_id).order_by(
+            "-roc_year", "-month"
+        ).first()
+        times.append(time.perf_counter() - start)
+
+    query = (
+        RevenueReport.filter(stock_id=stock_ids[0])
+        .order_by("-roc_year", "-month")
+        .limit(1)
+        .sql()
+    )
+    _, rows = await Tortoise.get_connection("default").execute_query(
+        f"EXPLAIN QUERY PLAN {query}"
+    )
+    return {
+        "median_ms": statistics.median(times) * 1000,
+        "plan": [row["detail"] for row in rows],
+    }
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    with tempfile.TemporaryDirectory() as directory:
+        await init_db(f"sqlite://{directory}/bench.sqlite3")
+        start = time.perf_counter()
+        stock_ids = await seed(args)
+        seeded = time.perf_counter() - start
+        reports = await RevenueReport.all().count()
+
+        latest_before = await time_latest_reports(stock_ids, args.queries)
+        start = time.perf_counter()
+        pruned = await roll_over_reports(args.keep)
+        rollover = time.perf_counter() - start
+        latest_after = await time_latest_reports(stock_ids, args.queries)
+        await close_db()
+
+    return {
+        "params": {
+            "stocks": args.stocks,
+            "periods": args.periods,
+            "keep": args.keep,
+        },
+        "reports": reports,
+        "seed_s": seeded,
+        "rollover_s": rollover,
+        "pruned": pruned,
+        "latest_report": {"before": latest_before, "after": latest_after},
+    }
+
+
+parser = argparse.ArgumentParser(description="Benchmark the report rollover")
+parser.add_argument("--stocks", type=int, default=2000)
+parser.add_argument("--periods", type=int, default=60, help="periods of history")
+parser.add_argument("--keep", type=int, default=60, help="periods kept by pruning")
+parser.add_argument("--queries", type=int, default=200)
+parser.add_argument("--seed", type=int, default=0)
+
+if __name__ == "__main__":
+    print(json.dumps(asyncio.run(run(parser.parse_args())), indent=2))
@@ -0,0 +1,219 @@
+"""
+Load test the bot's webhook by replaying signed LINE webhook events
+
+Follow, message and postback events of `--users` users are signed with the
+channel secret and posted to a running bot, `--concurrency` requests at a
+time. The time the bot takes to answer each request is measured, then the
+bot's /metrics are polled until its event queue is drained. Results are
+printed as JSON, e.g.
+
+    python -m benchmarks.bench_webhook http://127.0.0.1:7060/callback --events 5000
+
+The reply tokens are made up, LINE rejects the replies sent with them and the
+bot logs the failures. Run it against a bot of a test channel.
+
+With `--crawl-pages-dir` the requests are sent while the bot crawls. Recorded
+pages of `--crawl-period` are served on `--crawl-port`, whatever period is
+asked for, with a new comment appended each time so every crawl parses them
+again. Start the bot with MOPS_URL pointed at it, then a crawl is started
+every `--crawl-interval` seconds with the admin's postback, e.g.
+
+    MOPS_URL=http://127.0.0.1:7061 python run.py
+    python -m benchmarks.bench_webhook http://127.0.0.1:7060/callback \
+        --crawl-pages-dir pages --crawl-period 112/9
+"""
+
+import argparse
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import os
+import random
+import statistics
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from urllib.parse import urljoin
+
+import aiohttp
+from dotenv import load_dotenv
+
+from benchmarks.stubs import Stub
+from crn.backfill import parse_period
+
+load_dotenv()
+
+POSTBACKS = ("cmd=list_companies", "cmd=search_company", "cmd=add_company")
+ADMIN_ID = "Udfc687303c03a91398d74cbfd33dcea4"
+
+
+def make_event(user_id: str, rng: random.Random) -> Dict[str, Any]:
+    event: Dict[str, Any] = {
+        "mode": "active",
+        "timestamp": int(time.time() * 1000),
+        "source": {"type": "user", "userId": user_id},
+        "webhookEventId": uuid.uuid4().hex.upper()[:26],
+        "deliveryContext": {"isRedelivery": False},
+        "replyToken": uuid.uuid4().hex,
+    }
+    kind = rng.choices(("follow", "message", "postback"), (1, 5, 4))[0]
+    if kind == "follow":
+        event.update(type="follow", follow={"isUnblocked": False})
+    elif kind == "message":
+        event.update(
+            type="message",
+            message={
+                "id": str(rng.randrange(10**17)),
+                "type": "text",
+                "quoteToken": uuid.uuid4().hex,
+                "text": rng.choice(("2330", "台積電", "2317")),
+            },
+        )
+    else:
+        event.update(type="postback", postback={"data": rng.choice(POSTBACKS)})
+    return event
+
+
+def make_crawl_request(admin_id: str) -> bytes:
+    event: Dict[str, Any] = make_event(admin_id, random.Random())
+    event.update(
+        type="postback", postback={"data": "cmd=crawl_and_save_revenue_reports"}
+    )
+    event.pop("message", None)
+    event.pop("follow", None)
+    return json.dumps({"destination": "U" + "0" * 32, "events": [event]}).encode()
+
+
+def sign(body: bytes, secret: str) -> str:
+    digest = hmac.new(secret.encode(), body, hashlib.sha256).digest()
+    return base64.b64encode(digest).decode()
+
+
+def make_requests(args: argparse.Namespace) -> List[bytes]:
+    """Webhook request bodies of `args.events` events, `args.batch` per request"""
+    rng = random.Random(args.seed)
+    user_ids = [f"U{i:032x}" for i in range(args.users)]
+    events = [make_event(rng.choice(user_ids), rng) for _ in range(args.events)]
+    return [
+        json.dumps(
+            {"destination": "U" + "0" * 32, "events": events[i : i + args.batch]}
+        ).encode()
+        for i in range(0, len(events), args.batch)
+    ]
+
+
+async def get_queue_size(session: aiohttp.ClientSession, url: str) -> Optional[float]:
+    async with session.get(url) as resp:
+        for line in (await resp.text()).splitlines():
+            if line.startswith("crn_event_queue_size "):
+                return float(line.split()[1])
+    return None
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    bodies = make_requests(args)
+    latencies: List[float] = []
+    statuses: Dict[int, int] = {}
+    pending = iter(bodies)
+
+    async def post(session: aiohttp.ClientSession, body: bytes) -> int:
+        headers = {
+            "Content-Type": "application/json",
+            "X-Line-Signature": sign(body, args.secret),
+        }
+        async with session.post(args.url, data=body, headers=headers) as resp:
+            await resp.read()
+        return resp.status
+
+    async def worker(session: aiohttp.ClientSession) -> None:
+        for body in pending:
+            start = time.perf_counter()
+            status = await post(session, body)
+            latencies.append(time.perf_counter() - start)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    async def crawl(session: aiohttp.ClientSession) -> None:
+        while True:
+            await post(session, make_crawl_request(args.crawl_admin_id))
+            await asyncio.sleep(args.crawl_interval)
+
+    stub: Optional[Stub] = None
+    if args.crawl_pages_dir is not None:
+        stub = Stub(args.crawl_pages_dir, period=args.crawl_period)
+        await stub.start(args.crawl_port)
+
+    metrics_url = args.metrics_url or urljoin(args.url, "/metrics")
+    async with aiohttp.ClientSession() as session:
+        crawler = asyncio.create_task(crawl(session)) if stub is not None else None
+        if crawler is not None:
+            # Let the first crawl start fetching
+            await asyncio.sleep(args.crawl_interval / 10)
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(session) for _ in range(args.concurrency)))
+        sent = time.perf_counter() - start
+        if crawler is not None:
+            crawler.cancel()
+
+        # The events are processed after the webhooks are answered
+        while (await get_queue_size(session, metrics_url)) or 0:
+            await asyncio.sleep(0.1)
+        drained = time.perf_counter() - start
+
+    if stub is not None:
+        await stub.runner.cleanup()
+
+    latencies.sort()
+    return {
+        "params": {
+            "events": args.events,
+            "users": args.users,
+            "batch": args.batch,
+            "concurrency": args.concurrency,
+            "crawl_period": "/".join(map(str, args.crawl_period or ())) or None,
+        },
+        "requests": len(bodies),
+        "crawled_pages": stub.requests if stub is not None else None,
+        "statuses": statuses,
+        "sent_s": sent,
+        "drained_s": drained,
+        "requests_per_s": len(bodies) / sent,
+        "latency_s": {
+            "p50": statistics.median(latencies),
+            "p95": latencies[int(len(latencies) * 0.95)],
+            "p99": latencies[int(len(latencies) * 0.99)],
+            "max": latencies[-1],
+        },
+    }
+
+
+parser = argparse.ArgumentParser(description="Load test the bot's webhook")
+parser.add_argument("url", help="webhook URL of a running bot")
+parser.add_argument(
+    "--secret",
+    default=os.getenv("LINE_CHANNEL_SECRET"),
+    help="channel secret, LINE_CHANNEL_SECRET by default",
+)
+parser.add_argument("--metrics-url", help="/metrics of the bot by default")
+parser.add_argument("--events", type=int, default=5000)
+parser.add_argument("--users", type=int, default=200)
+parser.add_argument("--batch", type=int, default=1, help="events per request")
+parser.add_argument("--concurrency", type=int, default=50)
+parser.add_argument("--seed", type=int, default=0)
+parser.add_argument("--crawl-pages-dir", type=Path, help="crawl these during the test")
+parser.add_argument(
+    "--crawl-period", type=parse_period, help="recorded period, e.g. 112/9"
+)
+parser.add_argument("--crawl-port", type=int, default=7061)
+parser.add_argument("--crawl-interval", type=float, default=5.0)
+parser.add_argument("--crawl-admin-id", default=ADMIN_ID)
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    if args.secret is None:
+        parser.error("LINE_CHANNEL_SECRET is not set")
+    if args.crawl_pages_dir is not None and args.crawl_period is None:
+        parser.error("--crawl-period is required with --crawl-pages-dir")
+    print(json.dumps(asyncio.run(run(args)), indent=2))
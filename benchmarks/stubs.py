@@ -0,0 +1,117 @@
+"""
+Local stubs of the services the bot talks to, shared by the benchmarks and tests
+"""
+
+import asyncio
+import uuid
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from aiohttp import web
+
+from crn.backfill import get_recorded_path
+from crn.crawl import get_report_url
+
+
+async def start_site(runner: web.AppRunner, port: int = 0) -> str:
+    """Serve an app on localhost, a free port by default, returns its base URL"""
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", port)
+    await site.start()
+    host, port = site._server.sockets[0].getsockname()[:2]  # type: ignore
+    return f"http://{host}:{port}"
+
+
+class Stub:
+    """
+    Serves recorded pages in place of MOPS and accepts LINE Notify requests
+
+    Parameters:
+        pages_dir: Recorded pages, laid out like `backfill.py --record` writes them
+        latency: Seconds added to every page, like the round trip to MOPS
+        period: Serve the pages of this period whatever period is asked for,
+            with a new comment appended each time so that every crawl parses
+            them again
+    """
+
+    def __init__(
+        self,
+        pages_dir: Path,
+        *,
+        latency: float = 0.0,
+        period: Optional[Tuple[int, int]] = None,
+    ) -> None:
+        self.pages_dir = pages_dir
+        self.latency = latency
+        self.period = period
+        self.requests = 0
+        self.app = web.Application()
+        self.app.router.add_get("/nas/t21/{company_type}/{name}", self._page)
+        self.app.router.add_post("/notify", self._notify)
+        self.runner = web.AppRunner(self.app, access_log=None)
+
+    async def _page(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        url = str(request.url)
+        if self.period is not None:
+            # t21sc03_<year>_<month>_<area>.html
+            area = int(request.match_info["name"].rsplit("_", 1)[1].split(".")[0])
+            url = get_report_url(request.match_info["company_type"], *self.period, area)
+        path = get_recorded_path(self.pages_dir, url)
+        if not path.exists():
+            return web.Response(status=404)
+
+        body = path.read_bytes()
+        if self.period is not None:
+            body += f"<!-- {uuid.uuid4()} -->".encode()
+        return web.Response(body=body)
+
+    async def _notify(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        await request.post()
+        return web.Response(
+            text='{"status": 200}', headers={"X-RateLimit-Remaining": "1000"}
+        )
+
+    async def start(self, port: int = 0) -> str:
+        return await start_site(self.runner, port)
+
+
+class StockAPIStub:
+    """
+    Answers lookups of the stock API after `latency` seconds
+
+    Stocks are named after their ids. Ids whose last two digits are among the
+    top `missing_ratio` of 0-99 don't exist, e.g. 9999 with a ratio of 0.01.
+    A lookup by name finds 2330.
+    """
+
+    def __init__(self, latency: float = 0.05, missing_ratio: float = 0.0) -> None:
+        self.latency = latency
+        self.missing_ratio = missing_ratio
+        self.requests: List[str] = []
+        """Ids and names looked up, in order"""
+        self.app = web.Application()
+        self.app.router.add_get("/stocks/{stock_id}", self._stock)
+        self.app.router.add_get("/stocks", self._stock_by_name)
+        self.runner = web.AppRunner(self.app, access_log=None)
+
+    async def _stock(self, request: web.Request) -> web.Response:
+        stock_id = request.match_info["stock_id"]
+        self.requests.append(stock_id)
+        await asyncio.sleep(self.latency)
+        if int(stock_id) % 100 >= 100 - self.missing_ratio * 100:
+            return web.json_response({"detail": "not found"}, status=404)
+        return web.json_response({"id": stock_id, "name": f"股票{stock_id}"})
+
+    async def _stock_by_name(self, request: web.Request) -> web.Response:
+        name = request.query["name"]
+        self.requests.append(name)
+        await asyncio.sleep(self.latency)
+        return web.json_response({"id": "2330", "name": name})
+
+    async def start(self) -> str:
+        return await start_site(self.runner)
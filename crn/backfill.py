@@ -0,0 +1,212 @@
+import argparse
+import asyncio
+import logging
+import time
+from concurrent.futures import Executor
+from pathlib import Path
+from typing import Iterator, List, Optional, Set, Tuple
+
+from yarl import URL
+
+from .crawl import (
+    PAGES,
+    CrawledReport,
+    FetchScheduler,
+    get_report_url,
+    log_row_errors,
+    parse_report_page,
+)
+from .extract import Extractor, extract_rows_stream
+from .models import BackfilledPage
+from .persist import save_report_history
+from .utils import get_report_period, shift_period
+
+LOGGER_ = logging.getLogger(__name__)
+
+
+def iter_periods(
+    start: Tuple[int, int], end: Tuple[int, int]
+) -> Iterator[Tuple[int, int]]:
+    """Yield the (ROC year, month) periods from `start` to `end`, both included"""
+    period = start
+    while period <= end:
+        yield period
+        period = shift_period(*period, 1)
+
+
+def parse_period(value: str) -> Tuple[int, int]:
+    """Parse a period written as <ROC year>/<month>, an argparse type"""
+    try:
+        roc_year, month = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"{value!r} isn't <ROC year>/<month>")
+    if not 1 <= month <= 12:
+        raise argparse.ArgumentTypeError(f"{value!r} has an invalid month")
+    return roc_year, month
+
+
+def get_recorded_path(directory: Path, url: str) -> Path:
+    """
+    Recorded pages keep the company type and file name of their URL, e.g.
+    <directory>/sii/t21sc03_112_1_0.html
+    """
+    return directory.joinpath(*URL(url).parts[-2:])
+
+
+class BackfillProgress:
+    def __init__(self, total: int) -> None:
+        self.total = total
+        self.loaded = 0
+        self.skipped = 0
+        self.missing = 0
+        self.failed = 0
+        self.reports = 0
+        self.started = time.monotonic()
+
+    @property
+    def done(self) -> int:
+        return self.loaded + self.skipped + self.missing + self.failed
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def __str__(self) -> str:
+        elapsed = self.elapsed or 1e-9
+        return (
+            f"{self.done}/{self.total} pages, {self.loaded} loaded, "
+            f"{self.skipped} already loaded, {self.missing} missing, "
+            f"{self.failed} failed, {self.reports} reports in {self.elapsed:.1f}s "
+            f"({self.loaded / elapsed:.2f} pages/s, {self.reports / elapsed:.0f} reports/s)"
+        )
+
+
+class Backfill:
+    """
+    Crawl and bulk load the revenue reports of past periods
+
+    Every page is loaded in its own transaction along with a `BackfilledPage`
+    checkpoint, an interrupted backfill resumes with the pages it didn't load.
+    Pages come from MOPS through a `FetchScheduler`, which limits how fast
+    pages are requested, or from a directory of recorded pages.
+
+    Parameters:
+        scheduler: Fetches pages from MOPS, None to read them from `pages_dir`
+        pages_dir: Directory of recorded pages, see `get_recorded_path`
+        record: Save the pages fetched from MOPS to `pages_dir`
+        workers: Number of pages processed concurrently
+        extractor: Turns a page into rows, the same as the crawl's
+        executor: Executor pages are parsed in, None for the default executor
+    """
+
+    def __init__(
+        self,
+        *,
+        scheduler: Optional[FetchScheduler] = None,
+        pages_dir: Optional[Path] = None,
+        record: bool = False,
+        workers: int = 4,
+        extractor: Extractor = extract_rows_stream,
+        executor: Optional[Executor] = None,
+    ) -> None:
+        if scheduler is None and pages_dir is None:
+            raise ValueError("Either scheduler or pages_dir must be given")
+        if record and (scheduler is None or pages_dir is None):
+            raise ValueError("Recording pages needs both scheduler and pages_dir")
+        if workers <= 0:
+            raise ValueError("Parameter workers must be a positive integer")
+
+        self.scheduler = scheduler
+        self.pages_dir = pages_dir
+        self.record = record
+        self.workers = workers
+        self.extractor = extractor
+        self.executor = executor
+        # Pages of the same period may share stocks, load one page at a time
+        self._save_lock = asyncio.Lock()
+
+    async def _read(self, url: str) -> Optional[bytes]:
+        if self.scheduler is None:
+            path = get_recorded_path(self.pages_dir, url)  # type: ignore
+            return path.read_bytes() if path.exists() else None
+
+        page = await self.scheduler.fetch(url)
+        if page is None:
+            return None
+        if self.record:
+            path = get_recorded_path(self.pages_dir, url)  # type: ignore
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(page.content)
+        return page.content
+
+    async def _load(
+        self, roc_year: int, month: int, url: str, progress: BackfillProgress
+    ) -> None:
+        content = await self._read(url)
+        if content is None:
+            LOGGER_.warning(f"{url} doesn't exist")
+            progress.missing += 1
+            return
+
+        batch = await asyncio.get_running_loop().run_in_executor(
+            self.executor, parse_report_page, content, self.extractor
+        )
+        log_row_errors(url, batch)
+        stock_ids: Set[str] = set()
+        crawled: List[CrawledReport] = []
+        for i, stock_id in enumerate(batch.stock_ids):
+            if stock_id in stock_ids:
+                continue
+            stock_ids.add(stock_id)
+            crawled.append(
+                CrawledReport(stock_id, batch.stock_names[i], batch.get_report(i))
+            )
+
+        async with self._save_lock:
+            saved = await save_report_history(
+                roc_year, month, crawled, BackfilledPage(url=url)
+            )
+        progress.loaded += 1
+        progress.reports += saved
+        LOGGER_.info(f"Loaded {saved} reports from {url}, {progress}")
+
+    async def run(
+        self, start: Tuple[int, int], end: Tuple[int, int]
+    ) -> BackfillProgress:
+        """
+        Backfill the (ROC year, month) periods from `start` to `end`
+
+        Raises:
+            ValueError: The range includes the current period, its reports are
+                saved by the crawl so that followers are notified
+        """
+        if end >= get_report_period():
+            raise ValueError("Only periods before the current one can be backfilled")
+
+        pages = [
+            (roc_year, month, get_report_url(company_type, roc_year, month, area))
+            for roc_year, month in iter_periods(start, end)
+            for company_type, area in PAGES
+        ]
+        progress = BackfillProgress(len(pages))
+        loaded = set(
+            await BackfilledPage.filter(
+                url__in=[url for _, _, url in pages]
+            ).values_list("url", flat=True)
+        )
+        progress.skipped = len(loaded)
+        LOGGER_.info(f"Backfilling {len(pages)} pages, {len(loaded)} already loaded")
+
+        pending = iter(page for page in pages if page[2] not in loaded)
+
+        async def worker() -> None:
+            for roc_year, month, url in pending:
+                try:
+                    await self._load(roc_year, month, url, progress)
+                except Exception:
+                    LOGGER_.exception(f"Failed to backfill {url}")
+                    progress.failed += 1
+
+        await asyncio.gather(*(worker() for _ in range(self.workers)))
+        LOGGER_.info(f"Backfill finished, {progress}")
+        return progress
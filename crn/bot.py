@@ -1,20 +1,33 @@
 import logging
 import os
 import sys
+from concurrent.futures import ProcessPoolExecutor
 from datetime import timedelta
 from pathlib import Path
+from typing import Tuple
+from urllib.parse import parse_qs, quote
 
 from aiohttp import web
 from line import Bot
 from line.ext.notify import LineNotifyAPI
-from linebot.v3.webhooks import FollowEvent, MessageEvent
-from tortoise import Tortoise
+from linebot.v3.webhooks import FollowEvent, MessageEvent, PostbackEvent
 from tortoise.exceptions import IntegrityError
 
-from .crawl import crawl_monthly_revenue_reports
-from .models import RevenueReport, Stock, User
+from .cache import ReportMessageCache, UserCache
+from .crawl import MOPS_URL, crawl_monthly_revenue_reports
+from .db import close_db, init_db
+from .directory import StockDirectory
+from .events import EventQueue
+from .extract import EXTRACTORS
+from .followers import FollowerGraph
+from .http import CRAWL, NOTIFY, STOCK_API, create_session
+from .metrics import METRICS, install_query_counter
+from .models import Stock, User
+from .notify import NotifyDispatcher, Outbox
+from .persist import roll_over_reports, save_revenue_reports
 from .rich_menu import RICH_MENU
-from .utils import get_now, get_report_title, get_today
+from .scheduler import CronSchedule, Job, Scheduler
+from .utils import SingleFlight, get_report_period
 
 LOGGER_ = logging.getLogger(__name__)
 
@@ -44,9 +57,10 @@ class CompanyRevenueNotifier(Bot):
         user = await User.get_or_none(line_notify_state=state)
         if user and isinstance(code, str):
             access_token = await self.line_notify_api.get_access_token(code)
-            user.line_notify_token = access_token
-            user.line_notify_state = None
-            await user.save()
+            await self.user_cache.update(
+                user, line_notify_token=access_token, line_notify_state=None
+            )
+            self.followers.set_notify(user.id, True)
             await self.line_notify_api.notify(
                 access_token,
                 message="\n✅ LINE Notify 設定成功\n點擊此連結返回機器人: https://line.me/R/oaMessage/%40758svcdf",
@@ -57,86 +71,211 @@ class CompanyRevenueNotifier(Bot):
             headers={"Location": "https://line.me/R/oaMessage/%40linenotify"},
         )
 
+    async def _metrics(self, request: web.Request) -> web.Response:
+        return web.Response(text=METRICS.render())
+
+    # Webhook events are only queued here, so the webhook is answered right
+    # away, and processed by the event queue's workers in the order each user
+    # sent them
     async def on_follow(self, event: FollowEvent) -> None:
-        try:
-            await User.create(id=event.source.user_id)  # type: ignore
-        except IntegrityError:
-            pass
+        await self.events.put(event.source.user_id, self._on_follow, event)  # type: ignore
 
     async def on_message(self, event: MessageEvent) -> None:
+        await self.events.put(event.source.user_id, self._on_message, event)  # type: ignore
+
+    async def on_postback(self, event: PostbackEvent) -> None:
+        await self.events.put(event.source.user_id, self._on_postback, event)  # type: ignore
+
+    async def _on_follow(self, event: FollowEvent) -> None:
+        with METRICS.span("crn_webhook_seconds", event="follow"):
+            try:
+                await User.create(id=event.source.user_id)  # type: ignore
+            except IntegrityError:
+                pass
+            self.user_cache.invalidate(event.source.user_id)  # type: ignore
+
+    async def _on_message(self, event: MessageEvent) -> None:
         if event.message is None:
             return
-        text: str = event.message.text  # type: ignore
-        user = await User.get(id=event.source.user_id)  # type: ignore
-        if user.temp_data:
-            event.message.text = user.temp_data.format(text=text)  # type: ignore
+        with METRICS.span("crn_webhook_seconds", event="message"):
+            text: str = event.message.text  # type: ignore
+            user = await self.user_cache.get(event.source.user_id)  # type: ignore
+            if user.temp_data:
+                # The text becomes a query string value, "&" or "=" in it would
+                # change the command
+                event.message.text = user.temp_data.format(text=quote(text))  # type: ignore
+
+            await super().on_message(event)
 
-        await super().on_message(event)
+    async def _on_postback(self, event: PostbackEvent) -> None:
+        # Cog commands are dispatched from postbacks, time them per command
+        command = parse_qs(event.postback.data).get("cmd", ["unknown"])[0]
+        with METRICS.span("crn_command_seconds", command=command):
+            await super().on_postback(event)
+
+    def _setup_scheduler(self) -> None:
+        self.scheduler = Scheduler()
+        self.scheduler.add_job(
+            Job("roll_over_reports", self.roll_over_reports, CronSchedule("0 0 1 * *"))
+        )
+        # Poll often while companies are filing, back off when nothing changes
+        self.scheduler.add_job(
+            Job(
+                "crawl_and_save_revenue_reports",
+                self.crawl_and_save_revenue_reports,
+                CronSchedule(os.getenv("CRAWL_SCHEDULE") or "* 7-22 1-15 * *"),
+                min_interval=timedelta(
+                    minutes=int(os.getenv("CRAWL_MIN_INTERVAL") or 5)
+                ),
+                max_interval=timedelta(
+                    minutes=int(os.getenv("CRAWL_MAX_INTERVAL") or 60)
+                ),
+                peak=CronSchedule(
+                    os.getenv("CRAWL_PEAK_SCHEDULE") or "* 8-18 5-10 * *"
+                ),
+                peak_interval=timedelta(
+                    minutes=int(os.getenv("CRAWL_PEAK_INTERVAL") or 10)
+                ),
+            )
+        )
 
     async def run_tasks(self) -> None:
-        now = get_now()
-        if now.hour == 0 and now.minute < 1 and now.day == 1:
-            await self.delete_reports()
-        elif now.hour in {9, 17} and now.minute < 1 and now.day <= 15:
-            await self.crawl_and_save_revenue_reports()
-
-    async def delete_reports(self):
-        LOGGER_.info("Deleting revenue reports")
-        await Stock.raw("UPDATE stock SET revenue_report_id = NULL")
-        await RevenueReport.all().delete()
-        LOGGER_.info("Deleted all revenue reports")
-
-    async def crawl_and_save_revenue_reports(self) -> None:
+        self.scheduler.tick()
+
+    async def roll_over_reports(self) -> None:
+        """
+        Start a new report period, reports of past periods are kept until the
+        retention policy prunes them
+        """
+        LOGGER_.info("Rolling over revenue reports")
+        await roll_over_reports(int(os.getenv("REPORT_RETENTION_MONTHS") or 60))
+        self.report_messages.clear()
+        LOGGER_.info("Rolled over revenue reports")
+
+    async def crawl_and_save_revenue_reports(self) -> bool:
+        """
+        Crawl and save the reports of the current period, callers arriving while
+        a crawl of the period is running wait for it instead of starting another
+
+        Returns:
+            Whether any new revenue reports were found
+        """
+        roc_year, month = get_report_period()
+        if (roc_year, month) in self.crawls:
+            LOGGER_.info("Waiting for the running crawl of revenue reports")
+        return await self.crawls.do(
+            (roc_year, month),
+            lambda: self._crawl_and_save_revenue_reports(roc_year, month),
+        )
+
+    async def _crawl_and_save_revenue_reports(self, roc_year: int, month: int) -> bool:
         LOGGER_.info("Crawling revenue reports")
-        today = get_today()
-        last_month = today - timedelta(days=today.day)
-        roc_year = last_month.year - 1911
-        try:
-            reports = await crawl_monthly_revenue_reports(
-                self.session, roc_year, last_month.month
+        known_stock_ids = set(
+            await Stock.filter(revenue_report_id__isnull=False).values_list(
+                "id", flat=True
             )
+        )
+        try:
+            with METRICS.span("crn_stage_seconds", stage="crawl"):
+                result = await crawl_monthly_revenue_reports(
+                    self.crawl_session,
+                    roc_year,
+                    month,
+                    concurrency=int(os.getenv("CRAWL_CONCURRENCY") or 4),
+                    extractor=EXTRACTORS[os.getenv("CRAWL_EXTRACTOR") or "stream"],
+                    executor=self.process_pool,
+                    incremental=True,
+                    known_stock_ids=known_stock_ids,
+                    # Can be pointed to a stub serving recorded pages
+                    base_url=os.getenv("MOPS_URL") or MOPS_URL,
+                )
         except Exception:
             LOGGER_.exception("Failed to crawl revenue reports")
-            return
+            return False
 
-        LOGGER_.info(f"Crawled {len(reports)} revenue reports")
-        for stock, report in reports:
-            if stock.revenue_report:
-                continue
+        LOGGER_.info(f"Crawled {len(result.reports)} new revenue reports")
+        self.stock_directory.update(
+            (report.stock_id, report.stock_name) for report in result.reports
+        )
+        with METRICS.span("crn_stage_seconds", stage="persist"):
+            await self.followers.sync()
+            saved = await save_revenue_reports(
+                result.reports,
+                result.pages,
+                period=(roc_year, month),
+                followers=self.followers,
+            )
+        for _, report in saved:
+            self.report_messages.set(report.id, report.message)  # type: ignore
+        self.outbox.wake()
+
+        LOGGER_.info("Saved all revenue reports")
+        return bool(result.reports)
 
-            await report.save()
-            stock.revenue_report = report
-            await stock.save()
+    async def setup_hook(self) -> None:
+        install_query_counter()
+        await init_db()
 
-            users = await stock.users.all()
+        self.stock_directory = StockDirectory()
+        await self.stock_directory.load()
+        self.user_cache = UserCache(ttl=float(os.getenv("USER_CACHE_TTL") or 300))
+        self.report_messages = ReportMessageCache()
+        self.followers = FollowerGraph()
+        await self.followers.load()
+        METRICS.add_cache("users", self.user_cache)
+        METRICS.add_cache("report_messages", self.report_messages)
+        METRICS.add_cache("stock_directory", self.stock_directory)
 
-            for user in users:
-                if user.line_notify_token is None:
-                    continue
-                await self.line_notify_api.notify(
-                    user.line_notify_token,
-                    message=f"\n{stock} {get_report_title()}\n\n{report}",
-                )
+        # Decoding and parsing crawled pages is CPU bound, keep it off the event
+        # loop so webhooks are still answered during a crawl
+        self.process_pool = ProcessPoolExecutor(
+            max_workers=int(os.getenv("CRAWL_WORKERS") or 2)
+        )
 
-        LOGGER_.info("Saved all revenue reports")
+        self.crawl_session = create_session(CRAWL)
+        self.stock_api_session = create_session(STOCK_API)
+        self.notify_session = create_session(NOTIFY)
+        self.notify_dispatcher = NotifyDispatcher(
+            self.notify_session, workers=int(os.getenv("NOTIFY_WORKERS") or 8)
+        )
+        self.outbox = Outbox(
+            self.notify_dispatcher,
+            self.report_messages,
+            batch_size=int(os.getenv("OUTBOX_BATCH_SIZE") or 500),
+        )
+        self.outbox.start()
 
-    async def setup_hook(self) -> None:
-        await Tortoise.init(
-            db_url=os.getenv("DB_URL") or "sqlite://db.sqlite3",
-            modules={"models": ["crn.models"]},
+        self.events = EventQueue(
+            workers=int(os.getenv("EVENT_WORKERS") or 16),
+            maxsize=int(os.getenv("EVENT_QUEUE_SIZE") or 10000),
         )
-        await Tortoise.generate_schemas()
+        self.events.start()
+        METRICS.add_gauge("crn_event_queue_size", lambda: len(self.events))
+        METRICS.add_gauge("crn_event_workers_busy", lambda: self.events.busy)
 
         await self.delete_all_rich_menus()
         rich_menu_id = await self.create_rich_menu(RICH_MENU, "assets/rich_menu.png")
         await self.line_bot_api.set_default_rich_menu(rich_menu_id)
 
+        self.crawls: SingleFlight[Tuple[int, int], bool] = SingleFlight()
         self._setup_line_notify()
-        self.app.add_routes([web.post("/line-notify", self._line_notify_callback)])
+        self._setup_scheduler()
+        self.app.add_routes(
+            [
+                web.post("/line-notify", self._line_notify_callback),
+                web.get("/metrics", self._metrics),
+            ]
+        )
 
         for cog in Path("crn/cogs").glob("*.py"):
             LOGGER_.info("Loading cog %s", cog.stem)
             self.add_cog(f"crn.cogs.{cog.stem}")
 
     async def on_close(self) -> None:
-        await Tortoise.close_connections()
+        await self.events.stop()
+        await self.outbox.stop()
+        await close_db()
+        self.process_pool.shutdown(cancel_futures=True)
+        await self.crawl_session.close()
+        await self.stock_api_session.close()
+        await self.notify_session.close()
@@ -0,0 +1,210 @@
+import time
+from collections import OrderedDict
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Generic,
+    Hashable,
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+)
+
+from .models import RevenueReport, Stock, User
+from .utils import SingleFlight, format_report_title
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class TTLCache(Generic[K, V]):
+    """
+    A cache evicting entries after `ttl` seconds and the least recently used
+    entry once it holds `maxsize` entries
+
+    Parameters:
+        maxsize: Maximum number of entries
+        ttl: Default number of seconds an entry is kept
+        clock: Returns the current time in seconds, replaceable in tests
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 1024,
+        ttl: float = 3600.0,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        if maxsize <= 0:
+            raise ValueError("Parameter maxsize must be a positive integer")
+
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        # key -> (expiry, value)
+        self._data: OrderedDict[K, Tuple[float, V]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def lookup(self, key: K) -> Tuple[bool, Optional[V]]:
+        """
+        Returns:
+            Whether the key is cached and its value, the value may be a cached None
+        """
+        entry = self._data.get(key)
+        if entry is None or entry[0] <= self.clock():
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return False, None
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return True, entry[1]
+
+    def get(self, key: K) -> Optional[V]:
+        return self.lookup(key)[1]
+
+    def peek(self, key: K) -> Optional[V]:
+        """Get a value without counting a hit or miss or refreshing its recency"""
+        entry = self._data.get(key)
+        if entry is None or entry[0] <= self.clock():
+            return None
+        return entry[1]
+
+    def set(self, key: K, value: V, ttl: Optional[float] = None) -> None:
+        self._data[key] = (self.clock() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: K) -> None:
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+
+class UserCache:
+    """
+    Per-process cache of `User` rows for the webhook hot path
+
+    Writes go through `update`, which saves only the changed fields and keeps
+    the cached row in sync. Rows expire after `ttl` seconds, which bounds how
+    stale a row written by another process can be, `invalidate` drops a row
+    right away. Concurrent misses of the same user share one query.
+
+    Parameters:
+        maxsize: Maximum number of cached users
+        ttl: Seconds a user is cached
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 300.0) -> None:
+        self._cache: TTLCache[str, User] = TTLCache(maxsize, ttl)
+        self._loads: SingleFlight[str, User] = SingleFlight()
+
+    @property
+    def hits(self) -> int:
+        """Lookups answered without querying the user"""
+        return self._cache.hits + self._loads.shared
+
+    @property
+    def misses(self) -> int:
+        """Lookups that queried the user"""
+        return self._cache.misses - self._loads.shared
+
+    async def get(self, user_id: str) -> User:
+        """
+        Raises:
+            DoesNotExist: The user doesn't exist
+        """
+        cached, user = self._cache.lookup(user_id)
+        if cached and user is not None:
+            return user
+
+        async def load() -> User:
+            user = await User.get(id=user_id)
+            self._cache.set(user_id, user)
+            return user
+
+        return await self._loads.do(user_id, load)
+
+    async def update(self, user: User, **fields: Any) -> None:
+        for name, value in fields.items():
+            setattr(user, name, value)
+        await user.save(update_fields=list(fields))
+
+        cached = self._cache.peek(user.id)
+        if cached is not None and cached is not user:
+            for name, value in fields.items():
+                setattr(cached, name, value)
+
+    def invalidate(self, user_id: str) -> None:
+        self._cache.pop(user_id)
+
+
+class ReportMessageCache:
+    """
+    Notification texts of revenue reports keyed by report id
+
+    Filled when reports are saved and read by the outbox and `view_report`,
+    must be cleared when the reports are deleted.
+
+    Parameters:
+        maxsize: Maximum number of cached texts
+    """
+
+    def __init__(self, maxsize: int = 4096) -> None:
+        # Texts never change, they only go away with their report
+        self._cache: TTLCache[int, str] = TTLCache(maxsize, float("inf"))
+
+    @property
+    def hits(self) -> int:
+        return self._cache.hits
+
+    @property
+    def misses(self) -> int:
+        return self._cache.misses
+
+    def set(self, report_id: int, message: str) -> None:
+        self._cache.set(report_id, message)
+
+    async def get_many(self, report_ids: Iterable[int]) -> Dict[int, str]:
+        result: Dict[int, str] = {}
+        missing: List[int] = []
+        for report_id in set(report_ids):
+            message = self._cache.get(report_id)
+            if message is None:
+                missing.append(report_id)
+            else:
+                result[report_id] = message
+        if not missing:
+            return result
+
+        reports = await RevenueReport.filter(id__in=missing)
+        stocks = {
+            stock.id: stock
+            for stock in await Stock.filter(
+                id__in={report.stock_id for report in reports}
+            )
+        }
+        for report in reports:
+            # Messages of past periods are dropped when they're pruned
+            message = report.message or report.render(
+                stocks[report.stock_id],  # type: ignore
+                format_report_title(report.roc_year, report.month),  # type: ignore
+            )
+            self._cache.set(report.id, message)
+            result[report.id] = message
+        return result
+
+    async def get(self, report_id: int) -> Optional[str]:
+        return (await self.get_many((report_id,))).get(report_id)
+
+    def clear(self) -> None:
+        self._cache.clear()
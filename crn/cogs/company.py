@@ -1,4 +1,5 @@
 from typing import Any, List, Optional
+from urllib.parse import quote
 
 from line import Cog, Context, command
 from line.models import (
@@ -13,8 +14,12 @@ from line.models import (
 )
 
 from ..bot import CompanyRevenueNotifier
-from ..models import Stock, User
-from ..utils import get_report_title, split_list
+from ..followers import get_followed_stocks
+from ..models import Stock
+from ..utils import get_report_title
+
+PAGE_SIZE = 10
+"""Maximum number of columns in a carousel"""
 
 
 class CompanyCog(Cog):
@@ -26,7 +31,7 @@ class CompanyCog(Cog):
     async def add_company(
         self, ctx: Context, stock_id_or_name: Optional[str] = None
     ) -> Any:
-        user = await User.get(id=ctx.user_id)
+        user = await self.bot.user_cache.get(ctx.user_id)
         if not user.line_notify_token:
             return await ctx.reply_text(
                 "❌ 錯誤: 目前尚未設定 LINE Notify\n\n您將無法在月營收公佈時收到通知, 請先點擊「推播設定」進行設定"
@@ -49,55 +54,36 @@ class CompanyCog(Cog):
         )
 
         if stock_id_or_name is None:
-            user.temp_data = "cmd=add_company&stock_id_or_name={text}"
-            await user.save()
+            await self.bot.user_cache.update(
+                user, temp_data="cmd=add_company&stock_id_or_name={text}"
+            )
 
             return await ctx.reply_multiple([template_msg])
 
-        if stock_id_or_name.isdigit():
-            stock = await Stock.get_or_none(id=stock_id_or_name)
-            if stock is None:
-                async with self.bot.session.get(
-                    f"https://stock-api.seriaati.xyz/stocks/{stock_id_or_name}"
-                ) as resp:
-                    if resp.status != 200:
-                        return await ctx.reply_multiple(
-                            [
-                                TextMessage(
-                                    f"❌ 錯誤: 找不到股票代號為 {stock_id_or_name} 的公司\n請檢查後重新輸入"
-                                ),
-                                template_msg,
-                            ]
-                        )
-
-                    stock = await Stock.create(
-                        id=stock_id_or_name, name=(await resp.json())["name"]
-                    )
-        else:
-            stock = await Stock.get_or_none(name=stock_id_or_name)
-            if stock is None:
-                async with self.bot.session.get(
-                    "https://stock-api.seriaati.xyz/stocks",
-                    params={"name": stock_id_or_name},
-                ) as resp:
-                    if resp.status != 200:
-                        return await ctx.reply_multiple(
-                            [
-                                TextMessage(
-                                    f"❌ 錯誤: 找不到股票簡稱為 {stock_id_or_name} 的公司\n請檢查後重新輸入"
-                                ),
-                                template_msg,
-                            ]
-                        )
-
-                    stock = await Stock.create(
-                        id=(await resp.json())["id"], name=stock_id_or_name
-                    )
+        directory = self.bot.stock_directory
+        found = await directory.resolve(self.bot.stock_api_session, stock_id_or_name)
+        if found is None:
+            kind = "代號" if stock_id_or_name.isdigit() else "簡稱"
+            message = f"❌ 錯誤: 找不到股票{kind}為 {stock_id_or_name} 的公司\n請檢查後重新輸入"
+            candidates = directory.search(stock_id_or_name, limit=5)
+            if candidates:
+                message += "\n\n您是不是要找:\n" + "\n".join(
+                    f"[{stock_id}] {name}" for stock_id, name in candidates
+                )
+            return await ctx.reply_multiple([TextMessage(message), template_msg])
+
+        stock_id, stock_name = found
+        # get_or_create retries the get if another user created the stock first
+        stock, created = await Stock.get_or_create(
+            id=stock_id, defaults={"name": stock_name}
+        )
+        if created:
+            directory.update([(stock_id, stock_name)])
 
         await user.stocks.add(stock)
-        await user.save()
+        self.bot.followers.follow(user.id, stock.id)
 
-        if stock.revenue_report:
+        if stock.revenue_report_id is not None:  # type: ignore
             return await ctx.reply_multiple(
                 [
                     TextMessage(
@@ -117,22 +103,23 @@ class CompanyCog(Cog):
 
     @command
     async def open_keyboard(self, ctx: Context) -> Any:
-        user = await User.get(id=ctx.user_id)
-        user.temp_data = "cmd=add_company&stock_id_or_name={text}"
-        await user.save()
+        user = await self.bot.user_cache.get(ctx.user_id)
+        await self.bot.user_cache.update(
+            user, temp_data="cmd=add_company&stock_id_or_name={text}"
+        )
 
     @command
     async def add_company_cancel(self, ctx: Context) -> Any:
-        user = await User.get(id=ctx.user_id)
-        user.temp_data = None
-        await user.save()
+        user = await self.bot.user_cache.get(ctx.user_id)
+        await self.bot.user_cache.update(user, temp_data=None)
         await ctx.reply_text("已取消")
 
     @command
     async def search_company(self, ctx: Context) -> Any:
-        user = await User.get(id=ctx.user_id)
-        user.temp_data = "cmd=list_companies&stock_id_or_name={text}"
-        await user.save()
+        user = await self.bot.user_cache.get(ctx.user_id)
+        await self.bot.user_cache.update(
+            user, temp_data="cmd=list_companies&stock_id_or_name={text}"
+        )
         await ctx.reply_text(
             "請輸入欲查詢的公司的股票代號或簡稱\n例如:「2330」或「台積電」",
             quick_reply=QuickReply(
@@ -144,22 +131,21 @@ class CompanyCog(Cog):
     async def list_companies(
         self, ctx: Context, index: int = 0, stock_id_or_name: Optional[str] = None
     ) -> Any:
-        user = await User.get(id=ctx.user_id)
-        stocks = await user.stocks.all()
+        user = await self.bot.user_cache.get(ctx.user_id)
+        # Fetch one extra stock to know whether there's a next page
+        stocks = await get_followed_stocks(
+            user, index * PAGE_SIZE, PAGE_SIZE + 1, stock_id_or_name
+        )
         if not stocks:
+            if stock_id_or_name:
+                return await ctx.reply_text(
+                    f"找不到符合「{stock_id_or_name}」的已追蹤公司"
+                )
             return await ctx.reply_text("您尚未追蹤任何公司")
+        has_next_page = len(stocks) > PAGE_SIZE
 
-        if stock_id_or_name:
-            stocks = [
-                stock
-                for stock in stocks
-                if stock_id_or_name in stock.id or stock_id_or_name in stock.name
-            ]
-
-        split_stocks = split_list(stocks, 10)
         columns: List[CarouselColumn] = []
-        for stock in split_stocks[index]:
-            await stock.fetch_related("revenue_report")
+        for stock in stocks[:PAGE_SIZE]:
             column = CarouselColumn(
                 title=str(stock),
                 text=f"{'已' if stock.revenue_report else '尚未'}公佈 {get_report_title()}",
@@ -175,20 +161,25 @@ class CompanyCog(Cog):
             )
             columns.append(column)
 
+        search = (
+            f"&stock_id_or_name={quote(stock_id_or_name)}" if stock_id_or_name else ""
+        )
         quick_reply_items: List[QuickReplyItem] = []
         if index > 0:
             quick_reply_items.append(
                 QuickReplyItem(
                     action=PostbackAction(
-                        label="⬅️ 上一頁", data=f"cmd=list_companies&index={index-1}"
+                        label="⬅️ 上一頁",
+                        data=f"cmd=list_companies&index={index-1}{search}",
                     )
                 ),
             )
-        if index < len(split_stocks) - 1:
+        if has_next_page:
             quick_reply_items.append(
                 QuickReplyItem(
                     action=PostbackAction(
-                        label="➡️ 下一頁", data=f"cmd=list_companies&index={index+1}"
+                        label="➡️ 下一頁",
+                        data=f"cmd=list_companies&index={index+1}{search}",
                     )
                 )
             )
@@ -213,17 +204,17 @@ class CompanyCog(Cog):
 
     @command
     async def remove_company(self, ctx: Context, stock_id: str) -> Any:
-        user = await User.get(id=ctx.user_id)
+        user = await self.bot.user_cache.get(ctx.user_id)
         stock = await Stock.get(id=stock_id)
         await user.stocks.remove(stock)
-        await user.save()
+        self.bot.followers.unfollow(user.id, stock.id)
         await ctx.reply_text(f"已將 {stock} 移出追蹤清單")
 
     @command
     async def view_report(self, ctx: Context, stock_id: str) -> Any:
-        stock = await Stock.get(id=stock_id).prefetch_related("revenue_report")
-        report = stock.revenue_report
-        if report is None:
+        stock = await Stock.get(id=stock_id)
+        if stock.revenue_report_id is None:  # type: ignore
             return await ctx.reply_text(f"{stock} 尚未公佈 {get_report_title()}")
 
-        await ctx.reply_text(f"{stock} {get_report_title()}\n\n{report}")
+        message = await self.bot.report_messages.get(stock.revenue_report_id)  # type: ignore
+        await ctx.reply_text(message or f"{stock} 尚未公佈 {get_report_title()}")
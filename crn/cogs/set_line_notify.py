@@ -12,7 +12,6 @@ from line.models import (
 )
 
 from ..bot import CompanyRevenueNotifier
-from ..models import User
 
 
 class SetNotifyCog(Cog):
@@ -22,22 +21,23 @@ class SetNotifyCog(Cog):
 
     @command
     async def set_line_notify(self, ctx: Context, reset: bool = False) -> Any:
-        user = await User.get(id=ctx.user_id)
+        user = await self.bot.user_cache.get(ctx.user_id)
         if reset:
-            await self.bot.session.post(
+            async with self.bot.notify_session.post(
                 "https://notify-api.line.me/api/revoke",
                 headers={"Authorization": f"Bearer {user.line_notify_token}"},
-            )
+            ):
+                pass
 
-            user.line_notify_token = None
-            user.line_notify_state = None
-            await user.save()
+            await self.bot.user_cache.update(
+                user, line_notify_token=None, line_notify_state=None
+            )
+            self.bot.followers.set_notify(user.id, False)
             return await ctx.reply_text("✅ 已解除綁定 LINE Notify")
 
         if not user.line_notify_token:
             state = secrets.token_urlsafe()
-            user.line_notify_state = state
-            await user.save()
+            await self.bot.user_cache.update(user, line_notify_state=state)
 
             template = ButtonsTemplate(
                 "目前尚未設定 LINE Notify\n\n請參考上方圖示步驟, 點擊下方「前往設定」按鈕後進行設定",
@@ -61,19 +61,34 @@ class SetNotifyCog(Cog):
                 ]
             )
         else:
+            digest = user.digest_notifications
             template = ButtonsTemplate(
-                "✅ 已完成設定",
+                f"✅ 已完成設定\n彙整通知: {'開啟' if digest else '關閉'}",
                 [
                     PostbackAction("發送測試訊息", data="cmd=send_test_message"),
+                    PostbackAction(
+                        f"{'關閉' if digest else '開啟'}彙整通知",
+                        data=f"cmd=set_digest_notifications&enabled={int(not digest)}",
+                    ),
                     PostbackAction("解除綁定", data="cmd=reset_line_notify"),
                 ],
                 title="推播設定",
             )
             await ctx.reply_template("推播設定", template=template)
 
+    @command
+    async def set_digest_notifications(self, ctx: Context, enabled: int) -> Any:
+        user = await self.bot.user_cache.get(ctx.user_id)
+        await self.bot.user_cache.update(user, digest_notifications=bool(enabled))
+        if enabled:
+            return await ctx.reply_text(
+                "✅ 已開啟彙整通知\n\n同一時間公佈的月營收將合併為一則通知"
+            )
+        await ctx.reply_text("✅ 已關閉彙整通知\n\n每間公司公佈月營收時將分別通知")
+
     @command
     async def send_test_message(self, ctx: Context) -> Any:
-        user = await User.get(id=ctx.user_id)
+        user = await self.bot.user_cache.get(ctx.user_id)
         assert user.line_notify_token
 
         await self.bot.line_notify_api.notify(
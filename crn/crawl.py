@@ -1,49 +1,293 @@
 import asyncio
+import hashlib
 import logging
-from typing import List, Tuple
+import time
+from concurrent.futures import Executor
+from typing import AbstractSet, Dict, List, NamedTuple, Optional, Sequence, Tuple
 
 import aiohttp
-from bs4 import BeautifulSoup
 from fake_useragent import UserAgent
+from yarl import URL
 
-from .models import RevenueReport, Stock
+from .extract import Extractor, extract_rows_stream
+from .metrics import METRICS
+from .models import CrawledPage, RevenueReport
+from .parse import ReportBatch, parse_reports
+from .utils import TokenBucket
 
 LOGGER_ = logging.getLogger(__name__)
 ua = UserAgent()
 
+MOPS_URL = "https://mops.twse.com.tw"
+PAGES: Tuple[Tuple[str, int], ...] = (("sii", 0), ("sii", 1), ("otc", 0), ("otc", 1))
+
+
+class CrawledReport(NamedTuple):
+    stock_id: str
+    stock_name: str
+    report: RevenueReport
+
+
+class CrawlResult(NamedTuple):
+    reports: List[CrawledReport]
+    pages: List[CrawledPage]
+    """Validators of the changed pages, to be saved along with the reports"""
+
+
+class FetchedPage(NamedTuple):
+    url: str
+    status: int
+    content: bytes
+    etag: Optional[str]
+    last_modified: Optional[str]
+
+
+def get_report_url(
+    company_type: str, year: int, month: int, area: int, base_url: str = MOPS_URL
+) -> str:
+    return f"{base_url}/nas/t21/{company_type}/t21sc03_{year}_{month}_{area}.html"
+
+
+class FetchScheduler:
+    """
+    Fetch pages concurrently with a global concurrency limit, a per-host token
+    bucket and retries with exponential backoff on 5xx responses and timeouts
+
+    Parameters:
+        session: The aiohttp session to use
+        concurrency: Maximum number of requests in flight
+        rate: Requests per second allowed for each host
+        burst: Number of requests each host may receive at once
+        retries: Number of retries after the first attempt
+        backoff: Delay in seconds before the first retry, doubled on each retry
+        timeout: Total timeout in seconds of a single attempt
+    """
+
+    def __init__(
+        self,
+        session: aiohttp.ClientSession,
+        *,
+        concurrency: int = 4,
+        rate: float = 0.5,
+        burst: int = 4,
+        retries: int = 3,
+        backoff: float = 1.0,
+        timeout: float = 30.0,
+    ) -> None:
+        if concurrency <= 0:
+            raise ValueError("Parameter concurrency must be a positive integer")
+
+        self.session = session
+        self.rate = rate
+        self.burst = burst
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._buckets: Dict[str, TokenBucket] = {}
+
+    def _get_bucket(self, url: str) -> TokenBucket:
+        host = URL(url).host or ""
+        if host not in self._buckets:
+            self._buckets[host] = TokenBucket(self.rate, self.burst)
+        return self._buckets[host]
+
+    async def fetch(
+        self, url: str, headers: Optional[Dict[str, str]] = None
+    ) -> Optional[FetchedPage]:
+        """
+        Fetch a page, returns None if the server responds with a 4xx status
+        """
+        bucket = self._get_bucket(url)
+        attempt = 0
+        while True:
+            async with self._semaphore:
+                await bucket.acquire()
+                LOGGER_.info(f"Crawling {url}")
+                try:
+                    async with self.session.get(
+                        url, headers=headers, timeout=self.timeout
+                    ) as resp:
+                        METRICS.inc("crn_fetch_responses_total", status=resp.status)
+                        if resp.status < 400:
+                            return FetchedPage(
+                                url,
+                                resp.status,
+                                await resp.read(),
+                                resp.headers.get("ETag"),
+                                resp.headers.get("Last-Modified"),
+                            )
+                        if resp.status < 500:
+                            LOGGER_.warning(f"Got status {resp.status} from {url}")
+                            return None
+                        resp.raise_for_status()
+                except (
+                    asyncio.TimeoutError,
+                    aiohttp.ClientConnectionError,
+                    aiohttp.ClientResponseError,
+                    # The connection was closed in the middle of the page
+                    aiohttp.ClientPayloadError,
+                ) as e:
+                    if not isinstance(e, aiohttp.ClientResponseError):
+                        METRICS.inc("crn_fetch_responses_total", status="error")
+                    if attempt >= self.retries:
+                        raise
+                    error = e
+
+            delay = self.backoff * 2**attempt
+            attempt += 1
+            LOGGER_.warning(f"Failed to fetch {url} ({error!r}), retrying in {delay}s")
+            await asyncio.sleep(delay)
+
+    async def fetch_all(
+        self,
+        urls: Sequence[str],
+        headers: Optional[Sequence[Optional[Dict[str, str]]]] = None,
+    ) -> List[Optional[FetchedPage]]:
+        headers = headers or [None] * len(urls)
+        return list(
+            await asyncio.gather(
+                *(self.fetch(url, h) for url, h in zip(urls, headers, strict=True))
+            )
+        )
+
+
+def get_conditional_headers(page: Optional[CrawledPage]) -> Optional[Dict[str, str]]:
+    if page is None:
+        return None
+    headers: Dict[str, str] = {}
+    if page.etag:
+        headers["If-None-Match"] = page.etag
+    if page.last_modified:
+        headers["If-Modified-Since"] = page.last_modified
+    return headers
+
+
+def parse_page(content: bytes, extractor: Extractor) -> List[List[str]]:
+    """
+    Decode and extract the rows of a page, runs in the crawl executor
+    """
+    return extractor(content.decode("big5hkscs"))
+
+
+def parse_report_page(content: bytes, extractor: Extractor) -> ReportBatch:
+    """
+    Decode, extract and parse the reports of a page, runs in the crawl executor
+    """
+    return parse_reports(parse_page(content, extractor))
+
+
+def parse_report_page_timed(
+    content: bytes, extractor: Extractor
+) -> Tuple[ReportBatch, float, float]:
+    """
+    `parse_report_page` that also returns the seconds spent decoding and
+    parsing, metrics recorded in an executor's worker process would be lost
+    """
+    start = time.perf_counter()
+    text = content.decode("big5hkscs")
+    decoded = time.perf_counter()
+    batch = parse_reports(extractor(text))
+    return batch, decoded - start, time.perf_counter() - decoded
+
+
+def log_row_errors(url: str, batch: ReportBatch) -> None:
+    if not batch.errors:
+        return
+    METRICS.inc("crn_parse_errors_total", len(batch.errors))
+    for error in batch.errors:
+        LOGGER_.warning(
+            f"Skipped row {error.row} ({error.stock_id}) of {url}: {error.error}"
+        )
+
 
 async def crawl_monthly_revenue_reports(
     session: aiohttp.ClientSession,
     year: int,
     month: int,
-) -> List[Tuple[Stock, RevenueReport]]:
-    found_stock_ids: set[str] = set()
-    result: List[Tuple[Stock, RevenueReport]] = []
-    for company_type in ("sii", "otc"):
-        for area in (0, 1):
-            url = f"https://mops.twse.com.tw/nas/t21/{company_type}/t21sc03_{year}_{month}_{area}.html"
-            LOGGER_.info(f"Crawling {url}")
-
-            async with session.get(url) as resp:
-                text = await resp.text(encoding="big5hkscs")
-                soup = BeautifulSoup(text, "html.parser")
-                big_table = soup.find("table")
-                if big_table is None:
-                    continue
-                tables = big_table.tr.td.find_all("table")  # type: ignore
-                for table in tables:
-                    rows = table.find_all("tr")[4:-1]
-                    for row in rows:
-                        strings = [s.strip().replace(",", "") for s in row.strings]
-                        stock_id, stock_name = strings[0], strings[1]
-                        if stock_id in found_stock_ids:
-                            continue
-
-                        stock = await Stock.get_or_none(id=stock_id)
-                        if stock is None:
-                            stock = await Stock.create(id=stock_id, name=stock_name)
-                        result.append((stock, RevenueReport.parse(strings)))
-                        found_stock_ids.add(stock_id)
-
-            await asyncio.sleep(3.0)
-    return result
+    *,
+    concurrency: int = 4,
+    extractor: Extractor = extract_rows_stream,
+    executor: Optional[Executor] = None,
+    incremental: bool = False,
+    known_stock_ids: AbstractSet[str] = frozenset(),
+    base_url: str = MOPS_URL,
+) -> CrawlResult:
+    """
+    Crawl the monthly revenue reports of listed and OTC companies
+
+    Parameters:
+        incremental: Send conditional requests with the validators saved by the
+            last crawl and skip pages that are unchanged
+        known_stock_ids: Stocks whose rows are skipped, e.g. ones that already
+            have a report
+        base_url: Where the pages are crawled from, can be pointed to a local stub
+    """
+    urls = [
+        get_report_url(company_type, year, month, area, base_url)
+        for company_type, area in PAGES
+    ]
+    previous: Dict[str, CrawledPage] = (
+        {page.url: page for page in await CrawledPage.filter(url__in=urls)}
+        if incremental
+        else {}
+    )
+
+    scheduler = FetchScheduler(session, concurrency=concurrency)
+    with METRICS.span("crn_stage_seconds", stage="fetch"):
+        fetched = await scheduler.fetch_all(
+            urls, [get_conditional_headers(previous.get(url)) for url in urls]
+        )
+
+    changed: List[FetchedPage] = []
+    pages: List[CrawledPage] = []
+    for page in fetched:
+        if page is None:
+            continue
+        if page.status == 304:
+            LOGGER_.info(f"{page.url} is not modified")
+            continue
+
+        content_hash = hashlib.sha256(page.content).hexdigest()
+        last = previous.get(page.url)
+        if last is not None and last.content_hash == content_hash:
+            LOGGER_.info(f"{page.url} is unchanged")
+            continue
+
+        changed.append(page)
+        pages.append(
+            CrawledPage(
+                url=page.url,
+                etag=page.etag,
+                last_modified=page.last_modified,
+                content_hash=content_hash,
+            )
+        )
+
+    loop = asyncio.get_running_loop()
+    parsed = await asyncio.gather(
+        *(
+            loop.run_in_executor(
+                executor, parse_report_page_timed, page.content, extractor
+            )
+            for page in changed
+        )
+    )
+
+    found_stock_ids: set[str] = set(known_stock_ids)
+    reports: List[CrawledReport] = []
+    for page, (batch, decode_seconds, parse_seconds) in zip(changed, parsed):
+        METRICS.observe("crn_stage_seconds", decode_seconds, stage="decode")
+        METRICS.observe("crn_stage_seconds", parse_seconds, stage="parse")
+        log_row_errors(page.url, batch)
+        # Models are only created for the rows that are saved
+        for i, stock_id in enumerate(batch.stock_ids):
+            if stock_id in found_stock_ids:
+                continue
+
+            reports.append(
+                CrawledReport(stock_id, batch.stock_names[i], batch.get_report(i))
+            )
+            found_stock_ids.add(stock_id)
+
+    return CrawlResult(reports, pages)
@@ -0,0 +1,113 @@
+import asyncio
+import logging
+import os
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Optional
+
+from tortoise import Tortoise
+from tortoise.backends.base.config_generator import expand_db_url
+
+from .migrations import migrate
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None  # type: ignore
+
+LOGGER_ = logging.getLogger(__name__)
+
+DEFAULT_DB_URL = "sqlite://db.sqlite3"
+SQLITE_ENGINE = "tortoise.backends.sqlite"
+IMMEDIATE_SQLITE_ENGINE = "crn.sqlite"
+# Key of the Postgres advisory lock held while the schema is updated
+SCHEMA_LOCK_KEY = 0x63726E
+
+_initialized = False
+
+
+def get_db_config(db_url: str) -> Dict[str, Any]:
+    """
+    Build the Tortoise config of a database URL, settings in the URL's query
+    take precedence over the defaults here
+
+    SQLite gets WAL, which lets readers run during a write, NORMAL
+    synchronous, which is safe with WAL, and a busy timeout, so a process
+    waits for the other one's write instead of failing with "database is
+    locked". Its transactions are started with BEGIN IMMEDIATE, see
+    crn.sqlite. Postgres gets a connection pool of DB_POOL_MIN to DB_POOL_MAX
+    connections.
+    """
+    connection = expand_db_url(db_url)
+    credentials = connection["credentials"]
+    if connection["engine"] == SQLITE_ENGINE:
+        connection["engine"] = IMMEDIATE_SQLITE_ENGINE
+        credentials.setdefault("journal_mode", "WAL")
+        credentials.setdefault("synchronous", os.getenv("DB_SYNCHRONOUS") or "NORMAL")
+        credentials.setdefault(
+            "busy_timeout", int(os.getenv("DB_BUSY_TIMEOUT") or 10000)
+        )
+    else:
+        credentials.setdefault("minsize", int(os.getenv("DB_POOL_MIN") or 1))
+        credentials.setdefault("maxsize", int(os.getenv("DB_POOL_MAX") or 10))
+
+    return {
+        "connections": {"default": connection},
+        "apps": {"models": {"models": ["crn.models"], "default_connection": "default"}},
+    }
+
+
+@asynccontextmanager
+async def schema_lock(config: Dict[str, Any]) -> AsyncIterator[None]:
+    """
+    Hold a lock shared by all processes using the database while its schema
+    is updated, so the bot and the API don't both run the same DDL
+    """
+    connection = config["connections"]["default"]
+    if connection["engine"] != IMMEDIATE_SQLITE_ENGINE:
+        client = Tortoise.get_connection("default")
+        async with client.acquire_connection() as conn:
+            await conn.execute(f"SELECT pg_advisory_lock({SCHEMA_LOCK_KEY})")
+            try:
+                yield
+            finally:
+                await conn.execute(f"SELECT pg_advisory_unlock({SCHEMA_LOCK_KEY})")
+        return
+
+    file_path = connection["credentials"]["file_path"]
+    if fcntl is None or file_path == ":memory:":
+        yield
+        return
+
+    with open(f"{file_path}.lock", "w") as lock_file:
+        await asyncio.to_thread(fcntl.flock, lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+async def init_db(db_url: Optional[str] = None) -> None:
+    """
+    Connect to the database at `db_url`, DB_URL by default, and bring its
+    schema up to date
+
+    Raises:
+        RuntimeError: The database was already initialized in this process
+    """
+    global _initialized
+    if _initialized:
+        raise RuntimeError("The database is already initialized")
+    _initialized = True
+
+    config = get_db_config(db_url or os.getenv("DB_URL") or DEFAULT_DB_URL)
+    await Tortoise.init(config=config)
+    async with schema_lock(config):
+        await Tortoise.generate_schemas()
+        await migrate()
+    LOGGER_.info("Initialized the database")
+
+
+async def close_db() -> None:
+    global _initialized
+    await Tortoise.close_connections()
+    _initialized = False
@@ -0,0 +1,237 @@
+import asyncio
+import bisect
+import logging
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import aiohttp
+
+from .cache import TTLCache
+from .models import Stock
+from .utils import SingleFlight
+
+LOGGER_ = logging.getLogger(__name__)
+
+STOCK_API_URL = "https://stock-api.seriaati.xyz"
+
+
+class StockDirectory:
+    """
+    In-memory index of stock ids and names with prefix and substring search
+
+    Seeded from the `Stock` table and kept up to date with crawled rows and
+    newly created stocks. Lookups of stocks missing from the index go to the
+    stock API, its answers are cached, unknown stocks for a shorter time.
+
+    Parameters:
+        api_url: Base URL of the stock API
+        maxsize: Maximum number of cached stock API answers
+        ttl: Seconds a stock API answer is cached
+        negative_ttl: Seconds an unknown stock is cached
+    """
+
+    def __init__(
+        self,
+        *,
+        api_url: str = STOCK_API_URL,
+        maxsize: int = 4096,
+        ttl: float = 86400.0,
+        negative_ttl: float = 3600.0,
+    ) -> None:
+        self.api_url = api_url
+        self.negative_ttl = negative_ttl
+        self._names: Dict[str, str] = {}
+        self._ids_by_name: Dict[str, str] = {}
+        self._sorted_ids: List[str] = []
+        self._sorted_names: List[str] = []
+        self._hits = 0
+        # "id:<id>" or "name:<name>" -> (id, name), None if the stock doesn't exist
+        self._api_cache: TTLCache[str, Optional[Tuple[str, str]]] = TTLCache(
+            maxsize, ttl
+        )
+        # Concurrent lookups of the same stock share one stock API request
+        self._lookups: SingleFlight[str, Optional[Tuple[str, str]]] = SingleFlight()
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    @property
+    def hits(self) -> int:
+        """Lookups answered without asking the stock API"""
+        return self._hits + self._api_cache.hits + self._lookups.shared
+
+    @property
+    def misses(self) -> int:
+        """Lookups the stock API was asked for"""
+        return self._api_cache.misses - self._lookups.shared
+
+    async def load(self) -> None:
+        self.update(await Stock.all().values_list("id", "name"))  # type: ignore
+        LOGGER_.info(f"Loaded {len(self)} stocks into the stock directory")
+
+    def update(self, stocks: Iterable[Tuple[str, str]]) -> None:
+        changed = False
+        for stock_id, name in stocks:
+            if self._names.get(stock_id) == name:
+                continue
+            old_name = self._names.get(stock_id)
+            if old_name is not None and self._ids_by_name.get(old_name) == stock_id:
+                del self._ids_by_name[old_name]
+            self._names[stock_id] = name
+            self._ids_by_name[name] = stock_id
+            changed = True
+
+        if changed:
+            self._sorted_ids = sorted(self._names)
+            self._sorted_names = sorted(self._ids_by_name)
+
+    def get(self, stock_id_or_name: str) -> Optional[Tuple[str, str]]:
+        """Exact lookup by id or name in the index"""
+        if stock_id_or_name in self._names:
+            return stock_id_or_name, self._names[stock_id_or_name]
+        if stock_id_or_name in self._ids_by_name:
+            return self._ids_by_name[stock_id_or_name], stock_id_or_name
+        return None
+
+    @staticmethod
+    def _prefixed(keys: List[str], prefix: str) -> Iterable[str]:
+        for i in range(bisect.bisect_left(keys, prefix), len(keys)):
+            if not keys[i].startswith(prefix):
+                break
+            yield keys[i]
+
+    def search(self, query: str, limit: int = 10) -> List[Tuple[str, str]]:
+        """
+        Search stocks whose id or name contains the query, ones starting with
+        the query come first
+        """
+        found: Dict[str, str] = {}
+        for stock_id in self._prefixed(self._sorted_ids, query):
+            found.setdefault(stock_id, self._names[stock_id])
+        for name in self._prefixed(self._sorted_names, query):
+            found.setdefault(self._ids_by_name[name], name)
+
+        if len(found) < limit:
+            for stock_id, name in self._names.items():
+                if query in stock_id or query in name:
+                    found.setdefault(stock_id, name)
+                    if len(found) >= limit:
+                        break
+
+        return list(found.items())[:limit]
+
+    async def _fetch(
+        self,
+        session: aiohttp.ClientSession,
+        path: str,
+        params: Optional[Dict[str, str]],
+    ) -> Optional[Dict[str, str]]:
+        async with session.get(f"{self.api_url}{path}", params=params) as resp:
+            if resp.status != 200:
+                return None
+            return await resp.json()
+
+    async def resolve_id(
+        self, session: aiohttp.ClientSession, stock_id: str
+    ) -> Optional[Tuple[str, str]]:
+        """
+        Find the (id, name) of a stock by its id, asking the stock API if needed
+
+        Returns:
+            None if the stock doesn't exist
+        """
+        if stock_id in self._names:
+            self._hits += 1
+            return stock_id, self._names[stock_id]
+
+        key = f"id:{stock_id}"
+        cached, stock = self._api_cache.lookup(key)
+        if cached:
+            return stock
+
+        async def fetch() -> Optional[Tuple[str, str]]:
+            data = await self._fetch(session, f"/stocks/{stock_id}", None)
+            stock = (stock_id, data["name"]) if data else None
+            self._cache_api_result(key, stock)
+            return stock
+
+        return await self._lookups.do(key, fetch)
+
+    async def resolve_ids(
+        self,
+        session: aiohttp.ClientSession,
+        stock_ids: Iterable[str],
+        concurrency: int = 16,
+    ) -> Dict[str, Optional[Tuple[str, str]]]:
+        """
+        Find the (id, name) of many stocks by their ids, the ones missing from
+        the index are asked from the stock API concurrently, each id once
+
+        Returns:
+            The (id, name) of every id, None if the stock doesn't exist. Ids the
+            stock API couldn't be asked about are left out.
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def resolve(stock_id: str) -> Optional[Tuple[str, str]]:
+            async with semaphore:
+                return await self.resolve_id(session, stock_id)
+
+        unique_ids = list(dict.fromkeys(stock_ids))
+        results = await asyncio.gather(
+            *(resolve(stock_id) for stock_id in unique_ids), return_exceptions=True
+        )
+
+        stocks: Dict[str, Optional[Tuple[str, str]]] = {}
+        for stock_id, result in zip(unique_ids, results):
+            if isinstance(result, (aiohttp.ClientError, asyncio.TimeoutError)):
+                LOGGER_.warning(f"Failed to look up stock {stock_id}: {result!r}")
+                continue
+            if isinstance(result, BaseException):
+                raise result
+            stocks[stock_id] = result
+        return stocks
+
+    async def resolve_name(
+        self, session: aiohttp.ClientSession, name: str
+    ) -> Optional[Tuple[str, str]]:
+        """
+        Find the (id, name) of a stock by its name or the only stock in the index
+        with a name containing it, asking the stock API if needed
+
+        Returns:
+            None if the stock doesn't exist
+        """
+        if name in self._ids_by_name:
+            self._hits += 1
+            return self._ids_by_name[name], name
+
+        candidates = self.search(name, limit=2)
+        if len(candidates) == 1:
+            self._hits += 1
+            return candidates[0]
+
+        key = f"name:{name}"
+        cached, stock = self._api_cache.lookup(key)
+        if cached:
+            return stock
+
+        async def fetch() -> Optional[Tuple[str, str]]:
+            data = await self._fetch(session, "/stocks", {"name": name})
+            stock = (data["id"], name) if data else None
+            self._cache_api_result(key, stock)
+            return stock
+
+        return await self._lookups.do(key, fetch)
+
+    async def resolve(
+        self, session: aiohttp.ClientSession, stock_id_or_name: str
+    ) -> Optional[Tuple[str, str]]:
+        if stock_id_or_name.isdigit():
+            return await self.resolve_id(session, stock_id_or_name)
+        return await self.resolve_name(session, stock_id_or_name)
+
+    def _cache_api_result(self, key: str, stock: Optional[Tuple[str, str]]) -> None:
+        if stock is None:
+            self._api_cache.set(key, None, ttl=self.negative_ttl)
+        else:
+            self._api_cache.set(key, stock)
@@ -0,0 +1,113 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from .metrics import METRICS
+
+LOGGER_ = logging.getLogger(__name__)
+
+Handler = Callable[[Any], Awaitable[None]]
+
+
+class EventQueue:
+    """
+    Process webhook events in the background with a bounded worker pool, so
+    the webhook is answered as soon as its events are queued
+
+    Events with the same key, the user who sent them, are processed one at a
+    time in the order they were put, a user's `temp_data` is read and written
+    by the events in the order they were sent. Events of different users are
+    processed concurrently.
+
+    When `maxsize` events are waiting, `put` waits for a free slot, holding
+    the webhook open instead of growing without bounds.
+
+    Parameters:
+        workers: Number of events processed concurrently
+        maxsize: Maximum number of events waiting to be processed
+    """
+
+    def __init__(self, *, workers: int = 16, maxsize: int = 10000) -> None:
+        if workers <= 0:
+            raise ValueError("Parameter workers must be a positive integer")
+
+        self.workers = workers
+        self.maxsize = maxsize
+        # key -> events waiting, a key is in here while it's queued or processed
+        self._pending: Dict[str, Deque[Tuple[Handler, Any, float]]] = {}
+        self._ready: asyncio.Queue[str] = asyncio.Queue()
+        self._slots = asyncio.Semaphore(maxsize)
+        self._size = 0
+        self._busy = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._tasks: List[asyncio.Task[None]] = []
+
+    def __len__(self) -> int:
+        """Number of events waiting to be processed"""
+        return self._size
+
+    @property
+    def busy(self) -> int:
+        """Number of workers processing an event"""
+        return self._busy
+
+    def start(self) -> None:
+        if not self._tasks:
+            self._tasks = [
+                asyncio.create_task(self._work()) for _ in range(self.workers)
+            ]
+
+    async def stop(self, timeout: Optional[float] = 10.0) -> None:
+        """Wait up to `timeout` seconds for queued events, then stop the workers"""
+        if not self._tasks:
+            return
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            LOGGER_.warning(f"Dropping {self._size} unprocessed webhook events")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def put(self, key: str, handler: Handler, event: Any) -> None:
+        """Queue `handler(event)` after the events already queued for `key`"""
+        if self._slots.locked():
+            METRICS.inc("crn_event_queue_full_total")
+        await self._slots.acquire()
+
+        self._size += 1
+        self._idle.clear()
+        if key in self._pending:
+            self._pending[key].append((handler, event, time.perf_counter()))
+        else:
+            self._pending[key] = deque([(handler, event, time.perf_counter())])
+            self._ready.put_nowait(key)
+
+    async def _work(self) -> None:
+        while True:
+            key = await self._ready.get()
+            events = self._pending[key]
+            # Nothing else takes events of this key until it's removed below
+            while events:
+                handler, event, queued_at = events.popleft()
+                self._size -= 1
+                self._slots.release()
+                METRICS.observe(
+                    "crn_event_wait_seconds", time.perf_counter() - queued_at
+                )
+
+                self._busy += 1
+                try:
+                    await handler(event)
+                except Exception:
+                    LOGGER_.exception(f"Failed to process webhook event {event!r}")
+                finally:
+                    self._busy -= 1
+            del self._pending[key]
+
+            if not self._pending:
+                self._idle.set()
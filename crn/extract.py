@@ -0,0 +1,169 @@
+from html.parser import HTMLParser
+from typing import Callable, Dict, List, Optional, Tuple
+
+from bs4 import BeautifulSoup
+
+Extractor = Callable[[str], List[List[str]]]
+"""Turns a t21sc03 page into the rows of strings `crn.parse.parse_reports` expects"""
+
+VOID_ELEMENTS = frozenset(
+    (
+        "area",
+        "base",
+        "br",
+        "col",
+        "embed",
+        "hr",
+        "img",
+        "input",
+        "link",
+        "meta",
+        "param",
+        "source",
+        "track",
+        "wbr",
+    )
+)
+
+
+def clean_strings(strings: List[str]) -> List[str]:
+    return [s.strip().replace(",", "") for s in strings]
+
+
+def extract_rows_soup(text: str) -> List[List[str]]:
+    """
+    Extract rows by building a full BeautifulSoup tree, kept as the reference
+    implementation
+    """
+    soup = BeautifulSoup(text, "html.parser")
+    big_table = soup.find("table")
+    if big_table is None:
+        return []
+
+    result: List[List[str]] = []
+    tables = big_table.tr.td.find_all("table")  # type: ignore
+    for table in tables:
+        for row in table.find_all("tr")[4:-1]:
+            result.append(clean_strings(list(row.strings)))
+    return result
+
+
+class RowParser(HTMLParser):
+    """
+    Incremental parser yielding the same rows as `extract_rows_soup`
+
+    The rows of every table inside the first cell of the first table are
+    collected while the page is fed, without building a tree. Tags are matched
+    the way BeautifulSoup's html.parser builder does it: an end tag closes the
+    most recent open tag with the same name and stray end tags are ignored.
+    """
+
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=True)
+        # (tag, rows of the table or strings of the row)
+        self._stack: List[Tuple[str, Optional[List]]] = []
+        self._tables: List[List[List[str]]] = []
+        self._open_rows: List[List[str]] = []
+        self._open_tables: List[List[List[str]]] = []
+        self._big_table_depth: Optional[int] = None
+        self._first_row_depth: Optional[int] = None
+        self._container_depth: Optional[int] = None
+        self._done = False
+        self._in_data = False
+
+    @property
+    def rows(self) -> List[List[str]]:
+        result: List[List[str]] = []
+        for rows in self._tables:
+            result.extend(clean_strings(row) for row in rows[4:-1])
+        return result
+
+    def handle_starttag(self, tag: str, attrs: List[Tuple[str, Optional[str]]]) -> None:
+        self._in_data = False
+        if tag in VOID_ELEMENTS:
+            return
+
+        payload: Optional[List] = None
+        depth = len(self._stack)
+        if self._done:
+            pass
+        elif self._container_depth is not None:
+            if tag == "table":
+                payload = []
+                self._tables.append(payload)
+                self._open_tables.append(payload)
+            elif tag == "tr":
+                payload = []
+                self._open_rows.append(payload)
+                for rows in self._open_tables:
+                    rows.append(payload)
+        elif self._big_table_depth is None:
+            if tag == "table":
+                self._big_table_depth = depth
+        elif self._first_row_depth is None:
+            if tag == "tr":
+                self._first_row_depth = depth
+        elif tag == "td":
+            self._container_depth = depth
+
+        self._stack.append((tag, payload))
+
+    def handle_endtag(self, tag: str) -> None:
+        self._in_data = False
+        for i in range(len(self._stack) - 1, -1, -1):
+            if self._stack[i][0] == tag:
+                break
+        else:
+            return
+
+        while len(self._stack) > i:
+            self._pop()
+
+    def _pop(self) -> None:
+        tag, payload = self._stack.pop()
+        depth = len(self._stack)
+        if payload is not None:
+            if tag == "table":
+                self._open_tables.pop()
+            else:
+                self._open_rows.pop()
+
+        if depth == self._container_depth:
+            self._container_depth = None
+            self._done = True
+        elif depth == self._first_row_depth or depth == self._big_table_depth:
+            # BeautifulSoup fails on `big_table.tr.td` here, there are no rows
+            self._done = True
+
+    def handle_data(self, data: str) -> None:
+        if not self._open_rows or self._stack[-1][0] in {"script", "style"}:
+            return
+
+        # Text may arrive in several calls, BeautifulSoup joins it into one string
+        if self._in_data:
+            for row in self._open_rows:
+                row[-1] += data
+        else:
+            for row in self._open_rows:
+                row.append(data)
+        self._in_data = True
+
+    def handle_comment(self, data: str) -> None:
+        self._in_data = False
+
+
+def extract_rows_stream(text: str, chunk_size: int = 1 << 16) -> List[List[str]]:
+    """
+    Extract rows with `RowParser`, feeding the page in chunks
+    """
+    parser = RowParser()
+    for i in range(0, len(text), chunk_size):
+        parser.feed(text[i : i + chunk_size])
+    parser.close()
+    return parser.rows
+
+
+EXTRACTORS: Dict[str, Extractor] = {
+    "soup": extract_rows_soup,
+    "stream": extract_rows_stream,
+}
@@ -0,0 +1,152 @@
+import logging
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from pypika import Table
+from pypika.functions import Count
+from tortoise import Tortoise
+from tortoise.expressions import Q
+
+from .models import Stock, User
+from .utils import split_list
+
+LOGGER_ = logging.getLogger(__name__)
+
+USER_STOCK = Table("user_stock")
+
+
+async def count_follows() -> int:
+    conn = Tortoise.get_connection("default")
+    query = conn.query_class.from_(USER_STOCK).select(Count("*").as_("follows"))
+    _, rows = await conn.execute_query(str(query))
+    return rows[0]["follows"]
+
+
+async def get_followed_stocks(
+    user: User, offset: int, limit: int, search: Optional[str] = None
+) -> List[Stock]:
+    """
+    A page of the stocks a user follows ordered by id, along with their current
+    reports, in one query
+
+    The query starts from the user's rows of user_stock.
+    `Stock.filter(users__id=...)` joins the other way around and makes SQLite
+    scan every stock for every page.
+
+    Parameters:
+        search: Only the stocks whose id or name contains it
+    """
+    query = user.stocks.all()
+    if search:
+        query = query.filter(Q(id__contains=search) | Q(name__contains=search))
+    return (
+        await query.order_by("id")
+        .offset(offset)
+        .limit(limit)
+        .select_related("revenue_report")
+    )
+
+
+class FollowerGraph:
+    """
+    In-memory index of the followers of every stock, to find who to notify of
+    newly published reports without loading `User` models
+
+    Users are numbered by row, a stock's followers are an array of 4 byte rows
+    and whether a user has LINE Notify set up is one byte per row. Tokens
+    aren't kept, the outbox reads them when it sends.
+
+    The bot keeps it in sync with the follows it changes. The API process
+    adds follows too, `sync` reloads the index if the number of follows in
+    the database differs from the index.
+    """
+
+    def __init__(self) -> None:
+        self._user_ids: List[str] = []
+        self._rows: Dict[str, int] = {}
+        self._notify = bytearray()
+        self._followers: Dict[str, array] = {}
+        # Rows of user_stock, duplicates included, to tell when it drifted
+        self._follows = 0
+
+    def __len__(self) -> int:
+        """Number of follows"""
+        return self._follows
+
+    def _get_row(self, user_id: str) -> int:
+        row = self._rows.get(user_id)
+        if row is None:
+            row = self._rows[user_id] = len(self._user_ids)
+            self._user_ids.append(user_id)
+            self._notify.append(0)
+        return row
+
+    async def load(self, chunk_size: int = 100) -> None:
+        """
+        Build the index from the database, the follows of `chunk_size` stocks
+        are read at a time
+        """
+        graph = FollowerGraph()
+        graph._follows = await count_follows()
+        for user_id, token in await User.all().values_list("id", "line_notify_token"):
+            graph._notify[graph._get_row(user_id)] = token is not None
+
+        conn = Tortoise.get_connection("default")
+        stock_ids: List[str] = await Stock.all().values_list("id", flat=True)  # type: ignore
+        for chunk in split_list(stock_ids, chunk_size):
+            query = (
+                conn.query_class.from_(USER_STOCK)
+                .select(USER_STOCK.stock_id, USER_STOCK.user_id)
+                .distinct()
+                .where(USER_STOCK.stock_id.isin(chunk))
+            )
+            _, rows = await conn.execute_query(str(query))
+            for row in rows:
+                followers = graph._followers.get(row["stock_id"])
+                if followers is None:
+                    followers = graph._followers[row["stock_id"]] = array("I")
+                followers.append(graph._get_row(row["user_id"]))
+
+        # Swapped in at once, fan-outs never see a half built index
+        vars(self).update(vars(graph))
+        LOGGER_.info(
+            f"Loaded {self._follows} follows of {len(self._user_ids)} users "
+            "into the follower graph"
+        )
+
+    async def sync(self) -> None:
+        """Reload the index if it drifted from the database"""
+        if await count_follows() != self._follows:
+            LOGGER_.info("Follower graph drifted from the database, reloading")
+            await self.load()
+
+    def follow(self, user_id: str, stock_id: str) -> None:
+        followers = self._followers.setdefault(stock_id, array("I"))
+        row = self._get_row(user_id)
+        if row not in followers:
+            followers.append(row)
+            self._follows += 1
+
+    def unfollow(self, user_id: str, stock_id: str) -> None:
+        followers = self._followers.get(stock_id)
+        row = self._rows.get(user_id)
+        if followers is not None and row is not None and row in followers:
+            followers.remove(row)
+            self._follows -= 1
+
+    def set_notify(self, user_id: str, enabled: bool) -> None:
+        """Record whether the user has LINE Notify set up"""
+        self._notify[self._get_row(user_id)] = enabled
+
+    def get_targets(self, stock_ids: Iterable[str]) -> List[Tuple[str, str]]:
+        """
+        Returns:
+            (stock id, user id) of every follower with LINE Notify set up
+        """
+        user_ids, notify = self._user_ids, self._notify
+        return [
+            (stock_id, user_ids[row])
+            for stock_id in stock_ids
+            for row in self._followers.get(stock_id, ())
+            if notify[row]
+        ]
@@ -0,0 +1,58 @@
+from typing import Any, NamedTuple
+
+import aiohttp
+
+
+class ClientConfig(NamedTuple):
+    """
+    Connection pool and timeout settings of a session
+
+    Parameters:
+        limit: Maximum number of open connections
+        limit_per_host: Maximum number of open connections to one host, 0 for no limit
+        keepalive_timeout: Seconds an idle connection is kept for reuse
+        dns_ttl: Seconds a resolved host is cached
+        total_timeout: Seconds a request may take in total
+        connect_timeout: Seconds acquiring a connection may take, including
+            waiting for a free one in the pool
+    """
+
+    limit: int = 100
+    limit_per_host: int = 0
+    keepalive_timeout: float = 30.0
+    dns_ttl: int = 300
+    total_timeout: float = 30.0
+    connect_timeout: float = 10.0
+
+
+NOTIFY = ClientConfig(
+    limit=64, limit_per_host=64, keepalive_timeout=60.0, total_timeout=15.0
+)
+"""LINE Notify, bursts of small requests to one host"""
+CRAWL = ClientConfig(
+    limit=16, limit_per_host=8, keepalive_timeout=30.0, total_timeout=60.0
+)
+"""MOPS, a few large pages per crawl"""
+STOCK_API = ClientConfig(
+    limit=32, limit_per_host=32, keepalive_timeout=60.0, total_timeout=10.0
+)
+"""The stock API, lookups made while a user waits for a reply"""
+
+
+def create_session(config: ClientConfig, **kwargs: Any) -> aiohttp.ClientSession:
+    """
+    Create a session with its own connection pool, a session should be made
+    for every group of hosts so that one can't use up the connections of another
+
+    aiohttp only speaks HTTP/1.1, requests are sped up by reusing connections.
+    """
+    connector = aiohttp.TCPConnector(
+        limit=config.limit,
+        limit_per_host=config.limit_per_host,
+        keepalive_timeout=config.keepalive_timeout,
+        ttl_dns_cache=config.dns_ttl,
+    )
+    timeout = aiohttp.ClientTimeout(
+        total=config.total_timeout, connect=config.connect_timeout
+    )
+    return aiohttp.ClientSession(connector=connector, timeout=timeout, **kwargs)
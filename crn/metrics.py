@@ -0,0 +1,144 @@
+import bisect
+import logging
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+
+# Upper bounds in seconds of the histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self) -> None:
+        # The last count is of observations above every bucket
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+class Metrics:
+    """
+    Counters and timing histograms of a process, rendered in the Prometheus
+    text format
+
+    Recording is a dict lookup and an addition, cheap enough to leave on for
+    every webhook and query.
+    """
+
+    def __init__(self) -> None:
+        self.counters: Dict[str, Dict[Labels, float]] = {}
+        self.histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self.caches: Dict[str, Any] = {}
+        self.gauges: Dict[str, Callable[[], float]] = {}
+
+    @staticmethod
+    def _key(labels: Dict[str, Any]) -> Labels:
+        return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    def inc(self, name: str, value: float = 1.0, **labels: Any) -> None:
+        series = self.counters.setdefault(name, {})
+        key = self._key(labels)
+        series[key] = series.get(key, 0.0) + value
+
+    def get(self, name: str, **labels: Any) -> float:
+        return self.counters.get(name, {}).get(self._key(labels), 0.0)
+
+    def observe(self, name: str, seconds: float, **labels: Any) -> None:
+        series = self.histograms.setdefault(name, {})
+        key = self._key(labels)
+        if key not in series:
+            series[key] = Histogram()
+        series[key].observe(seconds)
+
+    @contextmanager
+    def span(self, name: str, **labels: Any) -> Iterator[None]:
+        """Time the block into the histogram `name`, also when it raises"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def add_cache(self, name: str, cache: Any) -> None:
+        """Export the `hits` and `misses` of a cache"""
+        self.caches[name] = cache
+
+    def add_gauge(self, name: str, get_value: Callable[[], float]) -> None:
+        """Export the value `get_value` returns when the metrics are rendered"""
+        self.gauges[name] = get_value
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for name, series in self.counters.items():
+            lines.append(f"# TYPE {name} counter")
+            for labels, value in series.items():
+                lines.append(f"{name}{format_labels(labels)} {value:g}")
+
+        for name, histograms in self.histograms.items():
+            lines.append(f"# TYPE {name} histogram")
+            for labels, histogram in histograms.items():
+                cumulative = 0
+                for bound, count in zip(BUCKETS + (float("inf"),), histogram.counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                    lines.append(
+                        f"{name}_bucket{format_labels(labels + (('le', le),))} "
+                        f"{cumulative}"
+                    )
+                lines.append(f"{name}_sum{format_labels(labels)} {histogram.sum:g}")
+                lines.append(f"{name}_count{format_labels(labels)} {histogram.count}")
+
+        for name, get_value in self.gauges.items():
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {get_value():g}")
+
+        for kind in ("hits", "misses") if self.caches else ():
+            name = f"crn_cache_{kind}_total"
+            lines.append(f"# TYPE {name} counter")
+            for cache_name, cache in self.caches.items():
+                labels = (("cache", cache_name),)
+                lines.append(f"{name}{format_labels(labels)} {getattr(cache, kind)}")
+        return "\n".join(lines) + "\n"
+
+
+METRICS = Metrics()
+"""The metrics of this process"""
+
+
+class QueryCounter(logging.Handler):
+    """Counts the queries Tortoise logs at the debug level"""
+
+    def __init__(self, metrics: Metrics) -> None:
+        super().__init__(logging.DEBUG)
+        self.metrics = metrics
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.metrics.inc("crn_db_queries_total")
+
+
+def install_query_counter(metrics: Metrics = METRICS) -> None:
+    """
+    Count database queries into `crn_db_queries_total`, the query log itself
+    stays out of the log files
+    """
+    logger = logging.getLogger("tortoise.db_client")
+    if any(isinstance(handler, QueryCounter) for handler in logger.handlers):
+        return
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+    logger.addHandler(QueryCounter(metrics))
@@ -0,0 +1,138 @@
+import logging
+import re
+
+from tortoise import Tortoise
+from tortoise.backends.base.client import BaseDBAsyncClient
+from tortoise.exceptions import OperationalError
+
+from .utils import get_report_period
+
+LOGGER_ = logging.getLogger(__name__)
+
+# (table, column, definition) added after the table was first created,
+# generate_schemas only creates missing tables
+COLUMNS = (
+    ("user", "digest_notifications", "BOOL NOT NULL DEFAULT FALSE"),
+    ("revenuereport", "message", "TEXT"),
+    ("revenuereport", "stock_id", "VARCHAR(10)"),
+    ("revenuereport", "roc_year", "INT"),
+    ("revenuereport", "month", "INT"),
+)
+
+# (name, table, columns, unique), kept out of the models so that new and
+# migrated databases end up with the same indexes
+INDEXES = (
+    # Reports of a stock, latest first with ORDER BY roc_year DESC, month DESC
+    (
+        "uid_revenuereport_stock_period",
+        "revenuereport",
+        ("stock_id", "roc_year", "month"),
+        True,
+    ),
+    # All reports of a period
+    ("idx_revenuereport_period", "revenuereport", ("roc_year", "month"), False),
+    # The LINE Notify callback looks the user up by the state it was sent
+    ("idx_user_line_notify_state", "user", ("line_notify_state",), False),
+    # Exact name lookups, searches with LIKE '%...%' still scan the table
+    ("idx_stock_name", "stock", ("name",), False),
+    # Tortoise creates the through table without indexes, one per direction:
+    # the stocks of a user, and the followers of a stock
+    ("idx_user_stock_user_stock", "user_stock", ("user_id", "stock_id"), False),
+    ("idx_user_stock_stock_user", "user_stock", ("stock_id", "user_id"), False),
+)
+
+# Stock.revenue_report was created with ON DELETE CASCADE, deleting a report
+# deleted its stock
+STOCK_REPORT_CASCADE = 'REFERENCES "revenuereport" ("id") ON DELETE CASCADE'
+STOCK_REPORT_SET_NULL = 'REFERENCES "revenuereport" ("id") ON DELETE SET NULL'
+
+
+async def has_column(conn: BaseDBAsyncClient, table: str, column: str) -> bool:
+    try:
+        # Unquoted, SQLite reads an unknown quoted identifier as a string literal
+        await conn.execute_query(f'SELECT {column} FROM "{table}" LIMIT 1')
+    except OperationalError:
+        return False
+    return True
+
+
+async def migrate() -> None:
+    """
+    Bring the schema of an existing database up to date with crn.models
+    """
+    conn = Tortoise.get_connection("default")
+    for table, column, definition in COLUMNS:
+        if await has_column(conn, table, column):
+            continue
+        LOGGER_.info(f"Adding column {table}.{column}")
+        await conn.execute_script(
+            f'ALTER TABLE "{table}" ADD COLUMN "{column}" {definition}'
+        )
+
+    await backfill_report_periods(conn)
+    await migrate_stock_report_fk(conn)
+
+    for name, table, columns, unique in INDEXES:
+        await conn.execute_script(
+            f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS \"{name}\" "
+            f'ON "{table}" ({", ".join(columns)})'
+        )
+
+
+async def backfill_report_periods(conn: BaseDBAsyncClient) -> None:
+    """
+    Reports used to be deleted every month, so reports saved before they had a
+    period all belong to the current one and are linked from their stock
+    """
+    roc_year, month = get_report_period()
+    await conn.execute_script(
+        'UPDATE "revenuereport" SET '
+        'stock_id = (SELECT "stock".id FROM "stock" '
+        'WHERE "stock".revenue_report_id = "revenuereport".id), '
+        f"roc_year = {roc_year}, month = {month} "
+        "WHERE roc_year IS NULL"
+    )
+
+
+async def migrate_stock_report_fk(conn: BaseDBAsyncClient) -> None:
+    """
+    Make deleting a report set the pointer of its stock to NULL instead of
+    deleting the stock, generate_schemas doesn't change existing constraints
+    """
+    dialect = conn.capabilities.dialect
+    if dialect == "sqlite":
+        _, rows = await conn.execute_query(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'stock'"
+        )
+        sql = rows[0]["sql"]
+        if STOCK_REPORT_CASCADE not in sql:
+            return
+
+        # SQLite can't alter a constraint, the table is rebuilt. The foreign
+        # keys of user_stock and the outbox reference the table by name.
+        LOGGER_.info("Rebuilding table stock with ON DELETE SET NULL")
+        sql = re.sub(r'^CREATE TABLE "?stock"?', 'CREATE TABLE "stock_new"', sql)
+        sql = sql.replace(STOCK_REPORT_CASCADE, STOCK_REPORT_SET_NULL)
+        await conn.execute_script(
+            "PRAGMA foreign_keys = OFF; BEGIN; "
+            f"{sql}; "
+            'INSERT INTO "stock_new" SELECT * FROM "stock"; '
+            'DROP TABLE "stock"; '
+            'ALTER TABLE "stock_new" RENAME TO "stock"; '
+            "COMMIT; PRAGMA foreign_keys = ON"
+        )
+    elif dialect == "postgres":
+        _, rows = await conn.execute_query(
+            "SELECT con.conname FROM pg_constraint con "
+            "JOIN pg_attribute att "
+            "ON att.attrelid = con.conrelid AND att.attnum = ANY(con.conkey) "
+            "WHERE con.conrelid = 'stock'::regclass AND con.contype = 'f' "
+            "AND att.attname = 'revenue_report_id' AND con.confdeltype = 'c'"
+        )
+        for row in rows:
+            LOGGER_.info(f"Changing constraint {row['conname']} to ON DELETE SET NULL")
+            await conn.execute_script(
+                f'ALTER TABLE "stock" DROP CONSTRAINT "{row["conname"]}", '
+                f'ADD CONSTRAINT "{row["conname"]}" FOREIGN KEY ("revenue_report_id") '
+                f"{STOCK_REPORT_SET_NULL}"
+            )
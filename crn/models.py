@@ -16,6 +16,8 @@ class User(Model):
         "models.Stock", related_name="users", through="user_stock"
     )
     temp_data: fields.Field[Optional[str]] = fields.TextField(null=True)  # type: ignore
+    digest_notifications = fields.BooleanField(default=False)
+    """Receive one message per crawl with all newly published reports"""
 
 
 class Stock(Model):
@@ -24,14 +26,34 @@ class Stock(Model):
     users: fields.ManyToManyRelation[User]
     revenue_report: fields.OneToOneNullableRelation[
         "RevenueReport"
-    ] = fields.OneToOneField("models.RevenueReport", related_name="stock", null=True)
+    ] = fields.OneToOneField(
+        "models.RevenueReport",
+        related_name="current_stock",
+        null=True,
+        on_delete=fields.SET_NULL,
+    )
+    """The report of the current period, reset when a new period starts"""
 
     def __str__(self) -> str:
         return f"[{self.id}] {self.name}"
 
 
 class RevenueReport(Model):
-    stock: fields.BackwardOneToOneRelation[Stock]
+    """
+    A monthly revenue report of a stock, reports of past periods are kept until
+    they're pruned
+
+    The columns (stock_id, roc_year, month) are unique, the indexes are created
+    by crn.migrations. `stock_id` isn't a foreign key, stocks already reference
+    their current report and Tortoise can't create tables referencing each other.
+    """
+
+    current_stock: fields.BackwardOneToOneRelation[Stock]
+    stock_id: fields.Field[Optional[str]] = fields.CharField(
+        max_length=10, null=True
+    )  # type: ignore
+    roc_year: fields.Field[Optional[int]] = fields.IntField(null=True)  # type: ignore
+    month: fields.Field[Optional[int]] = fields.IntField(null=True)  # type: ignore
     industry = fields.CharField(max_length=100)
     current_month_revenue = fields.BigIntField()
     last_month_revenue = fields.BigIntField()
@@ -42,6 +64,8 @@ class RevenueReport(Model):
     last_year_accum_revenue = fields.BigIntField()
     last_season_diff = fields.FloatField()
     notes: fields.Field[Optional[str]] = fields.TextField(null=True)  # type: ignore
+    message: fields.Field[Optional[str]] = fields.TextField(null=True)  # type: ignore
+    """The notification text, rendered once when the report is saved"""
 
     def __str__(self) -> str:
         return (
@@ -56,8 +80,15 @@ class RevenueReport(Model):
             f"備註: {self.notes or '無'}"
         )
 
+    def render(self, stock: Stock, title: str) -> str:
+        return f"{stock} {title}\n\n{self}"
+
     @classmethod
     def parse(cls, strings: List[str]) -> Self:
+        """
+        Parse a row of strings, kept as the reference implementation of
+        `crn.parse.parse_reports`, which parses whole pages
+        """
         return cls(
             industry="新版本不再提供產業別",
             current_month_revenue=int(strings[2]),
@@ -70,3 +101,41 @@ class RevenueReport(Model):
             last_season_diff=float(strings[9]) if strings[9] else 0,
             notes=strings[10] if strings[10] != "-" else None,
         )
+
+
+class PendingNotification(Model):
+    """A notification waiting in the outbox to be sent to a follower of a stock"""
+
+    id = fields.IntField(pk=True)
+    user: fields.ForeignKeyRelation[User] = fields.ForeignKeyField(
+        "models.User", related_name="pending_notifications"
+    )
+    stock: fields.ForeignKeyRelation[Stock] = fields.ForeignKeyField(
+        "models.Stock", related_name="pending_notifications"
+    )
+    report: fields.ForeignKeyRelation[RevenueReport] = fields.ForeignKeyField(
+        "models.RevenueReport", related_name="pending_notifications"
+    )
+    attempts = fields.IntField(default=0)
+    created_at = fields.DatetimeField(auto_now_add=True)
+
+
+class CrawledPage(Model):
+    """Validators of the last crawled version of a page, for incremental crawls"""
+
+    url = fields.CharField(max_length=255, pk=True)
+    etag: fields.Field[Optional[str]] = fields.CharField(
+        max_length=255, null=True
+    )  # type: ignore
+    last_modified: fields.Field[Optional[str]] = fields.CharField(
+        max_length=255, null=True
+    )  # type: ignore
+    content_hash = fields.CharField(max_length=64)
+
+
+class BackfilledPage(Model):
+    """A page whose reports were loaded by the backfill, skipped when it's resumed"""
+
+    url = fields.CharField(max_length=255, pk=True)
+    reports = fields.IntField()
+    loaded_at = fields.DatetimeField(auto_now_add=True)
@@ -0,0 +1,397 @@
+import asyncio
+import logging
+import random
+import time
+from collections import Counter
+from typing import Dict, List, Mapping, NamedTuple, Optional, Sequence, Set, Tuple
+
+import aiohttp
+
+from .cache import ReportMessageCache
+from .metrics import METRICS
+from .models import PendingNotification
+from .utils import TokenBucket, get_report_title
+
+LOGGER_ = logging.getLogger(__name__)
+
+NOTIFY_URL = "https://notify-api.line.me/api/notify"
+NOTIFY_MESSAGE_LIMIT = 1000
+
+
+class Notification(NamedTuple):
+    token: str
+    message: str
+
+
+def pack_sections(
+    sections: Sequence[str], limit: int = NOTIFY_MESSAGE_LIMIT
+) -> List[Tuple[str, Set[int]]]:
+    """
+    Join sections into as few messages of at most `limit` characters as possible,
+    a section is only split if it's longer than the limit itself
+
+    Returns:
+        Each message with the indices of the sections it has a part of
+    """
+    messages: List[Tuple[str, Set[int]]] = []
+    current = ""
+    indices: Set[int] = set()
+    for index, section in enumerate(sections):
+        for i in range(0, len(section), limit):
+            piece = section[i : i + limit]
+            if current and len(current) + len(piece) > limit:
+                messages.append((current, indices))
+                current = ""
+                indices = set()
+            current += piece
+            indices.add(index)
+    if current:
+        messages.append((current, indices))
+    return messages
+
+
+def split_message(
+    sections: Sequence[str], limit: int = NOTIFY_MESSAGE_LIMIT
+) -> List[str]:
+    """`pack_sections` without the indices"""
+    return [message for message, _ in pack_sections(sections, limit)]
+
+
+def is_transient(status: Optional[int]) -> bool:
+    return status is None or status == 429 or status >= 500
+
+
+class NotifyStats:
+    def __init__(self) -> None:
+        self.statuses: Counter[int] = Counter()
+        self.retries = 0
+        self.errors = 0
+        self.started = time.monotonic()
+        self.finished: Optional[float] = None
+        self.results: List[Optional[int]] = []
+
+    @property
+    def sent(self) -> int:
+        return self.statuses[200]
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished or time.monotonic()) - self.started
+
+    @property
+    def throughput(self) -> float:
+        """Successfully sent notifications per second"""
+        return self.sent / self.elapsed if self.elapsed > 0 else 0.0
+
+    def __str__(self) -> str:
+        return (
+            f"sent {self.sent} notifications in {self.elapsed:.2f}s "
+            f"({self.throughput:.1f}/s), {self.retries} retries, "
+            f"{self.errors} errors, statuses: {dict(self.statuses)}"
+        )
+
+
+class NotifyDispatcher:
+    """
+    Send LINE Notify messages with a bounded worker pool
+
+    Requests are limited by a global token bucket and per access token by the
+    X-RateLimit-* headers LINE Notify responds with. 429 and 5xx responses,
+    timeouts and connection errors are retried with jittered exponential backoff.
+
+    Parameters:
+        session: The aiohttp session to use
+        workers: Number of notifications sent concurrently
+        rate: Requests per second allowed in total
+        burst: Number of requests that may be sent at once
+        retries: Number of retries after the first attempt
+        backoff: Base delay in seconds before the first retry
+        max_wait: Longest time in seconds to wait for an exhausted token's quota to reset
+        url: The notify endpoint, can be pointed to a local stub
+    """
+
+    def __init__(
+        self,
+        session: aiohttp.ClientSession,
+        *,
+        workers: int = 8,
+        rate: float = 50.0,
+        burst: int = 50,
+        retries: int = 3,
+        backoff: float = 1.0,
+        max_wait: float = 60.0,
+        url: str = NOTIFY_URL,
+    ) -> None:
+        if workers <= 0:
+            raise ValueError("Parameter workers must be a positive integer")
+
+        self.session = session
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+        self.max_wait = max_wait
+        self.url = url
+        self.last_stats: Optional[NotifyStats] = None
+        self._bucket = TokenBucket(rate, burst)
+        # access token -> epoch time its exhausted quota resets
+        self._token_resets: Dict[str, float] = {}
+
+    def _record_rate_limit(self, token: str, headers: Mapping[str, str]) -> None:
+        remaining = headers.get("X-RateLimit-Remaining")
+        reset = headers.get("X-RateLimit-Reset")
+        if remaining is None or reset is None:
+            return
+        if int(remaining) <= 0:
+            self._token_resets[token] = float(reset)
+        else:
+            self._token_resets.pop(token, None)
+
+    def _get_token_delay(self, token: str) -> float:
+        reset = self._token_resets.get(token)
+        if reset is None:
+            return 0.0
+        delay = reset - time.time()
+        if delay <= 0:
+            del self._token_resets[token]
+            return 0.0
+        return delay
+
+    async def send(
+        self, notification: Notification, stats: Optional[NotifyStats] = None
+    ) -> Optional[int]:
+        """
+        Send a notification, returns the final response status or None if the
+        request kept failing
+        """
+        stats = stats or NotifyStats()
+        token, message = notification
+        attempt = 0
+        while True:
+            delay = self._get_token_delay(token)
+            if delay > self.max_wait:
+                LOGGER_.warning(
+                    f"Notify quota of a token is exhausted for {delay:.0f}s"
+                )
+                stats.statuses[429] += 1
+                return 429
+            await asyncio.sleep(delay)
+
+            await self._bucket.acquire()
+            status: Optional[int] = None
+            try:
+                async with self.session.post(
+                    self.url,
+                    headers={"Authorization": f"Bearer {token}"},
+                    data={"message": message},
+                ) as resp:
+                    status = resp.status
+                    self._record_rate_limit(token, resp.headers)
+            except (asyncio.TimeoutError, aiohttp.ClientError) as e:
+                LOGGER_.warning(f"Failed to send notification: {e!r}")
+            METRICS.inc(
+                "crn_notify_responses_total",
+                status="error" if status is None else status,
+            )
+
+            if not is_transient(status):
+                stats.statuses[status] += 1
+                if status != 200:
+                    LOGGER_.warning(f"Notify responded with status {status}")
+                return status
+
+            if attempt >= self.retries:
+                if status is None:
+                    stats.errors += 1
+                else:
+                    stats.statuses[status] += 1
+                return status
+
+            stats.retries += 1
+            await asyncio.sleep(self.backoff * 2**attempt * random.uniform(0.5, 1.5))
+            attempt += 1
+
+    async def dispatch(self, notifications: Sequence[Notification]) -> NotifyStats:
+        """
+        Send notifications, the final status of each one is kept in the returned
+        stats' `results` in the same order
+        """
+        stats = NotifyStats()
+        stats.results = [None] * len(notifications)
+        pending = iter(enumerate(notifications))
+
+        async def worker() -> None:
+            for i, notification in pending:
+                stats.results[i] = await self.send(notification, stats)
+
+        with METRICS.span("crn_stage_seconds", stage="notify"):
+            await asyncio.gather(*(worker() for _ in range(self.workers)))
+        stats.finished = time.monotonic()
+        self.last_stats = stats
+        LOGGER_.info(f"Notify fan-out {stats}")
+        return stats
+
+
+class Outbox:
+    """
+    Background consumer draining `PendingNotification` rows in batches
+
+    A row is deleted once its notification is sent or permanently rejected,
+    transient failures are retried on later batches until `max_attempts`.
+    Delivery is at least once, a notification sent right before the process
+    dies may be sent again after a restart.
+
+    Parameters:
+        dispatcher: The dispatcher used to send notifications
+        messages: Cache of the reports' notification texts
+        batch_size: Number of rows sent per batch
+        poll_interval: Seconds to wait for new rows when the outbox is drained
+        max_attempts: Number of batches a notification is attempted in
+    """
+
+    def __init__(
+        self,
+        dispatcher: NotifyDispatcher,
+        messages: Optional[ReportMessageCache] = None,
+        *,
+        batch_size: int = 500,
+        poll_interval: float = 60.0,
+        max_attempts: int = 5,
+    ) -> None:
+        self.dispatcher = dispatcher
+        self.messages = messages or ReportMessageCache()
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task[None]] = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def wake(self) -> None:
+        """Notify the consumer that new rows were enqueued"""
+        self._wakeup.set()
+
+    async def _run(self) -> None:
+        while True:
+            self._wakeup.clear()
+            try:
+                done = await self.drain_batch()
+            except Exception:
+                LOGGER_.exception("Failed to drain the notification outbox")
+                done = 0
+            if done:
+                continue
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def drain_batch(self) -> int:
+        """
+        Send one batch of pending notifications
+
+        Pending notifications of users with digest notifications turned on are
+        all sent together in as few messages as possible.
+
+        Returns:
+            The number of rows removed from the outbox
+        """
+        jobs = (
+            await PendingNotification.all()
+            .order_by("id")
+            .limit(self.batch_size)
+            .select_related("user", "stock")
+        )
+        if not jobs:
+            return 0
+
+        digest_user_ids = {job.user.id for job in jobs if job.user.digest_notifications}
+        if digest_user_ids:
+            batch_ids = {job.id for job in jobs}
+            jobs.extend(
+                job
+                for job in await PendingNotification.filter(user_id__in=digest_user_ids)
+                .order_by("id")
+                .select_related("user", "stock")
+                if job.id not in batch_ids
+            )
+
+        done_ids: List[int] = []
+        groups: List[List[PendingNotification]] = []
+        digests: Dict[str, List[PendingNotification]] = {}
+        for job in jobs:
+            if job.user.line_notify_token is None:
+                done_ids.append(job.id)
+            elif job.user.digest_notifications:
+                digests.setdefault(job.user.id, []).append(job)
+            else:
+                groups.append([job])
+        groups.extend(digests.values())
+
+        title = get_report_title()
+        texts = await self.messages.get_many(job.report_id for job in jobs)  # type: ignore
+        notifications: List[Notification] = []
+        # rows whose text is in each notification
+        owners: List[List[PendingNotification]] = []
+        for group in groups:
+            token: str = group[0].user.line_notify_token  # type: ignore
+            if len(group) == 1:
+                notifications.append(
+                    Notification(token, f"\n{texts[group[0].report_id]}")  # type: ignore
+                )
+                owners.append(group)
+                continue
+
+            # Section 0 is the title, section i + 1 the text of group[i]
+            packed = pack_sections(
+                [f"\n{title}彙整\n"]
+                + [f"\n{texts[job.report_id]}\n" for job in group]  # type: ignore
+            )
+            for message, indices in packed:
+                notifications.append(Notification(token, message))
+                owners.append([group[i - 1] for i in indices if i > 0])
+
+        stats = await self.dispatcher.dispatch(notifications)
+        # A digest whose messages were partly delivered only keeps the rows of
+        # the undelivered ones, so the next batch doesn't send the rest again
+        failed = {
+            job.id
+            for i, status in enumerate(stats.results)
+            if is_transient(status)
+            for job in owners[i]
+        }
+
+        retry: List[PendingNotification] = []
+        for group in groups:
+            for job in group:
+                if job.id not in failed:
+                    done_ids.append(job.id)
+                    continue
+
+                job.attempts += 1
+                if job.attempts < self.max_attempts:
+                    retry.append(job)
+                else:
+                    LOGGER_.warning(
+                        f"Giving up on notification {job.id} after {job.attempts} attempts"
+                    )
+                    done_ids.append(job.id)
+
+        if done_ids:
+            await PendingNotification.filter(id__in=done_ids).delete()
+        if retry:
+            await PendingNotification.bulk_update(retry, fields=["attempts"])
+        return len(done_ids)
@@ -0,0 +1,112 @@
+from array import array
+from typing import List, NamedTuple, Optional, Tuple
+
+from .models import RevenueReport
+
+COLUMNS = 11
+"""Number of strings in a row of a t21sc03 page"""
+
+
+class RowError(NamedTuple):
+    row: int
+    """Index of the row in the page"""
+    stock_id: str
+    error: str
+
+
+class ReportBatch:
+    """
+    The revenue reports of a page in columns, numbers are kept in typed arrays
+
+    Pages are parsed into batches in the crawl executor, `RevenueReport`
+    models are only created by `get_report` for the rows that are saved.
+    """
+
+    def __init__(self) -> None:
+        self.stock_ids: List[str] = []
+        self.stock_names: List[str] = []
+        self.current_month_revenue = array("q")
+        self.last_month_revenue = array("q")
+        self.last_year_current_month_revenue = array("q")
+        self.last_month_diff = array("d")
+        self.last_year_current_month_diff = array("d")
+        self.current_month_accum_revenue = array("q")
+        self.last_year_accum_revenue = array("q")
+        self.last_season_diff = array("d")
+        self.notes: List[Optional[str]] = []
+        self.errors: List[RowError] = []
+        """Rows that were skipped because they're malformed"""
+
+    def __len__(self) -> int:
+        return len(self.stock_ids)
+
+    def numeric_columns(self) -> Tuple[array, ...]:
+        return (
+            self.current_month_revenue,
+            self.last_month_revenue,
+            self.last_year_current_month_revenue,
+            self.last_month_diff,
+            self.last_year_current_month_diff,
+            self.current_month_accum_revenue,
+            self.last_year_accum_revenue,
+            self.last_season_diff,
+        )
+
+    def get_report(self, i: int) -> RevenueReport:
+        return RevenueReport(
+            industry="新版本不再提供產業別",
+            current_month_revenue=self.current_month_revenue[i],
+            last_month_revenue=self.last_month_revenue[i],
+            last_year_current_month_revenue=self.last_year_current_month_revenue[i],
+            last_month_diff=self.last_month_diff[i],
+            last_year_current_month_diff=self.last_year_current_month_diff[i],
+            current_month_accum_revenue=self.current_month_accum_revenue[i],
+            last_year_accum_revenue=self.last_year_accum_revenue[i],
+            last_season_diff=self.last_season_diff[i],
+            notes=self.notes[i],
+        )
+
+
+def parse_reports(rows: List[List[str]]) -> ReportBatch:
+    """
+    Parse the rows of strings of a page in one pass, the same way
+    `RevenueReport.parse` parses a single row
+
+    A malformed row is recorded in the batch's `errors` and skipped, the other
+    rows of the page are still parsed.
+    """
+    batch = ReportBatch()
+    numbers = batch.numeric_columns()
+    for i, strings in enumerate(rows):
+        stock_id = strings[0] if strings else ""
+        try:
+            # A note split by <br> spans more strings, only its first is kept
+            if len(strings) < COLUMNS:
+                raise ValueError(f"expected {COLUMNS} columns, got {len(strings)}")
+            if not stock_id:
+                raise ValueError("missing stock id")
+            batch.current_month_revenue.append(int(strings[2]))
+            batch.last_month_revenue.append(int(strings[3]) if strings[3] else 0)
+            batch.last_year_current_month_revenue.append(
+                int(strings[4]) if strings[4] else 0
+            )
+            batch.last_month_diff.append(float(strings[5]) if strings[5] else 0.0)
+            batch.last_year_current_month_diff.append(
+                float(strings[6]) if strings[6] else 0.0
+            )
+            batch.current_month_accum_revenue.append(
+                int(strings[7]) if strings[7] else 0
+            )
+            batch.last_year_accum_revenue.append(int(strings[8]) if strings[8] else 0)
+            batch.last_season_diff.append(float(strings[9]) if strings[9] else 0.0)
+        except (ValueError, OverflowError) as e:
+            # Drop the values of the row that were already appended
+            for column in numbers:
+                del column[len(batch) :]
+            batch.errors.append(RowError(i, stock_id, str(e)))
+            continue
+
+        batch.stock_ids.append(stock_id)
+        batch.stock_names.append(strings[1])
+        batch.notes.append(strings[10] if strings[10] != "-" else None)
+    return batch
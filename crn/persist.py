@@ -0,0 +1,340 @@
+import logging
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+from pypika import Table
+from tortoise.expressions import Q
+from tortoise.transactions import in_transaction
+
+from .crawl import CrawledReport
+from .followers import FollowerGraph
+from .models import (
+    BackfilledPage,
+    CrawledPage,
+    PendingNotification,
+    RevenueReport,
+    Stock,
+    User,
+)
+from .utils import format_report_title, get_report_period, shift_period
+
+LOGGER_ = logging.getLogger(__name__)
+
+
+async def save_revenue_reports(
+    crawled: List[CrawledReport],
+    pages: Sequence[CrawledPage] = (),
+    period: Optional[Tuple[int, int]] = None,
+    followers: Optional[FollowerGraph] = None,
+) -> List[Tuple[Stock, RevenueReport]]:
+    """
+    Save crawled reports of the (ROC year, month) `period`, which defaults to
+    the current one, for stocks that don't have a report yet in one transaction
+
+    Known stocks are loaded with one query, missing stocks and new reports are
+    bulk created and the stocks are linked to their reports with one bulk update.
+    A notification for every follower with LINE Notify set up is put in the
+    outbox in the same transaction, so none are lost if the process dies.
+
+    The validators of the crawled pages are saved in the same transaction too,
+    an incremental crawl never skips a page whose reports weren't saved.
+
+    Each report's notification text is rendered once here.
+
+    The followers to notify are taken from `followers` if it's given, which
+    should be synced beforehand, or else loaded from the database.
+
+    Returns:
+        The newly saved (stock, report) pairs
+    """
+    if not crawled and not pages:
+        return []
+
+    async with in_transaction() as conn:
+        if pages:
+            await CrawledPage.filter(url__in=[page.url for page in pages]).using_db(
+                conn
+            ).delete()
+            await CrawledPage.bulk_create(pages, using_db=conn)
+
+        stocks: Dict[str, Stock] = {
+            stock.id: stock
+            for stock in await Stock.filter(
+                id__in=[c.stock_id for c in crawled]
+            ).using_db(conn)
+        }
+
+        missing = [
+            Stock(id=c.stock_id, name=c.stock_name)
+            for c in crawled
+            if c.stock_id not in stocks
+        ]
+        if missing:
+            await Stock.bulk_create(missing, using_db=conn)
+            stocks.update((stock.id, stock) for stock in missing)
+
+        unlinked = [
+            (stocks[c.stock_id], c.report)
+            for c in crawled
+            if stocks[c.stock_id].revenue_report_id is None  # type: ignore
+        ]
+        if not unlinked:
+            return []
+
+        # A stock whose report of the period is already saved only needs to be
+        # linked to it again, e.g. after the period was rolled over twice
+        roc_year, month = period or get_report_period()
+        saved_ids: Dict[str, int] = dict(
+            await RevenueReport.filter(
+                stock_id__in=[stock.id for stock, _ in unlinked],
+                roc_year=roc_year,
+                month=month,
+            )
+            .using_db(conn)
+            .values_list("stock_id", "id")  # type: ignore
+        )
+        relinked: List[Stock] = []
+        new: List[Tuple[Stock, RevenueReport]] = []
+        for stock, report in unlinked:
+            if stock.id in saved_ids:
+                stock.revenue_report_id = saved_ids[stock.id]  # type: ignore
+                relinked.append(stock)
+            else:
+                new.append((stock, report))
+        if relinked:
+            await Stock.bulk_update(
+                relinked, fields=["revenue_report_id"], using_db=conn
+            )
+        if not new:
+            return []
+
+        title = format_report_title(roc_year, month)
+        for stock, report in new:
+            report.stock_id = stock.id  # type: ignore
+            report.roc_year = roc_year
+            report.month = month
+            report.message = report.render(stock, title)
+        reports = [report for _, report in new]
+        await RevenueReport.bulk_create(reports, using_db=conn)
+        # bulk_create doesn't populate auto-increment primary keys, read them
+        # back by (stock_id, roc_year, month), which is unique
+        report_ids: Dict[str, int] = dict(
+            await RevenueReport.filter(
+                stock_id__in=[stock.id for stock, _ in new],
+                roc_year=roc_year,
+                month=month,
+            )
+            .using_db(conn)
+            .values_list("stock_id", "id")  # type: ignore
+        )
+        for stock, report in new:
+            report.id = report_ids[stock.id]
+            stock.revenue_report_id = report.id  # type: ignore
+
+        await Stock.bulk_update(
+            [stock for stock, _ in new], fields=["revenue_report_id"], using_db=conn
+        )
+
+        if followers is not None:
+            targets = followers.get_targets(stock.id for stock, _ in new)
+        else:
+            targets = [
+                (stock.id, user.id)
+                for stock in await Stock.filter(id__in=[stock.id for stock, _ in new])
+                .using_db(conn)
+                .prefetch_related("users")
+                for user in stock.users
+                if user.line_notify_token is not None
+            ]
+        report_id_by_stock = {stock.id: report.id for stock, report in new}
+        await PendingNotification.bulk_create(
+            [
+                PendingNotification(
+                    user_id=user_id,
+                    stock_id=stock_id,
+                    report_id=report_id_by_stock[stock_id],
+                )
+                for stock_id, user_id in targets
+            ],
+            using_db=conn,
+        )
+
+    LOGGER_.info(f"Saved {len(new)} new revenue reports")
+    return new
+
+
+async def save_follows(
+    follows: Sequence[Tuple[str, str]], names: Dict[str, str]
+) -> Tuple[Set[str], Set[Tuple[str, str]]]:
+    """
+    Make users follow stocks in one transaction, with the same number of
+    queries however many follows there are
+
+    Missing stocks are bulk created and the new rows of the through table are
+    inserted with one statement. Follows that already exist are skipped, like
+    `user.stocks.add` does.
+
+    Parameters:
+        follows: (user id, stock id) pairs
+        names: Names of the stocks by id, every followed stock must be in it
+
+    Returns:
+        The ids of the users that exist, follows of other users are skipped,
+        and the follows that were added
+    """
+    user_ids = {user_id for user_id, _ in follows}
+    stock_ids = {stock_id for _, stock_id in follows}
+    async with in_transaction() as conn:
+        users: Set[str] = set(
+            await User.filter(id__in=user_ids)
+            .using_db(conn)
+            .values_list("id", flat=True)
+        )
+        follows = [follow for follow in follows if follow[0] in users]
+        if not follows:
+            return users, set()
+
+        known = set(
+            await Stock.filter(id__in=stock_ids)
+            .using_db(conn)
+            .values_list("id", flat=True)
+        )
+        # The bot may create one of the stocks at the same time
+        await Stock.bulk_create(
+            [
+                Stock(id=stock_id, name=names[stock_id])
+                for stock_id in stock_ids - known
+            ],
+            ignore_conflicts=True,
+            using_db=conn,
+        )
+
+        user_stock = Table("user_stock")
+        query = (
+            conn.query_class.from_(user_stock)
+            .select(user_stock.user_id, user_stock.stock_id)
+            .where(user_stock.user_id.isin(list(users)))
+            .where(user_stock.stock_id.isin(list(stock_ids)))
+        )
+        _, rows = await conn.execute_query(str(query))
+        existing = {(row["user_id"], row["stock_id"]) for row in rows}
+
+        added = set(follows) - existing
+        if added:
+            insert = conn.query_class.into(user_stock).columns(
+                user_stock.stock_id, user_stock.user_id
+            )
+            for user_id, stock_id in added:
+                insert = insert.insert(stock_id, user_id)
+            await conn.execute_query(str(insert))
+
+    LOGGER_.info(f"Added {len(added)} follows")
+    return users, added
+
+
+async def save_report_history(
+    roc_year: int, month: int, crawled: List[CrawledReport], page: BackfilledPage
+) -> int:
+    """
+    Bulk load backfilled reports of a past period along with the checkpoint of
+    the page they were crawled from, in one transaction
+
+    Reports already saved for the period are skipped, stocks aren't linked to
+    the reports and no notifications are sent.
+
+    Returns:
+        The number of saved reports
+    """
+    async with in_transaction() as conn:
+        stock_ids = [c.stock_id for c in crawled]
+        known = set(
+            await Stock.filter(id__in=stock_ids)
+            .using_db(conn)
+            .values_list("id", flat=True)
+        )
+        await Stock.bulk_create(
+            [
+                Stock(id=c.stock_id, name=c.stock_name)
+                for c in crawled
+                if c.stock_id not in known
+            ],
+            # The bot or the API may create one of the stocks at the same time
+            ignore_conflicts=True,
+            using_db=conn,
+        )
+
+        saved = set(
+            await RevenueReport.filter(
+                stock_id__in=stock_ids, roc_year=roc_year, month=month
+            )
+            .using_db(conn)
+            .values_list("stock_id", flat=True)
+        )
+        reports: List[RevenueReport] = []
+        for c in crawled:
+            if c.stock_id in saved:
+                continue
+            c.report.stock_id = c.stock_id  # type: ignore
+            c.report.roc_year = roc_year
+            c.report.month = month
+            reports.append(c.report)
+        await RevenueReport.bulk_create(reports, using_db=conn)
+
+        page.reports = len(reports)
+        await page.save(using_db=conn, force_create=True)
+
+    return len(reports)
+
+
+async def roll_over_reports(keep_periods: int) -> int:
+    """
+    Start a new report period, stocks are unlinked from the reports of the last
+    one, the validators of crawled pages are forgotten and the report history
+    is pruned to the last `keep_periods` periods
+
+    Returns:
+        The number of pruned reports
+    """
+    await Stock.raw("UPDATE stock SET revenue_report_id = NULL")
+    await CrawledPage.all().delete()
+    return await prune_reports(keep_periods)
+
+
+async def prune_reports(keep_periods: int) -> int:
+    """
+    Apply the retention policy to the report history
+
+    Reports of periods before the last `keep_periods` ones, counting the current
+    one, are deleted. The rendered messages of past periods are dropped, they're
+    only needed while a period is current.
+
+    Returns:
+        The number of deleted reports
+    """
+    if keep_periods <= 0:
+        raise ValueError("Parameter keep_periods must be a positive integer")
+
+    roc_year, month = get_report_period()
+    oldest_year, oldest_month = shift_period(roc_year, month, 1 - keep_periods)
+    async with in_transaction() as conn:
+        deleted = (
+            await RevenueReport.filter(
+                Q(roc_year__lt=oldest_year)
+                | Q(roc_year=oldest_year, month__lt=oldest_month)
+            )
+            .using_db(conn)
+            .delete()
+        )
+        compacted = (
+            await RevenueReport.filter(
+                Q(roc_year__lt=roc_year) | Q(roc_year=roc_year, month__lt=month),
+                message__isnull=False,
+            )
+            .using_db(conn)
+            .update(message=None)
+        )
+
+    LOGGER_.info(
+        f"Pruned {deleted} revenue reports older than {oldest_year}/{oldest_month}, "
+        f"dropped {compacted} rendered messages"
+    )
+    return deleted
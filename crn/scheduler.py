@@ -0,0 +1,194 @@
+import asyncio
+import datetime
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
+from .utils import get_now
+
+LOGGER_ = logging.getLogger(__name__)
+
+# (minimum, maximum) of each cron field
+CRON_RANGES = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 6))
+
+
+def parse_cron_field(field: str, minimum: int, maximum: int) -> Set[int]:
+    values: Set[int] = set()
+    for part in field.split(","):
+        step = 1
+        if "/" in part:
+            part, step_str = part.split("/", 1)
+            step = int(step_str)
+            if step <= 0:
+                raise ValueError(f"Invalid step in cron field {field!r}")
+
+        if part == "*":
+            start, end = minimum, maximum
+        elif "-" in part:
+            start_str, end_str = part.split("-", 1)
+            start, end = int(start_str), int(end_str)
+        else:
+            start = int(part)
+            end = maximum if step > 1 else start
+
+        if not minimum <= start <= end <= maximum:
+            raise ValueError(f"Cron field {field!r} is out of range")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class CronSchedule:
+    """
+    A cron expression with the fields minute, hour, day of month, month and day
+    of week (0 is Sunday), e.g. "*/5 8-18 1-15 * *"
+    """
+
+    def __init__(self, expression: str) -> None:
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"Cron expression {expression!r} must have 5 fields")
+
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, self.weekdays = (
+            parse_cron_field(field, minimum, maximum)
+            for field, (minimum, maximum) in zip(fields, CRON_RANGES)
+        )
+
+    def __repr__(self) -> str:
+        return f"CronSchedule({self.expression!r})"
+
+    def matches(self, dt: datetime.datetime) -> bool:
+        return (
+            dt.minute in self.minutes
+            and dt.hour in self.hours
+            and dt.day in self.days
+            and dt.month in self.months
+            and (dt.weekday() + 1) % 7 in self.weekdays
+        )
+
+
+class Job:
+    """
+    A coroutine function run when its schedule matches
+
+    If `min_interval` is set the job is adaptive: it returns whether it found
+    anything new, the interval between runs is reset to `min_interval` when it
+    did and doubled up to `max_interval` when it didn't. While `peak` matches
+    the interval is capped at `peak_interval`.
+
+    Parameters:
+        name: Name of the job used in logs
+        func: The coroutine function to run
+        schedule: When the job may run
+        min_interval: Shortest interval between runs of an adaptive job
+        max_interval: Longest interval between runs of an adaptive job
+        peak: When the job should run more often
+        peak_interval: Longest interval between runs while `peak` matches
+    """
+
+    def __init__(
+        self,
+        name: str,
+        func: Callable[[], Awaitable[Optional[bool]]],
+        schedule: CronSchedule,
+        *,
+        min_interval: Optional[datetime.timedelta] = None,
+        max_interval: Optional[datetime.timedelta] = None,
+        peak: Optional[CronSchedule] = None,
+        peak_interval: Optional[datetime.timedelta] = None,
+    ) -> None:
+        self.name = name
+        self.func = func
+        self.schedule = schedule
+        self.min_interval = min_interval
+        self.max_interval = max_interval or min_interval
+        self.peak = peak
+        self.peak_interval = peak_interval
+        self.interval = min_interval
+        self.last_run: Optional[datetime.datetime] = None
+        self.running = False
+
+    def is_due(self, now: datetime.datetime) -> bool:
+        if self.running or not self.schedule.matches(now):
+            return False
+        if self.last_run is None:
+            return True
+
+        # Ticks aren't exactly a minute apart, compare whole minutes
+        elapsed = now.replace(second=0, microsecond=0) - self.last_run.replace(
+            second=0, microsecond=0
+        )
+        if elapsed <= datetime.timedelta():
+            return False
+        if self.interval is None:
+            return True
+
+        interval = self.interval
+        if self.peak is not None and self.peak_interval and self.peak.matches(now):
+            interval = min(interval, self.peak_interval)
+        return elapsed >= interval
+
+    def update_interval(self, found_new: Optional[bool]) -> None:
+        if self.interval is None or self.min_interval is None:
+            return
+        if found_new:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * 2, self.max_interval)  # type: ignore
+
+
+class Scheduler:
+    """
+    Runs jobs in the background on every `tick`, a job never overlaps itself
+
+    Parameters:
+        clock: Returns the current time, replaceable with a fake clock
+    """
+
+    def __init__(self, clock: Callable[[], datetime.datetime] = get_now) -> None:
+        self.clock = clock
+        self.jobs: Dict[str, Job] = {}
+        self._tasks: Set[asyncio.Task[None]] = set()
+
+    def add_job(self, job: Job) -> None:
+        if job.name in self.jobs:
+            raise ValueError(f"Job {job.name!r} already exists")
+        self.jobs[job.name] = job
+
+    def tick(self) -> List[Job]:
+        """
+        Start the jobs that are due
+
+        Returns:
+            The started jobs
+        """
+        now = self.clock()
+        started: List[Job] = []
+        for job in self.jobs.values():
+            if not job.is_due(now):
+                continue
+
+            job.running = True
+            job.last_run = now
+            task = asyncio.create_task(self._run(job))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+            started.append(job)
+        return started
+
+    async def _run(self, job: Job) -> None:
+        LOGGER_.info(f"Running job {job.name}")
+        try:
+            found_new = await job.func()
+        except Exception:
+            LOGGER_.exception(f"Job {job.name} failed")
+        else:
+            job.update_interval(found_new)
+            if job.interval is not None:
+                LOGGER_.info(f"Next run of job {job.name} in {job.interval}")
+        finally:
+            job.running = False
+
+    async def wait(self) -> None:
+        """Wait for all running jobs to finish"""
+        if self._tasks:
+            await asyncio.gather(*self._tasks)
@@ -0,0 +1,30 @@
+"""
+Tortoise engine for SQLite whose transactions take the write lock up front
+
+With a plain BEGIN a transaction that reads before it writes fails with
+"database is locked" right away, without waiting for the busy timeout, if
+another process wrote in between. BEGIN IMMEDIATE waits for the lock instead.
+"""
+
+import sqlite3
+
+from tortoise.backends.base.client import TransactionContext
+from tortoise.backends.sqlite.client import SqliteClient, TransactionWrapper
+from tortoise.exceptions import TransactionManagementError
+
+
+class ImmediateTransactionWrapper(TransactionWrapper):
+    async def start(self) -> None:
+        try:
+            await self._connection.commit()
+            await self._connection.execute("BEGIN IMMEDIATE")
+        except sqlite3.OperationalError as exc:
+            raise TransactionManagementError(exc)
+
+
+class ImmediateSqliteClient(SqliteClient):
+    def _in_transaction(self) -> TransactionContext:
+        return TransactionContext(ImmediateTransactionWrapper(self))
+
+
+client_class = ImmediateSqliteClient
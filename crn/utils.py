@@ -1,5 +1,7 @@
+import asyncio
 import datetime
-from typing import List, TypeVar
+import time
+from typing import Awaitable, Callable, Dict, Generic, Hashable, List, Tuple, TypeVar
 
 
 def get_now() -> datetime.datetime:
@@ -14,11 +16,29 @@ def remove_commas(s: str) -> str:
     return s.replace(",", "")
 
 
-def get_report_title() -> str:
+def format_report_title(roc_year: int, month: int) -> str:
+    return f"{roc_year} 年 {month} 月營收"
+
+
+def get_report_period() -> Tuple[int, int]:
+    """
+    Returns:
+        The (ROC year, month) of the reports published this month
+    """
     today = get_today()
     if today.month == 1:
-        return f"{today.year-1912} 年 12 月營收"
-    return f"{today.year-1911} 年 {today.month-1} 月營收"
+        return today.year - 1912, 12
+    return today.year - 1911, today.month - 1
+
+
+def shift_period(roc_year: int, month: int, months: int) -> Tuple[int, int]:
+    """Move a (ROC year, month) period by a number of months"""
+    year, month_index = divmod(roc_year * 12 + month - 1 + months, 12)
+    return year, month_index + 1
+
+
+def get_report_title() -> str:
+    return format_report_title(*get_report_period())
 
 
 T = TypeVar("T")
@@ -36,3 +56,68 @@ def split_list(input_list: List[T], n: int) -> List[List[T]]:
         raise ValueError("Parameter n must be a positive integer")
 
     return [input_list[i : i + n] for i in range(0, len(input_list), n)]
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter
+
+    Parameters:
+        rate: Tokens refilled per second
+        capacity: Maximum number of tokens, i.e. the allowed burst size
+    """
+
+    def __init__(self, rate: float, capacity: int) -> None:
+        if rate <= 0 or capacity <= 0:
+            raise ValueError("Parameters rate and capacity must be positive")
+
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity, self._tokens + (now - self._updated) * self.rate
+                )
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class SingleFlight(Generic[K, V]):
+    """
+    Coalesce concurrent calls with the same key, callers arriving while a call
+    is in flight wait for it and share its result or exception
+
+    The call runs in its own task, a caller that is cancelled doesn't cancel it
+    for the others.
+    """
+
+    def __init__(self) -> None:
+        self.shared = 0
+        """Number of calls that joined a call in flight"""
+        self._tasks: Dict[K, asyncio.Future[V]] = {}
+
+    def __contains__(self, key: K) -> bool:
+        return key in self._tasks
+
+    async def do(self, key: K, func: Callable[[], Awaitable[V]]) -> V:
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._tasks[key] = task
+            task.add_done_callback(lambda _: self._tasks.pop(key, None))
+        else:
+            self.shared += 1
+        return await asyncio.shield(task)
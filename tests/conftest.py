@@ -0,0 +1,24 @@
+import asyncio
+from pathlib import Path
+from typing import Any, Awaitable, Callable
+
+import pytest
+
+from crn.db import close_db, init_db
+
+
+@pytest.fixture
+def run_with_db(tmp_path: Path) -> Callable[[Callable[[], Awaitable[Any]]], Any]:
+    """Run a coroutine function in an event loop with a fresh SQLite database"""
+
+    def run(func: Callable[[], Awaitable[Any]]) -> Any:
+        async def main() -> Any:
+            await init_db(f"sqlite://{tmp_path}/test.sqlite3")
+            try:
+                return await func()
+            finally:
+                await close_db()
+
+        return asyncio.run(main())
+
+    return run
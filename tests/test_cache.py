@@ -0,0 +1,178 @@
+import asyncio
+from typing import Any, List
+
+import pytest
+from tortoise.exceptions import DoesNotExist
+
+from crn.cache import TTLCache, UserCache
+from crn.models import User
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def count_queries(monkeypatch: pytest.MonkeyPatch) -> List[str]:
+    """Record the ids `User.get` is called with"""
+    queried: List[str] = []
+    get = User.get
+
+    def counting_get(*args: Any, **kwargs: Any) -> Any:
+        queried.append(kwargs["id"])
+        return get(*args, **kwargs)
+
+    monkeypatch.setattr(User, "get", counting_get)
+    return queried
+
+
+def test_concurrent_gets_of_one_user_share_a_query(
+    run_with_db: Any, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    queried = count_queries(monkeypatch)
+    cache = UserCache()
+
+    async def main() -> None:
+        await User.create(id="U1")
+        users = await asyncio.gather(*(cache.get("U1") for _ in range(50)))
+        assert all(user is users[0] for user in users)
+        assert (cache.hits, cache.misses) == (49, 1)
+
+        await asyncio.gather(*(cache.get("U1") for _ in range(50)))
+        assert (cache.hits, cache.misses) == (99, 1)
+
+    run_with_db(main)
+    assert queried == ["U1"]
+
+
+def test_concurrent_gets_of_different_users(
+    run_with_db: Any, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    queried = count_queries(monkeypatch)
+    cache = UserCache()
+    user_ids = [f"U{i}" for i in range(10)]
+
+    async def main() -> None:
+        await User.bulk_create([User(id=user_id) for user_id in user_ids])
+        users = await asyncio.gather(
+            *(cache.get(user_id) for _ in range(5) for user_id in user_ids)
+        )
+        assert [user.id for user in users] == user_ids * 5
+
+    run_with_db(main)
+    assert (cache.hits, cache.misses) == (40, 10)
+    assert sorted(queried) == user_ids
+
+
+def test_missing_user_is_not_cached(run_with_db: Any) -> None:
+    cache = UserCache()
+
+    async def main() -> None:
+        with pytest.raises(DoesNotExist):
+            await cache.get("U1")
+        await User.create(id="U1")
+        assert (await cache.get("U1")).id == "U1"
+
+    run_with_db(main)
+    assert (cache.hits, cache.misses) == (0, 2)
+
+
+def test_update_saves_only_changed_fields(run_with_db: Any) -> None:
+    cache = UserCache()
+
+    async def main() -> None:
+        await User.create(id="U1", temp_data="old")
+        user = await cache.get("U1")
+        # Written by another process after the user was cached
+        await User.filter(id="U1").update(temp_data="new")
+
+        await cache.update(user, digest_notifications=True)
+
+        saved = await User.get(id="U1")
+        assert (saved.digest_notifications, saved.temp_data) == (True, "new")
+
+    run_with_db(main)
+
+
+def test_update_syncs_the_cached_copy(run_with_db: Any) -> None:
+    cache = UserCache()
+
+    async def main() -> None:
+        await User.create(id="U1")
+        cached = await cache.get("U1")
+        # The /line-notify callback loads the user on its own
+        separate = await User.get(id="U1")
+
+        await cache.update(separate, line_notify_token="token")
+
+        assert await cache.get("U1") is cached
+        assert cached.line_notify_token == "token"
+
+    run_with_db(main)
+
+
+def test_invalidate_reloads_the_user(run_with_db: Any) -> None:
+    cache = UserCache()
+
+    async def main() -> None:
+        await User.create(id="U1")
+        await cache.get("U1")
+        await User.filter(id="U1").update(temp_data="new")
+        assert (await cache.get("U1")).temp_data is None
+
+        cache.invalidate("U1")
+
+        assert (await cache.get("U1")).temp_data == "new"
+
+    run_with_db(main)
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_ttl_expiry() -> None:
+    clock = FakeClock()
+    cache: TTLCache[str, int] = TTLCache(ttl=10.0, clock=clock)
+    cache.set("a", 1)
+    cache.set("b", 2, ttl=20.0)
+
+    clock.now = 9.9
+    assert (cache.get("a"), cache.get("b")) == (1, 2)
+    clock.now = 10.0
+    assert (cache.get("a"), cache.get("b")) == (None, 2)
+    assert cache.peek("b") == 2
+    clock.now = 20.0
+    assert cache.peek("b") is None
+    assert cache.lookup("b") == (False, None)
+
+    assert (cache.hits, cache.misses) == (3, 2)
+    assert len(cache) == 0
+
+
+def test_cached_none_is_a_hit() -> None:
+    cache: TTLCache[str, None] = TTLCache(clock=FakeClock())
+    cache.set("missing", None)
+
+    assert cache.lookup("missing") == (True, None)
+    assert cache.lookup("other") == (False, None)
+
+
+def test_lru_eviction() -> None:
+    cache: TTLCache[str, int] = TTLCache(maxsize=2, clock=FakeClock())
+    cache.set("a", 1)
+    cache.set("b", 2)
+    # "b" becomes the least recently used, peek doesn't count as a use
+    assert cache.get("a") == 1
+    assert cache.peek("b") == 2
+
+    cache.set("c", 3)
+
+    assert len(cache) == 2
+    assert cache.peek("b") is None
+    assert (cache.peek("a"), cache.peek("c")) == (1, 3)
+
+
+def test_maxsize_must_be_positive() -> None:
+    with pytest.raises(ValueError):
+        TTLCache(maxsize=0)
@@ -0,0 +1,42 @@
+import asyncio
+from typing import List, Optional
+
+import aiohttp
+from aiohttp import web
+
+from benchmarks.stubs import start_site
+from crn.crawl import FetchScheduler, FetchedPage
+
+PAGE = b"<table>" + b"-" * 100000 + b"</table>"
+
+
+def test_cut_off_page_is_retried() -> None:
+    requests: List[int] = []
+
+    async def page(request: web.Request) -> web.StreamResponse:
+        requests.append(1)
+        if len(requests) > 1:
+            return web.Response(body=PAGE)
+
+        resp = web.StreamResponse(headers={"Content-Length": str(len(PAGE))})
+        await resp.prepare(request)
+        await resp.write(PAGE[:1000])
+        request.transport.close()  # type: ignore
+        return resp
+
+    async def main() -> Optional[FetchedPage]:
+        app = web.Application()
+        app.router.add_get("/page", page)
+        runner = web.AppRunner(app, access_log=None)
+        url = await start_site(runner)
+        try:
+            async with aiohttp.ClientSession() as session:
+                scheduler = FetchScheduler(session, rate=1e6, backoff=0.0)
+                return await scheduler.fetch(f"{url}/page")
+        finally:
+            await runner.cleanup()
+
+    fetched = asyncio.run(main())
+    assert fetched is not None
+    assert fetched.content == PAGE
+    assert len(requests) == 2
@@ -0,0 +1,74 @@
+import asyncio
+from typing import Any, Dict, List, Optional, Tuple
+
+import aiohttp
+
+from benchmarks.stubs import StockAPIStub
+from crn.directory import StockDirectory
+
+
+def run_with_stub(func: Any) -> Any:
+    async def main() -> Any:
+        # 9999 doesn't exist
+        stub = StockAPIStub(missing_ratio=0.01)
+        directory = StockDirectory(api_url=await stub.start())
+        try:
+            async with aiohttp.ClientSession() as session:
+                return await func(stub, directory, session)
+        finally:
+            await stub.runner.cleanup()
+
+    return asyncio.run(main())
+
+
+def test_concurrent_resolve_id_sends_one_request() -> None:
+    async def main(
+        stub: StockAPIStub, directory: StockDirectory, session: aiohttp.ClientSession
+    ) -> List[Optional[Tuple[str, str]]]:
+        results = await asyncio.gather(
+            *(directory.resolve_id(session, "2330") for _ in range(50))
+        )
+        assert stub.requests == ["2330"]
+        assert (directory.hits, directory.misses) == (49, 1)
+
+        # Answered from the cache afterwards
+        assert await directory.resolve_id(session, "2330") == ("2330", "股票2330")
+        assert stub.requests == ["2330"]
+        return results
+
+    assert run_with_stub(main) == [("2330", "股票2330")] * 50
+
+
+def test_concurrent_lookups_of_missing_stock() -> None:
+    async def main(
+        stub: StockAPIStub, directory: StockDirectory, session: aiohttp.ClientSession
+    ) -> Dict[str, Any]:
+        results = await asyncio.gather(
+            *(directory.resolve_id(session, "9999") for _ in range(20)),
+            *(directory.resolve_name(session, "台積電") for _ in range(20)),
+        )
+        assert sorted(stub.requests) == ["9999", "台積電"]
+        return {"missing": results[:20], "by_name": results[20:]}
+
+    results = run_with_stub(main)
+    assert results["missing"] == [None] * 20
+    assert results["by_name"] == [("2330", "台積電")] * 20
+
+
+def test_resolve_ids_asks_each_id_once() -> None:
+    async def main(
+        stub: StockAPIStub, directory: StockDirectory, session: aiohttp.ClientSession
+    ) -> None:
+        directory.update([("2317", "鴻海")])
+        stocks = await directory.resolve_ids(
+            session, ["2330", "2317", "9999", "2330", "2454"], concurrency=2
+        )
+        assert stocks == {
+            "2330": ("2330", "股票2330"),
+            "2317": ("2317", "鴻海"),
+            "9999": None,
+            "2454": ("2454", "股票2454"),
+        }
+        assert sorted(stub.requests) == ["2330", "2454", "9999"]
+
+    run_with_stub(main)
@@ -0,0 +1,88 @@
+import random
+
+import pytest
+
+from crn.extract import extract_rows_soup, extract_rows_stream
+
+
+def make_row(rng: random.Random, stock_id: int, sep: str) -> str:
+    cells = [
+        f"{stock_id}<script>track({stock_id})</script>",
+        f"公司&amp;{stock_id}",
+        f"{rng.randrange(10**9):,}",
+        f"{rng.randrange(10**9):,}",
+        "0",
+        f"{rng.uniform(-100, 100):.2f}",
+        "&nbsp;",
+        f"{rng.randrange(10**10):,}",
+        f"{rng.randrange(10**10):,}",
+        f"{rng.uniform(-100, 100):.2f}",
+        rng.choice(["-", "因應疫情 營收減少", "a &lt; b"]),
+    ]
+    return (
+        f"<tr align=right>{sep}"
+        + sep.join(f"<td>{sep}{cell}{sep}</td>" for cell in cells)
+        + f"{sep}</tr>"
+    )
+
+
+def make_page(seed: int, sep: str = "", industries: int = 3, rows: int = 20) -> str:
+    """A page laid out like t21sc03, `sep` is put between tags"""
+    rng = random.Random(seed)
+    parts = [
+        "<html><head><title>t</title><style>td { color: red }</style>",
+        "<script>if (a < b) { document.write('</td>') }</script></head>",
+        "<body><center><table width=100%><tr><td>",
+    ]
+    for industry in range(industries):
+        parts.append(f"<table><tr><th class=tt>產業別：{industry}</th></tr></table>")
+        parts.append("<table><tr><td><table class=hasBorder>")
+        parts.append("<tr><th>公司代號</th><th>公司名稱</th></tr>")
+        parts.append("<tr><th>營業收入<br>當月營收</th></tr>")
+        parts.append("<tr><th>累計營業收入</th><!-- 註 --></tr>")
+        parts.append("<tr><th>備註</th></tr></p>")
+        parts.extend(make_row(rng, 1000 + industry * 100 + i, sep) for i in range(rows))
+        parts.append("<tr><th>合計</th><td>1,000</td></tr>")
+        parts.append("</table></td></tr></table>")
+    parts.append("</td></tr></table></center><table><tr><td>footer</td></tr></table>")
+    parts.append("</body></html>")
+    return sep.join(parts)
+
+
+PAGES = {
+    "clean": make_page(0),
+    "whitespace": make_page(1, sep="\r\n    "),
+    "unclosed": make_page(2).replace("</td>", "").replace("</tr>", ""),
+    "no_table": "<html><body><p>查無資料</p></body></html>",
+}
+
+
+@pytest.mark.parametrize("name", PAGES)
+@pytest.mark.parametrize("chunk_size", [1, 7, 1 << 16])
+def test_stream_matches_soup(name: str, chunk_size: int) -> None:
+    text = PAGES[name]
+    assert extract_rows_stream(text, chunk_size) == extract_rows_soup(text)
+
+
+def test_table_without_rows() -> None:
+    # BeautifulSoup fails on `big_table.tr.td`, the stream has no rows
+    text = "<html><body><table></table><table><tr><td>x</td></tr></table></body>"
+    with pytest.raises(AttributeError):
+        extract_rows_soup(text)
+    assert extract_rows_stream(text) == []
+
+
+def test_rows() -> None:
+    rows = {row[0]: row for row in extract_rows_stream(PAGES["clean"])}
+    assert {str(1000 + i * 100 + j) for i in range(3) for j in range(20)} <= set(rows)
+    row = rows["1000"]
+    assert len(row) == 11
+    assert row[1] == "公司&1000"
+    assert row[2].isdigit() and row[7].isdigit()
+    assert row[6] == ""
+
+
+def test_big5_page() -> None:
+    # Pages are decoded from Big5 before they're extracted
+    text = make_page(3).encode("big5", errors="replace").decode("big5")
+    assert extract_rows_stream(text) == extract_rows_soup(text)
@@ -0,0 +1,29 @@
+from typing import Any
+
+from crn.followers import get_followed_stocks
+from crn.models import Stock, User
+
+
+def test_get_followed_stocks_pages(run_with_db: Any) -> None:
+    async def main() -> None:
+        await Stock.bulk_create(
+            [Stock(id=str(1000 + i), name=f"公司{i}") for i in range(30)]
+        )
+        user, other = await User.create(id="U1"), await User.create(id="U2")
+        await user.stocks.add(*await Stock.filter(id__in=["1003", "1001", "1012"]))
+        await other.stocks.add(*await Stock.all())
+
+        stocks = await get_followed_stocks(user, 0, 2)
+        assert [stock.id for stock in stocks] == ["1001", "1003"]
+        stocks = await get_followed_stocks(user, 2, 2)
+        assert [stock.id for stock in stocks] == ["1012"]
+        assert stocks[0].revenue_report is None
+
+        # By id or name
+        stocks = await get_followed_stocks(user, 0, 10, "12")
+        assert [stock.id for stock in stocks] == ["1012"]
+        stocks = await get_followed_stocks(user, 0, 10, "公司3")
+        assert [stock.id for stock in stocks] == ["1003"]
+        assert await get_followed_stocks(user, 0, 10, "1002") == []
+
+    run_with_db(main)
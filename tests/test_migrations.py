@@ -0,0 +1,170 @@
+import sqlite3
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+import pytest
+from tortoise import Tortoise
+
+from crn.followers import get_followed_stocks
+from crn.models import RevenueReport, Stock, User
+from crn.sqlite import ImmediateSqliteClient
+
+# Schema of the first release, before any migration
+BASELINE_SCHEMA = """
+CREATE TABLE "revenuereport" (
+    "id" INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+    "industry" VARCHAR(100) NOT NULL,
+    "current_month_revenue" BIGINT NOT NULL,
+    "last_month_revenue" BIGINT NOT NULL,
+    "last_year_current_month_revenue" BIGINT NOT NULL,
+    "last_month_diff" REAL NOT NULL,
+    "last_year_current_month_diff" REAL NOT NULL,
+    "current_month_accum_revenue" BIGINT NOT NULL,
+    "last_year_accum_revenue" BIGINT NOT NULL,
+    "last_season_diff" REAL NOT NULL,
+    "notes" TEXT
+);
+CREATE TABLE "stock" (
+    "id" VARCHAR(10) NOT NULL  PRIMARY KEY,
+    "name" VARCHAR(255) NOT NULL,
+    "revenue_report_id" INT  UNIQUE REFERENCES "revenuereport" ("id") ON DELETE CASCADE
+);
+CREATE TABLE "user" (
+    "id" VARCHAR(33) NOT NULL  PRIMARY KEY,
+    "line_notify_token" VARCHAR(255),
+    "line_notify_state" VARCHAR(255),
+    "temp_data" TEXT
+);
+CREATE TABLE "user_stock" (
+    "user_id" VARCHAR(33) NOT NULL REFERENCES "user" ("id") ON DELETE CASCADE,
+    "stock_id" VARCHAR(10) NOT NULL REFERENCES "stock" ("id") ON DELETE CASCADE
+);
+INSERT INTO "revenuereport" VALUES (1, '', 1, 2, 3, 0.5, 1.5, 4, 5, 2.5, NULL);
+INSERT INTO "stock" VALUES ('2330', '台積電', 1), ('2317', '鴻海', NULL);
+INSERT INTO "user" VALUES ('U1', 'token', NULL, NULL);
+INSERT INTO "user_stock" VALUES ('U1', '2330'), ('U1', '2317');
+"""
+
+
+def test_migrate_baseline_database(run_with_db: Any, tmp_path: Path) -> None:
+    with sqlite3.connect(tmp_path / "test.sqlite3") as db:
+        db.executescript(BASELINE_SCHEMA)
+
+    async def main() -> None:
+        conn = Tortoise.get_connection("default")
+        _, rows = await conn.execute_query(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'stock'"
+        )
+        assert "ON DELETE SET NULL" in rows[0]["sql"]
+        _, rows = await conn.execute_query("PRAGMA foreign_key_check")
+        assert not rows
+
+        # Rows and follows are kept, the report belongs to the current period
+        stock = await Stock.get(id="2330").prefetch_related("revenue_report")
+        assert stock.name == "台積電"
+        assert stock.revenue_report.stock_id == "2330"
+        user = await User.get(id="U1").prefetch_related("stocks")
+        assert sorted(s.id for s in user.stocks) == ["2317", "2330"]
+
+        # Deleting a report no longer deletes its stock
+        await RevenueReport.filter(id=1).delete()
+        stock = await Stock.get(id="2330")
+        assert stock.revenue_report_id is None  # type: ignore
+        assert await Stock.filter(users__id="U1").count() == 2
+
+    run_with_db(main)
+
+
+def test_migrate_is_idempotent(run_with_db: Any, tmp_path: Path) -> None:
+    with sqlite3.connect(tmp_path / "test.sqlite3") as db:
+        db.executescript(BASELINE_SCHEMA)
+
+    async def count_stocks() -> int:
+        return await Stock.all().count()
+
+    assert run_with_db(count_stocks) == 2
+    assert run_with_db(count_stocks) == 2
+
+
+async def explain_queries(
+    monkeypatch: pytest.MonkeyPatch, func: Callable[[], Awaitable[Any]]
+) -> List[List[str]]:
+    """EXPLAIN QUERY PLAN of every statement `func` runs"""
+    statements: List[Tuple[str, Any]] = []
+    execute_query = ImmediateSqliteClient.execute_query
+
+    async def record(self, query, values=None):  # type: ignore
+        statements.append((query, values))
+        return await execute_query(self, query, values)
+
+    with monkeypatch.context() as m:
+        m.setattr(ImmediateSqliteClient, "execute_query", record)
+        await func()
+
+    conn = Tortoise.get_connection("default")
+    plans = []
+    for query, values in statements:
+        _, rows = await conn.execute_query(f"EXPLAIN QUERY PLAN {query}", values)
+        plans.append([row["detail"] for row in rows])
+    return plans
+
+
+def test_hot_queries_use_indexes(
+    run_with_db: Any, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    async def main() -> None:
+        await Stock.bulk_create(
+            [Stock(id=str(1000 + i), name=f"公司{i}") for i in range(100)]
+        )
+        await User.bulk_create(
+            [User(id=f"U{i}", line_notify_state=f"state-{i}") for i in range(100)]
+        )
+        user, stock = await User.get(id="U1"), await Stock.get(id="1001")
+        await user.stocks.add(stock)
+
+        hot_queries: Dict[str, Tuple[Callable[[], Awaitable[Any]], str]] = {
+            "LINE Notify callback": (
+                lambda: User.get_or_none(line_notify_state="state-1"),
+                "idx_user_line_notify_state",
+            ),
+            "stock by name": (
+                lambda: Stock.filter(name="公司1").first(),
+                "idx_stock_name",
+            ),
+            "list_companies": (
+                lambda: get_followed_stocks(user, 0, 11, "1"),
+                "idx_user_stock_user_stock",
+            ),
+            "followers of a stock": (
+                lambda: stock.users.all(),
+                "idx_user_stock_stock_user",
+            ),
+            "prefetch followers": (
+                lambda: Stock.filter(id__in=["1001", "1002"]).prefetch_related("users"),
+                "idx_user_stock_stock_user",
+            ),
+            "unfollow": (
+                lambda: user.stocks.remove(stock),
+                "idx_user_stock_stock_user",
+            ),
+            "latest report of a stock": (
+                lambda: RevenueReport.filter(stock_id="1001")
+                .order_by("-roc_year", "-month")
+                .first(),
+                "uid_revenuereport_stock_period",
+            ),
+            "reports of a period": (
+                lambda: RevenueReport.filter(roc_year=112, month=9),
+                "idx_revenuereport_period",
+            ),
+        }
+        for name, (func, index) in hot_queries.items():
+            plans = await explain_queries(monkeypatch, func)
+            details = [detail for plan in plans for detail in plan]
+            assert any(index in detail for detail in details), (name, details)
+            assert not any(detail.startswith("SCAN") for detail in details), (
+                name,
+                details,
+            )
+
+    run_with_db(main)
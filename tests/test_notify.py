@@ -0,0 +1,364 @@
+import asyncio
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import aiohttp
+from aiohttp import web
+
+from crn.cache import UserCache
+from crn.models import PendingNotification, RevenueReport, Stock, User
+from crn.notify import (
+    Notification,
+    NotifyDispatcher,
+    Outbox,
+    pack_sections,
+    split_message,
+)
+
+# (token, message) -> (status, headers), 200 when None
+Responder = Callable[[str, str], Optional[Tuple[int, Dict[str, str]]]]
+
+
+class NotifyStub:
+    """Records LINE Notify requests and answers them with `respond`"""
+
+    def __init__(self, respond: Optional[Responder] = None) -> None:
+        self.respond = respond
+        self.received: List[Tuple[str, str]] = []
+        self.statuses: List[int] = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        # Seconds to wait before answering a message
+        self.delay: Callable[[str], float] = lambda message: 0.0
+        self.app = web.Application()
+        self.app.router.add_post("/notify", self._notify)
+        self.runner = web.AppRunner(self.app, access_log=None)
+
+    async def _notify(self, request: web.Request) -> web.Response:
+        token = request.headers["Authorization"].removeprefix("Bearer ")
+        message = str((await request.post())["message"])
+        self.received.append((token, message))
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay(message))
+        finally:
+            self.in_flight -= 1
+        status, headers = (self.respond and self.respond(token, message)) or (200, {})
+        self.statuses.append(status)
+        return web.json_response({"status": status}, status=status, headers=headers)
+
+    async def start(self) -> str:
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        host, port = site._server.sockets[0].getsockname()[:2]  # type: ignore
+        return f"http://{host}:{port}/notify"
+
+
+async def with_dispatcher(
+    stub: NotifyStub, func: Callable[[NotifyDispatcher], Any], **kwargs: Any
+) -> Any:
+    url = await stub.start()
+    try:
+        async with aiohttp.ClientSession() as session:
+            kwargs = {
+                "retries": 0,
+                "backoff": 0.0,
+                "rate": 1e6,
+                "burst": 1000,
+                **kwargs,
+            }
+            return await func(NotifyDispatcher(session, url=url, **kwargs))
+    finally:
+        await stub.runner.cleanup()
+
+
+async def drain(stub: NotifyStub, batches: int = 1, **kwargs: Any) -> List[int]:
+    """Drain the outbox against the stub, returns the rows removed by each batch"""
+
+    async def func(dispatcher: NotifyDispatcher) -> List[int]:
+        outbox = Outbox(dispatcher, **kwargs)
+        return [await outbox.drain_batch() for _ in range(batches)]
+
+    return await with_dispatcher(stub, func)
+
+
+async def seed(
+    users: Dict[str, bool], stock_ids: List[str], text_length: int = 20
+) -> None:
+    """Users by id with their digest setting, each with a notification per stock"""
+    for stock_id in stock_ids:
+        stock = await Stock.create(id=stock_id, name=f"股票{stock_id}")
+        report = await RevenueReport.create(
+            stock_id=stock_id,
+            roc_year=112,
+            month=9,
+            industry="",
+            current_month_revenue=1,
+            last_month_revenue=1,
+            last_year_current_month_revenue=1,
+            last_month_diff=0,
+            last_year_current_month_diff=0,
+            current_month_accum_revenue=1,
+            last_year_accum_revenue=1,
+            last_season_diff=0,
+            message=stock_id + "-" * (text_length - len(stock_id)),
+        )
+        stock.revenue_report = report
+        await stock.save()
+    for user_id, digest in users.items():
+        await User.create(
+            id=user_id,
+            line_notify_token=f"token-{user_id}",
+            digest_notifications=digest,
+        )
+    for user_id in users:
+        for stock_id in stock_ids:
+            stock = await Stock.get(id=stock_id)
+            await PendingNotification.create(
+                user_id=user_id, stock_id=stock_id, report_id=stock.revenue_report_id
+            )
+
+
+def get_stock_ids(message: str) -> List[str]:
+    return [line[:4] for line in message.splitlines() if line[:4].isdigit()]
+
+
+def test_pack_sections() -> None:
+    packed = pack_sections(["a" * 4, "b" * 4, "c" * 3, "d" * 12], limit=10)
+
+    assert packed == [
+        ("aaaabbbb", {0, 1}),
+        ("ccc", {2}),
+        ("d" * 10, {3}),
+        ("dd", {3}),
+    ]
+    assert split_message(["a" * 4, "b" * 4, "c" * 3, "d" * 12], limit=10) == [
+        message for message, _ in packed
+    ]
+
+
+def test_digest_users_get_one_split_message(run_with_db: Any) -> None:
+    stock_ids = [str(1101 + i) for i in range(40)]
+    stub = NotifyStub()
+
+    async def main() -> Tuple[List[int], int]:
+        await seed({"digest": True, "single": False}, stock_ids, text_length=100)
+        return await drain(stub), await PendingNotification.all().count()
+
+    assert run_with_db(main) == ([80], 0)
+    digest = [message for token, message in stub.received if token == "token-digest"]
+    single = [message for token, message in stub.received if token == "token-single"]
+    # 40 texts of about 100 characters fit in 5 messages of at most 1000
+    assert len(digest) == 5
+    assert all(len(message) <= 1000 for message in digest)
+    assert "彙整" in digest[0]
+    assert sorted(sum(map(get_stock_ids, digest), [])) == stock_ids
+    assert len(single) == 40
+
+
+def test_partly_sent_digest_only_retries_unsent_part(run_with_db: Any) -> None:
+    stock_ids = [str(1101 + i) for i in range(40)]
+    failures = [True]
+
+    def respond(token: str, message: str) -> Optional[Tuple[int, Dict[str, str]]]:
+        # The message with 1120 fails once
+        if "1120" in get_stock_ids(message) and failures:
+            failures.pop()
+            return 429, {}
+        return None
+
+    stub = NotifyStub(respond)
+
+    async def main() -> List[int]:
+        await seed({"digest": True}, stock_ids, text_length=100)
+        return await drain(stub, batches=2)
+
+    first, second = run_with_db(main)
+    assert len(stub.received) == 6
+    failed = get_stock_ids(stub.received[-1][1])
+    assert "1120" in failed
+    assert (first, second) == (40 - len(failed), len(failed))
+    # Every report was delivered once
+    delivered = [
+        stock_id
+        for (_, message), status in zip(stub.received, stub.statuses)
+        if status == 200
+        for stock_id in get_stock_ids(message)
+    ]
+    assert sorted(delivered) == stock_ids
+
+
+def test_turning_on_digest_groups_next_batch(run_with_db: Any) -> None:
+    stub = NotifyStub()
+
+    async def main() -> None:
+        await seed({"U1": False}, ["1101", "1102", "1103"])
+        # What set_digest_notifications does
+        cache = UserCache()
+        await cache.update(await cache.get("U1"), digest_notifications=True)
+        assert await drain(stub) == [3]
+
+    run_with_db(main)
+    assert len(stub.received) == 1
+    assert get_stock_ids(stub.received[0][1]) == ["1101", "1102", "1103"]
+
+
+def respond_by_token(statuses: Dict[str, int]) -> Responder:
+    """Answer with the status of the token, 200 for the others"""
+    return lambda token, message: (statuses.get(token, 200), {})
+
+
+def test_sent_and_rejected_rows_are_deleted(run_with_db: Any) -> None:
+    stub = NotifyStub(respond_by_token({"token-revoked": 401, "token-bad": 400}))
+
+    async def main() -> Tuple[List[int], int]:
+        await seed({"ok": False, "revoked": False, "bad": False}, ["1101", "1102"])
+        return await drain(stub), await PendingNotification.all().count()
+
+    assert run_with_db(main) == ([6], 0)
+    assert sorted(stub.statuses) == [200, 200, 400, 400, 401, 401]
+
+
+def test_transient_failures_are_retried_until_max_attempts(run_with_db: Any) -> None:
+    stub = NotifyStub(respond_by_token({"token-busy": 429, "token-down": 503}))
+
+    async def main() -> None:
+        await seed({"ok": False, "busy": False, "down": False}, ["1101", "1102"])
+
+        assert await drain(stub, max_attempts=3) == [2]
+        attempts = await PendingNotification.all().values_list("user_id", "attempts")
+        assert sorted(attempts) == [("busy", 1)] * 2 + [("down", 1)] * 2
+
+        assert await drain(stub, max_attempts=3) == [0]
+        assert set(
+            await PendingNotification.all().values_list("attempts", flat=True)
+        ) == {2}
+
+        # The third attempt is the last one
+        assert await drain(stub, max_attempts=3) == [4]
+        assert await PendingNotification.all().count() == 0
+
+    run_with_db(main)
+    assert len(stub.received) == 2 + 4 * 3
+
+
+def test_rows_of_users_without_a_token_are_dropped(run_with_db: Any) -> None:
+    stub = NotifyStub()
+
+    async def main() -> Tuple[List[int], int]:
+        await seed({"U1": False, "U2": True}, ["1101", "1102"])
+        await User.filter(id__in=["U1", "U2"]).update(line_notify_token=None)
+        return await drain(stub), await PendingNotification.all().count()
+
+    assert run_with_db(main) == ([4], 0)
+    assert stub.received == []
+
+
+def test_batches_are_drained_in_order(run_with_db: Any) -> None:
+    stub = NotifyStub()
+    stock_ids = [str(1101 + i) for i in range(5)]
+
+    async def main() -> Tuple[List[int], int]:
+        await seed({"U1": False}, stock_ids)
+        return (
+            await drain(stub, batches=3, batch_size=2),
+            await PendingNotification.all().count(),
+        )
+
+    assert run_with_db(main) == ([2, 2, 1], 0)
+    assert [get_stock_ids(message)[0] for _, message in stub.received] == stock_ids
+
+
+def test_transient_failures_are_retried() -> None:
+    statuses = [503, 429, 200]
+    stub = NotifyStub(lambda token, message: (statuses.pop(0), {}))
+
+    async def main(dispatcher: NotifyDispatcher) -> Any:
+        stats = await dispatcher.dispatch([Notification("token", "hi")])
+        return stats.results, stats.retries, stats.sent
+
+    assert asyncio.run(with_dispatcher(stub, main, retries=3)) == ([200], 2, 1)
+    assert len(stub.received) == 3
+
+
+def test_retries_are_limited() -> None:
+    stub = NotifyStub(lambda token, message: (500, {}))
+
+    async def main(dispatcher: NotifyDispatcher) -> Any:
+        stats = await dispatcher.dispatch([Notification("token", "hi")])
+        return stats.results, stats.retries
+
+    assert asyncio.run(with_dispatcher(stub, main, retries=2)) == ([500], 2)
+    assert len(stub.received) == 3
+
+
+def test_exhausted_quota_delays_next_send() -> None:
+    reset = time.time() + 0.5
+
+    def respond(token: str, message: str) -> Tuple[int, Dict[str, str]]:
+        headers = {"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": str(reset)}
+        return 200, headers if message == "first" else {}
+
+    stub = NotifyStub(respond)
+
+    async def main(dispatcher: NotifyDispatcher) -> Any:
+        await dispatcher.send(Notification("token", "first"))
+        # Other tokens have their own quota
+        start = time.monotonic()
+        assert await dispatcher.send(Notification("other", "second")) == 200
+        assert time.monotonic() - start < 0.2
+        assert await dispatcher.send(Notification("token", "third")) == 200
+        return time.time()
+
+    sent = asyncio.run(with_dispatcher(stub, main, max_wait=5.0))
+    assert sent >= reset
+    assert len(stub.received) == 3
+
+
+def test_exhausted_quota_past_max_wait_gives_429() -> None:
+    reset = time.time() + 3600
+
+    def respond(token: str, message: str) -> Tuple[int, Dict[str, str]]:
+        return 200, {"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": str(reset)}
+
+    stub = NotifyStub(respond)
+
+    async def main(dispatcher: NotifyDispatcher) -> Any:
+        stats = await dispatcher.dispatch(
+            [Notification("token", "first"), Notification("token", "second")]
+        )
+        return stats.results
+
+    assert asyncio.run(with_dispatcher(stub, main, workers=1)) == [200, 429]
+    assert [message for _, message in stub.received] == ["first"]
+
+
+def test_results_keep_input_order() -> None:
+    def respond(token: str, message: str) -> Tuple[int, Dict[str, str]]:
+        return (400 if int(message) % 3 == 0 else 200), {}
+
+    stub = NotifyStub(respond)
+    # Later messages are answered sooner
+    stub.delay = lambda message: (50 - int(message)) / 1000
+    notifications = [Notification(f"token-{i}", str(i)) for i in range(50)]
+
+    async def main(dispatcher: NotifyDispatcher) -> Any:
+        return (await dispatcher.dispatch(notifications)).results
+
+    assert asyncio.run(with_dispatcher(stub, main, workers=8)) == [
+        400 if i % 3 == 0 else 200 for i in range(50)
+    ]
+
+
+def test_workers_bound_concurrent_requests() -> None:
+    stub = NotifyStub()
+    stub.delay = lambda message: 0.02
+    notifications = [Notification(f"token-{i}", str(i)) for i in range(40)]
+
+    async def main(dispatcher: NotifyDispatcher) -> Any:
+        return (await dispatcher.dispatch(notifications)).sent
+
+    assert asyncio.run(with_dispatcher(stub, main, workers=4)) == 40
+    assert stub.max_in_flight == 4
@@ -0,0 +1,98 @@
+import random
+from typing import Any, List, Tuple
+
+import pytest
+
+from crn.models import RevenueReport
+from crn.parse import COLUMNS, RowError, parse_reports
+
+FIELDS = (
+    "industry",
+    "current_month_revenue",
+    "last_month_revenue",
+    "last_year_current_month_revenue",
+    "last_month_diff",
+    "last_year_current_month_diff",
+    "current_month_accum_revenue",
+    "last_year_accum_revenue",
+    "last_season_diff",
+    "notes",
+)
+
+
+def make_row(rng: random.Random, stock_id: int) -> List[str]:
+    def number() -> str:
+        return rng.choice(("", "0", str(rng.randrange(10**9))))
+
+    def percent() -> str:
+        return rng.choice(("", "0", f"{rng.uniform(-99, 999):.2f}"))
+
+    return [
+        str(stock_id),
+        f"公司{stock_id}",
+        str(rng.randrange(10**9)),
+        number(),
+        number(),
+        percent(),
+        percent(),
+        number(),
+        number(),
+        percent(),
+        rng.choice(("-", "新產品出貨")),
+    ]
+
+
+def get_fields(report: RevenueReport) -> Tuple[Any, ...]:
+    return tuple(getattr(report, field) for field in FIELDS)
+
+
+def test_matches_reference_parser() -> None:
+    rng = random.Random(0)
+    rows = [make_row(rng, 1000 + i) for i in range(200)]
+    # A note split by <br> into two strings
+    rows.append(make_row(rng, 9999)[:-1] + ["因應疫情", "營收減少"])
+
+    batch = parse_reports(rows)
+
+    assert batch.errors == []
+    assert batch.stock_ids == [strings[0] for strings in rows]
+    assert batch.stock_names == [strings[1] for strings in rows]
+    assert [get_fields(batch.get_report(i)) for i in range(len(batch))] == [
+        get_fields(RevenueReport.parse(strings)) for strings in rows
+    ]
+    assert batch.notes[-1] == "因應疫情"
+
+
+@pytest.mark.parametrize(
+    "strings, error",
+    [
+        (["公司代號", "公司名稱"], f"expected {COLUMNS} columns, got 2"),
+        ([], f"expected {COLUMNS} columns, got 0"),
+        ([""] + ["0"] * (COLUMNS - 1), "missing stock id"),
+        (["2330", "台積電", "不適用"] + ["0"] * 8, "invalid literal"),
+        (["2330", "台積電", "1", "1", "1", "N/A"] + ["0"] * 5, "could not convert"),
+    ],
+)
+def test_malformed_rows_are_recorded(strings: List[str], error: str) -> None:
+    rng = random.Random(1)
+    rows = [make_row(rng, 1101), strings, make_row(rng, 1102)]
+
+    batch = parse_reports(rows)
+
+    assert batch.stock_ids == ["1101", "1102"]
+    assert [get_fields(batch.get_report(i)) for i in range(len(batch))] == [
+        get_fields(RevenueReport.parse(rows[0])),
+        get_fields(RevenueReport.parse(rows[2])),
+    ]
+    assert len(batch.errors) == 1
+    assert batch.errors[0][:2] == (1, strings[0] if strings else "")
+    assert error in batch.errors[0].error
+    # The numeric columns of the skipped row were dropped
+    assert all(len(column) == 2 for column in batch.numeric_columns())
+
+
+def test_row_error_fields() -> None:
+    batch = parse_reports([["1101", "台泥"]])
+
+    assert batch.errors == [RowError(0, "1101", f"expected {COLUMNS} columns, got 2")]
+    assert len(batch) == 0
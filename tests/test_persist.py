@@ -0,0 +1,80 @@
+from typing import Any, List
+
+import pytest
+
+from crn.crawl import CrawledReport
+from crn.models import BackfilledPage, RevenueReport, Stock
+from crn.persist import save_report_history, save_revenue_reports
+
+PERIOD = (112, 9)
+
+
+def make_crawled(stock_ids: List[str]) -> List[CrawledReport]:
+    return [
+        CrawledReport(
+            stock_id,
+            f"name-{stock_id}",
+            RevenueReport.parse(
+                [stock_id, f"name-{stock_id}", stock_id, "1", "2", "3.5", "-1.5"]
+                + ["4", "5", "0.5", "-"]
+            ),
+        )
+        for stock_id in stock_ids
+    ]
+
+
+def test_reports_linked_by_stock_with_concurrent_writer(
+    run_with_db: Any, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    stock_ids = [str(1000 + i) for i in range(20)]
+    bulk_create = RevenueReport.bulk_create.__func__  # type: ignore
+
+    async def bulk_create_with_backfill(cls, objects, *args, **kwargs):  # type: ignore
+        # Another writer, e.g. the backfill on Postgres, inserts reports of a
+        # past period while the crawl's transaction is open
+        backfilled = make_crawled(stock_ids[::-1])
+        for c in backfilled:
+            c.report.stock_id, c.report.roc_year, c.report.month = c.stock_id, 111, 1
+        await bulk_create(
+            cls, [c.report for c in backfilled], using_db=kwargs.get("using_db")
+        )
+        return await bulk_create(cls, objects, *args, **kwargs)
+
+    async def main() -> None:
+        monkeypatch.setattr(
+            RevenueReport, "bulk_create", classmethod(bulk_create_with_backfill)
+        )
+        saved = await save_revenue_reports(make_crawled(stock_ids), period=PERIOD)
+        monkeypatch.undo()
+
+        assert len(saved) == len(stock_ids)
+        for stock in await Stock.all().prefetch_related("revenue_report"):
+            report = stock.revenue_report
+            assert report.stock_id == stock.id
+            assert (report.roc_year, report.month) == PERIOD
+            assert stock.revenue_report.message.startswith(str(stock))
+
+    run_with_db(main)
+
+
+def test_report_history_skips_stocks_created_concurrently(
+    run_with_db: Any, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    filter_ = Stock.filter.__func__  # type: ignore
+
+    async def main() -> None:
+        # The bot creates the stock after the backfill looked it up
+        monkeypatch.setattr(
+            Stock, "filter", classmethod(lambda cls, *a, **kw: filter_(cls, id="-"))
+        )
+        await Stock.create(id="1000", name="name-1000")
+        saved = await save_report_history(
+            111, 1, make_crawled(["1000", "1001"]), BackfilledPage(url="page")
+        )
+        monkeypatch.undo()
+
+        assert saved == 2
+        assert await Stock.all().count() == 2
+        assert await BackfilledPage.filter(url="page", reports=2).exists()
+
+    run_with_db(main)
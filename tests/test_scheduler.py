@@ -0,0 +1,202 @@
+import asyncio
+import datetime
+from typing import List, Optional
+
+import pytest
+
+from crn.scheduler import CronSchedule, Job, Scheduler, parse_cron_field
+
+# A Friday, 2023-09-01 was the first day of the 112/8 filing season
+START = datetime.datetime(2023, 9, 1, 0, 0)
+MINUTE = datetime.timedelta(minutes=1)
+
+
+class FakeClock:
+    def __init__(self, now: datetime.datetime) -> None:
+        self.now = now
+
+    def __call__(self) -> datetime.datetime:
+        return self.now
+
+
+def simulate(scheduler: Scheduler, clock: FakeClock, until: datetime.datetime) -> None:
+    """Tick once a minute until `until`, each tick's jobs finish before the next"""
+
+    async def main() -> None:
+        while clock.now < until:
+            scheduler.tick()
+            await scheduler.wait()
+            clock.now += MINUTE
+
+    asyncio.run(main())
+
+
+def get_intervals(runs: List[datetime.datetime]) -> List[int]:
+    return [(b - a) // MINUTE for a, b in zip(runs, runs[1:])]
+
+
+def test_parse_cron_field() -> None:
+    assert parse_cron_field("*", 0, 6) == set(range(7))
+    assert parse_cron_field("*/15", 0, 59) == {0, 15, 30, 45}
+    assert parse_cron_field("7-22", 0, 23) == set(range(7, 23))
+    assert parse_cron_field("1-15/7", 1, 31) == {1, 8, 15}
+    assert parse_cron_field("5/20", 0, 59) == {5, 25, 45}
+    assert parse_cron_field("0,30,45", 0, 59) == {0, 30, 45}
+
+
+@pytest.mark.parametrize(
+    "expression", ["* * * *", "60 * * * *", "* 5-3 * * *", "*/0 * * * *", "a * * * *"]
+)
+def test_invalid_cron_expression(expression: str) -> None:
+    with pytest.raises(ValueError):
+        CronSchedule(expression)
+
+
+def test_cron_matches() -> None:
+    schedule = CronSchedule("*/5 7-22 1-15 * *")
+    assert schedule.matches(START.replace(hour=7, minute=55))
+    assert not schedule.matches(START.replace(hour=7, minute=56))
+    assert not schedule.matches(START.replace(hour=23))
+    assert not schedule.matches(START.replace(day=16, hour=7))
+
+    # 2023-09-03 is a Sunday, day of week 0
+    weekdays = CronSchedule("0 9 * * 1-5")
+    assert weekdays.matches(START.replace(hour=9))
+    assert not weekdays.matches(START.replace(day=3, hour=9))
+    assert CronSchedule("0 9 * * 0").matches(START.replace(day=3, hour=9))
+
+
+def test_cron_job_runs_once_per_match() -> None:
+    clock = FakeClock(START)
+    runs: List[datetime.datetime] = []
+
+    async def roll_over() -> None:
+        runs.append(clock.now)
+
+    scheduler = Scheduler(clock)
+    scheduler.add_job(Job("roll_over", roll_over, CronSchedule("0 0 1 * *")))
+    simulate(scheduler, clock, START + datetime.timedelta(days=40))
+    assert runs == [START, datetime.datetime(2023, 10, 1)]
+
+
+def test_duplicate_job() -> None:
+    async def func() -> None:
+        pass
+
+    scheduler = Scheduler()
+    scheduler.add_job(Job("job", func, CronSchedule("* * * * *")))
+    with pytest.raises(ValueError):
+        scheduler.add_job(Job("job", func, CronSchedule("* * * * *")))
+
+
+def test_no_overlapping_runs() -> None:
+    clock = FakeClock(START)
+    scheduler = Scheduler(clock)
+    started = 0
+    release = asyncio.Event()
+
+    async def crawl() -> bool:
+        nonlocal started
+        started += 1
+        await release.wait()
+        return False
+
+    scheduler.add_job(Job("crawl", crawl, CronSchedule("* * * * *")))
+
+    async def main() -> None:
+        for _ in range(10):
+            scheduler.tick()
+            await asyncio.sleep(0)
+            clock.now += MINUTE
+        assert started == 1
+        assert scheduler.jobs["crawl"].running
+
+        release.set()
+        await scheduler.wait()
+        assert not scheduler.jobs["crawl"].running
+        assert [job.name for job in scheduler.tick()] == ["crawl"]
+        await scheduler.wait()
+        assert started == 2
+
+    asyncio.run(main())
+
+
+def test_failed_job_runs_again() -> None:
+    clock = FakeClock(START)
+    scheduler = Scheduler(clock)
+    runs = 0
+
+    async def crawl() -> bool:
+        nonlocal runs
+        runs += 1
+        raise RuntimeError("MOPS is down")
+
+    scheduler.add_job(Job("crawl", crawl, CronSchedule("* * * * *")))
+    simulate(scheduler, clock, START + 3 * MINUTE)
+    assert runs == 3
+
+
+def make_crawl_job(
+    clock: FakeClock, runs: List[datetime.datetime], new_at: List[datetime.datetime]
+) -> Job:
+    async def crawl() -> Optional[bool]:
+        runs.append(clock.now)
+        return clock.now in new_at
+
+    return Job(
+        "crawl",
+        crawl,
+        CronSchedule("* 7-22 1-15 * *"),
+        min_interval=datetime.timedelta(minutes=5),
+        max_interval=datetime.timedelta(minutes=60),
+        peak=CronSchedule("* 8-18 5-10 * *"),
+        peak_interval=datetime.timedelta(minutes=10),
+    )
+
+
+def test_interval_doubles_up_to_max() -> None:
+    clock = FakeClock(START)
+    runs: List[datetime.datetime] = []
+    scheduler = Scheduler(clock)
+    scheduler.add_job(make_crawl_job(clock, runs, []))
+    simulate(scheduler, clock, START + datetime.timedelta(days=2))
+
+    # Two days outside the peak, 07:00 to 22:59, nothing new is found
+    day_one = [run for run in runs if run.day == 1]
+    assert day_one[0] == START.replace(hour=7)
+    assert get_intervals(day_one) == [10, 20, 40] + [60] * 14
+    assert all(7 <= run.hour <= 22 for run in runs)
+    # The first run of the next day is at the start of the schedule
+    day_two = [run for run in runs if run.day == 2]
+    assert day_two[0] == START.replace(day=2, hour=7)
+    assert get_intervals(day_two) == [60] * 15
+
+
+def test_interval_reset_when_new_reports_are_found() -> None:
+    clock = FakeClock(START)
+    runs: List[datetime.datetime] = []
+    found = START.replace(hour=9, minute=10)
+    scheduler = Scheduler(clock)
+    scheduler.add_job(make_crawl_job(clock, runs, [found]))
+    simulate(scheduler, clock, START.replace(hour=13))
+
+    assert found in runs
+    after = runs[runs.index(found) :]
+    assert get_intervals(after)[:5] == [5, 10, 20, 40, 60]
+
+
+def test_peak_caps_interval() -> None:
+    # 2023-09-05 is in the peak, the interval is capped from 08:00 to 18:59
+    start = START.replace(day=5)
+    clock = FakeClock(start)
+    runs: List[datetime.datetime] = []
+    scheduler = Scheduler(clock)
+    scheduler.add_job(make_crawl_job(clock, runs, []))
+    simulate(scheduler, clock, start + datetime.timedelta(days=1))
+
+    peak = [run for run in runs if 8 <= run.hour <= 18]
+    assert peak[0] == start.replace(hour=8)
+    assert set(get_intervals(peak)) == {10}
+    assert peak[-1] == start.replace(hour=18, minute=50)
+    # Back to the doubled interval after the peak
+    assert get_intervals([run for run in runs if run.hour >= 18])[-4:] == [60] * 4
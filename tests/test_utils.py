@@ -0,0 +1,109 @@
+import asyncio
+from typing import List
+
+import pytest
+
+from crn.utils import SingleFlight
+
+
+def test_concurrent_callers_share_one_call() -> None:
+    flight: SingleFlight[str, int] = SingleFlight()
+    calls = 0
+
+    async def fetch() -> int:
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return 42
+
+    async def main() -> List[int]:
+        return await asyncio.gather(*(flight.do("2330", fetch) for _ in range(100)))
+
+    assert asyncio.run(main()) == [42] * 100
+    assert calls == 1
+    assert flight.shared == 99
+    assert "2330" not in flight
+
+
+def test_calls_with_different_keys_run_separately() -> None:
+    flight: SingleFlight[str, str] = SingleFlight()
+    calls: List[str] = []
+
+    def make_fetch(key: str):  # type: ignore
+        async def fetch() -> str:
+            calls.append(key)
+            await asyncio.sleep(0.01)
+            return key
+
+        return fetch
+
+    async def main() -> List[str]:
+        return await asyncio.gather(
+            *(flight.do(key, make_fetch(key)) for key in ["a", "b", "a", "b"])
+        )
+
+    assert asyncio.run(main()) == ["a", "b", "a", "b"]
+    assert sorted(calls) == ["a", "b"]
+
+
+def test_exception_reaches_every_caller() -> None:
+    flight: SingleFlight[str, int] = SingleFlight()
+    calls = 0
+
+    async def fetch() -> int:
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        raise ConnectionError("stock API is down")
+
+    async def main() -> List[BaseException]:
+        return await asyncio.gather(
+            *(flight.do("2330", fetch) for _ in range(10)), return_exceptions=True
+        )
+
+    results = asyncio.run(main())
+    assert calls == 1
+    assert all(isinstance(result, ConnectionError) for result in results)
+
+
+def test_call_after_completion_runs_again() -> None:
+    flight: SingleFlight[str, int] = SingleFlight()
+    calls = 0
+
+    async def fetch() -> int:
+        nonlocal calls
+        calls += 1
+        return calls
+
+    async def main() -> List[int]:
+        return [await flight.do("2330", fetch), await flight.do("2330", fetch)]
+
+    assert asyncio.run(main()) == [1, 2]
+    assert flight.shared == 0
+
+
+def test_cancelled_caller_does_not_cancel_call() -> None:
+    flight: SingleFlight[str, int] = SingleFlight()
+
+    async def main() -> None:
+        calls = 0
+        release = asyncio.Event()
+
+        async def fetch() -> int:
+            nonlocal calls
+            calls += 1
+            await release.wait()
+            return 42
+
+        first = asyncio.create_task(flight.do("2330", fetch))
+        second = asyncio.create_task(flight.do("2330", fetch))
+        await asyncio.sleep(0)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+
+        release.set()
+        assert await second == 42
+        assert calls == 1
+
+    asyncio.run(main())